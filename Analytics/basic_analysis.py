@@ -15,10 +15,12 @@ def calculate_ineffective_energy_percentage(travel_energy_used, total_energy_use
 
 
 def average_charge_percentage(peripherals_list):
-    number_of_peripherals = len(peripherals_list)
+    return average_charge([peripheral.current_charge for peripheral in peripherals_list])
+
+
+def average_charge(charges):
+    number_of_peripherals = len(charges)
     if number_of_peripherals < 1:
         print('No peripherals found in peripherals list. Check code for errors.')
         raise AssertionError
-    total_sum_of_percentages = sum([peripheral.current_charge
-                                    for peripheral in peripherals_list])
-    return total_sum_of_percentages / number_of_peripherals
+    return sum(charges) / number_of_peripherals
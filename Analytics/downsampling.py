@@ -0,0 +1,267 @@
+import math
+
+import numpy as np
+
+from Analytics.telemetry_recorder import TelemetryRecorder, CHUNK_SIZE, load_telemetry
+
+"""
+Shape preserving downsampling of long time series, in a fixed amount of memory
+Runs last millions of cycles, far more than a plot can show. MinMaxDownsampler folds a stream of points into a fixed
+number of buckets, keeping the first, last, lowest and highest point of each, so spikes and dips survive however long
+the run is. When the buckets are full neighbouring pairs are merged and every bucket covers twice as many points from
+then on. largest_triangle_three_buckets thins the result down to what a plot needs.
+
+TelemetryDownsampler takes the place of a TelemetryRecorder in a simulation and folds every chunk of rows into a
+downsampler per series instead of keeping them, load_downsampled_telemetry does the same for a recorded run.
+"""
+
+BUCKETS = 2048  # buckets kept per series, each holds up to 4 points
+# name: description, the series folded from the telemetry rows, all over simulated time
+SERIES = {
+    'min_charge': 'lowest peripheral charge',
+    'mean_charge': 'mean peripheral charge',
+    'max_charge': 'highest peripheral charge',
+    'charger_charge': 'charge of the charger',
+    'travel_energy_used': 'travel energy used so far',
+    'transfer_energy_used': 'transfer energy used so far',
+    'energy_efficiency': 'share of the energy used so far that was transferred to peripherals',
+}
+
+
+class MinMaxDownsampler:
+    """
+    the first, last, lowest and highest point of each bucket of consecutive points
+    Every bucket covers the same number of points. x is expected not to decrease, e.g. simulated time
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        """
+        :param buckets: the number of buckets, at least 2. at most 4 points are kept per bucket
+        """
+        if buckets < 2:
+            raise ValueError('buckets must be at least 2, got {}.'.format(buckets))
+        self.buckets = buckets
+        self.width = 1  # points per bucket
+        self.count = 0  # points folded in so far
+        self.first = np.empty((buckets, 2))  # (x, y) of each bucket
+        self.last = np.empty((buckets, 2))
+        self.lowest = np.empty((buckets, 2))
+        self.highest = np.empty((buckets, 2))
+
+    def __len__(self):
+        return self.count
+
+    def add_many(self, x, y):
+        """
+        fold in a run of points, in order. points with a y of nan are skipped
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        kept = ~np.isnan(y)
+        if not kept.all():
+            x, y = x[kept], y[kept]
+        while len(x) > 0:
+            if self.count == self.buckets * self.width:
+                self._merge_pairs()
+            take = min(len(x), self.buckets * self.width - self.count)
+            self._fold(x[:take], y[:take])
+            x, y = x[take:], y[take:]
+
+    def _fold(self, x, y):
+        # the points all fit in the buckets at the current width
+        bucket_ids = (self.count + np.arange(len(x))) // self.width
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket_ids)) + 1))
+        ends = np.append(starts[1:], len(x))
+        bucket_ids = bucket_ids[starts]
+        # sorted by bucket and then by y, the first point of each bucket is its lowest
+        lowest = np.lexsort((y, bucket_ids.repeat(ends - starts)))[starts]
+        highest = np.lexsort((-y, bucket_ids.repeat(ends - starts)))[starts]
+        first = np.column_stack((x[starts], y[starts]))
+        last = np.column_stack((x[ends - 1], y[ends - 1]))
+        lowest = np.column_stack((x[lowest], y[lowest]))
+        highest = np.column_stack((x[highest], y[highest]))
+
+        if self.count % self.width:
+            # the first bucket was started by an earlier call, combine the two
+            bucket = bucket_ids[0]
+            first[0] = self.first[bucket]
+            if self.lowest[bucket, 1] <= lowest[0, 1]:
+                lowest[0] = self.lowest[bucket]
+            if self.highest[bucket, 1] >= highest[0, 1]:
+                highest[0] = self.highest[bucket]
+        self.first[bucket_ids] = first
+        self.last[bucket_ids] = last
+        self.lowest[bucket_ids] = lowest
+        self.highest[bucket_ids] = highest
+        self.count += len(x)
+
+    def _merge_pairs(self):
+        """
+        merge every bucket with its neighbour, doubling the points each one covers
+        """
+        pairs = self.buckets // 2
+        left, right = slice(0, 2 * pairs, 2), slice(1, 2 * pairs, 2)
+        self.first[:pairs] = self.first[left]
+        self.last[:pairs] = self.last[right]
+        self.lowest[:pairs] = np.where((self.lowest[left, 1] <= self.lowest[right, 1])[:, None],
+                                       self.lowest[left], self.lowest[right])
+        self.highest[:pairs] = np.where((self.highest[left, 1] >= self.highest[right, 1])[:, None],
+                                        self.highest[left], self.highest[right])
+        if self.buckets % 2:
+            # the last bucket has no neighbour and is only half full at the new width
+            for points in (self.first, self.last, self.lowest, self.highest):
+                points[pairs] = points[self.buckets - 1]
+        self.width *= 2
+
+    def get_points(self):
+        """
+        :return: x and y arrays of the points kept, in order of x
+        """
+        used = math.ceil(self.count / self.width)
+        points = np.stack((self.first[:used], self.lowest[:used], self.highest[:used], self.last[:used]), axis=1)
+        points = points.reshape(-1, 2)
+        # by x within each bucket. the buckets themselves are already in order
+        order = np.lexsort((points[:, 0], np.arange(len(points)) // 4))
+        points = points[order]
+        if len(points) > 1:
+            # the same point is often more than one of the four of a bucket
+            repeated = np.all(points[1:] == points[:-1], axis=1)
+            points = points[np.concatenate(([True], ~repeated))]
+        return points[:, 0].copy(), points[:, 1].copy()
+
+
+def largest_triangle_three_buckets(x, y, points):
+    """
+    thin a series down to a number of points that still look like it, by Steinarsson's largest triangle three
+    buckets. the first and last point are always kept
+    :param points: the number of points to keep
+    :return: x and y arrays of the points kept
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    length = len(x)
+    if points >= length or points < 3:
+        return x.copy(), y.copy()
+
+    # the points in between are split into points - 2 buckets, and each gives the point making the largest triangle
+    # with the one picked from the bucket before and the average of the bucket after
+    edges = (np.arange(points - 1) * ((length - 2) / (points - 2))).astype(np.int64) + 1
+    edges[-1] = length - 1
+    selected = np.empty(points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = length - 1
+    previous = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket == points - 3:
+            next_x, next_y = x[-1], y[-1]
+        else:
+            next_x, next_y = x[end:edges[bucket + 2]].mean(), y[end:edges[bucket + 2]].mean()
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return x[selected], y[selected]
+
+
+class TelemetryDownsampler(TelemetryRecorder):
+    """
+    takes telemetry rows like a TelemetryRecorder, and folds every chunk of them into a MinMaxDownsampler per series
+    of SERIES instead of keeping them. memory stays the same however long the run is
+    """
+
+    def __init__(self, buckets=BUCKETS, chunk_size=CHUNK_SIZE):
+        """
+        :param buckets: the number of buckets of each series
+        :param chunk_size: the number of rows buffered before they are folded in
+        """
+        super().__init__(chunk_size=chunk_size)
+        self.series = {name: MinMaxDownsampler(buckets) for name in SERIES}
+        self.travel_energy_used = 0.0
+        self.transfer_energy_used = 0.0
+        self.start_time = None
+        self.end_time = None
+
+    def flush(self):
+        """
+        fold the buffered rows into the series
+        """
+        if self.buffered == 0:
+            return
+        self.add_columns({name: buffer[:self.buffered] for name, buffer in self.buffers.items()})
+        self.rows_written += self.buffered
+        self.buffered = 0
+
+    def add_columns(self, columns):
+        """
+        fold in rows given as telemetry columns, e.g. a slice of a recorded run
+        :param columns: dict of column name: array, as TelemetryRecorder.get_columns gives them
+        """
+        time = np.asarray(columns['time'], dtype=np.float64)
+        if len(time) == 0:
+            return
+        travel_energy_used = self.travel_energy_used + np.cumsum(columns['travel_energy'])
+        transfer_energy_used = self.transfer_energy_used + np.cumsum(columns['transfer_energy'])
+        total_energy_used = travel_energy_used + transfer_energy_used
+        efficiency = np.full(len(time), np.nan)
+        np.divide(transfer_energy_used, total_energy_used, out=efficiency, where=total_energy_used > 0)
+
+        for name in ('min_charge', 'mean_charge', 'max_charge', 'charger_charge'):
+            self.series[name].add_many(time, columns[name])
+        self.series['travel_energy_used'].add_many(time, travel_energy_used)
+        self.series['transfer_energy_used'].add_many(time, transfer_energy_used)
+        self.series['energy_efficiency'].add_many(time, efficiency)
+        self.travel_energy_used = float(travel_energy_used[-1])
+        self.transfer_energy_used = float(transfer_energy_used[-1])
+        if self.start_time is None:
+            self.start_time = float(time[0])
+        self.end_time = float(time[-1])
+
+    def get_columns(self):
+        raise AssertionError('A TelemetryDownsampler does not keep its rows, use get_series instead.')
+
+    def get_series(self, points=None):
+        """
+        :param points: thin every series down to this many points, all of those kept by default
+        :return: dict of series name: (x, y) arrays
+        """
+        self.flush()
+        series = {}
+        for name, downsampler in self.series.items():
+            x, y = downsampler.get_points()
+            series[name] = (x, y) if points is None else largest_triangle_three_buckets(x, y, points)
+        return series
+
+    def resample(self, points, names=None):
+        """
+        read series off at evenly spaced times from the first to the last row, so that runs can be lined up
+        :param points: the number of times
+        :param names: the series to resample, all of them by default
+        :return: dict of 'time' and the series names: lists of floats, safe to send between processes
+        """
+        self.flush()
+        names = list(self.series) if names is None else list(names)
+        if self.start_time is None:
+            return dict({'time': []}, **{name: [] for name in names})
+        times = np.linspace(self.start_time, self.end_time, points)
+        resampled = {'time': times.tolist()}
+        for name in names:
+            x, y = self.series[name].get_points()
+            resampled[name] = np.interp(times, x, y).tolist() if len(x) else [math.nan] * points
+        return resampled
+
+
+def load_downsampled_telemetry(path, buckets=BUCKETS, chunk_size=CHUNK_SIZE):
+    """
+    downsample a run recorded by a TelemetryRecorder, a chunk at a time
+    :param path: the directory the recorder streamed to
+    :return: a TelemetryDownsampler holding the run
+    """
+    columns = load_telemetry(path)
+    downsampler = TelemetryDownsampler(buckets=buckets, chunk_size=chunk_size)
+    rows = len(columns['time'])
+    for start in range(0, rows, chunk_size):
+        downsampler.add_columns({name: np.asarray(column[start:start + chunk_size])
+                                 for name, column in columns.items()})
+    downsampler.rows_written = rows
+    return downsampler
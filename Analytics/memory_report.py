@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+import math
+import random
+import sys
+import tracemalloc
+
+"""
+How much memory a plane takes per peripheral
+get_memory_report adds up what a plane is made of, the device objects, the state store, the occupancy record and the
+lists holding it all together. measure_bytes_per_peripheral builds a plane from scratch under tracemalloc instead,
+which catches everything the breakdown does not know about:
+
+    python -m Analytics.memory_report 1000000
+"""
+
+PERIPHERAL_DENSITY = 0.04  # peripherals per cell of the plane measure_bytes_per_peripheral lays out
+
+
+def _object_size(obj, sizes_by_type):
+    # objects without __slots__ carry a dict around as well. looking at one makes Python build it, so only the first
+    # object of each type is looked at and the others are taken to be the same size
+    size = sizes_by_type.get(type(obj))
+    if size is None:
+        size = sys.getsizeof(obj)
+        if hasattr(obj, '__dict__'):
+            size += sys.getsizeof(obj.__dict__)
+        sizes_by_type[type(obj)] = size
+    return size
+
+
+def get_memory_report(plane):
+    """
+    :param plane: a populated Plane
+    :return: dict of bytes used by each part of the plane, in total and per peripheral
+    """
+    state = plane.state
+    owners = state.owners[:state.size]
+    sizes_by_type = {}
+    device_bytes = sum(_object_size(owner, sizes_by_type) + sys.getsizeof(owner.row) for owner in owners)
+    state_bytes = sum(column.nbytes for column in (state.location, state.charge_capacity, state.stored_charge,
+                                                   state.charge_threshold, state.cluster_id, state.draining,
+                                                   state.watched))
+    state_bytes += sys.getsizeof(state.owners) + sys.getsizeof(state.depletion_heap)
+    occupancy = plane.occupancy
+    if occupancy.bitmap is not None:
+        occupancy_bytes = sys.getsizeof(occupancy.bitmap)
+    else:
+        occupancy_bytes = sys.getsizeof(occupancy.occupied) + sum(sys.getsizeof(key) for key in occupancy.occupied)
+    if occupancy.free_cells is not None:
+        occupancy_bytes += occupancy.free_cells.nbytes
+    list_bytes = sum(sys.getsizeof(devices) for devices in (plane.peripherals, plane.chargers,
+                                                           plane.charging_stations))
+    cluster_bytes = sum(_object_size(cluster, sizes_by_type) + cluster.rows.nbytes + cluster.distance_matrix.nbytes +
+                        sys.getsizeof(cluster.peripheral_list)
+                        for cluster in plane.clusters_by_id.values())
+
+    total_bytes = device_bytes + state_bytes + occupancy_bytes + list_bytes + cluster_bytes
+    number_of_peripherals = plane.get_number_of_peripherals()
+    return {
+        'peripherals': number_of_peripherals,
+        'devices': len(owners),
+        'clusters': len(plane.clusters_by_id),
+        'device_object_bytes': device_bytes,
+        'state_store_bytes': state_bytes,
+        'occupancy_bytes': occupancy_bytes,
+        'list_bytes': list_bytes,
+        'cluster_bytes': cluster_bytes,
+        'total_bytes': total_bytes,
+        'bytes_per_peripheral': total_bytes / number_of_peripherals if number_of_peripherals else None,
+    }
+
+
+def measure_bytes_per_peripheral(number_of_peripherals, seed=0):
+    """
+    lay out a plane of peripherals and measure every allocation made on the way
+    :param number_of_peripherals: how many peripherals to place
+    :param seed: seed for the layout
+    :return: the plane, and the bytes still allocated per peripheral once it is built
+    """
+    from Models.plane_model import Plane, Peripheral
+    rng = random.Random(seed)
+    side = max(int(math.ceil(math.sqrt(number_of_peripherals / PERIPHERAL_DENSITY))), 2)
+
+    tracemalloc.start()
+    try:
+        plane = Plane(side, side)
+        for _ in range(number_of_peripherals):
+            x_location, y_location = plane.get_random_free_coord(rng)
+            Peripheral(x_location, y_location, plane, charge_capacity=20, current_charge=20)
+        allocated, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return plane, allocated / number_of_peripherals
+
+
+def print_memory_report(report):
+    for key, value in report.items():
+        if isinstance(value, float):
+            print('{:<24} {:>16.1f}'.format(key, value))
+        else:
+            print('{:<24} {:>16,}'.format(key, value))
+
+
+if __name__ == '__main__':
+    number_of_peripherals = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    plane, measured_bytes_per_peripheral = measure_bytes_per_peripheral(number_of_peripherals)
+    print_memory_report(get_memory_report(plane))
+    print('{:<24} {:>16.1f}'.format('measured_per_peripheral', measured_bytes_per_peripheral))
@@ -0,0 +1,264 @@
+import html
+import math
+
+import numpy as np
+
+from Analytics.downsampling import SERIES
+
+"""
+Static reports of simulation runs and sweeps
+A report is a single HTML file with the charts drawn in as SVG, so it opens in any browser without a network
+connection or a plotting package. The charts are drawn from downsampled series, see Analytics.downsampling, so a
+report stays small however long the runs were:
+
+    downsampler = TelemetryDownsampler()
+    simulation = SingleChargerSim(telemetry=downsampler).single_charger_simulation_with_communication(10)
+    write_run_report('run.html', downsampler, summary=simulation.get_summary())
+
+SweepComparison folds in the summaries of a sweep one at a time, keeping only a running mean and range per group of
+runs, and draws the groups against each other.
+"""
+
+PLOT_POINTS = 600  # points drawn per line, about one per horizontal pixel
+COMPARISON_POINTS = 200  # evenly spaced times each run is read off at for a sweep comparison
+COMPARED_SERIES = ('mean_charge', 'min_charge', 'energy_efficiency')
+# summary figures tabled for every group of a sweep, as their mean over the group's runs
+COMPARED_FIGURES = ('effective_energy_percentage', 'average_charge_at_15_cycles', 'peripheral_failure_count',
+                    'failed_peripheral_fraction', 'time_of_earliest_failure', 'cycles')
+# the charts of a run report: title, y axis label and the series drawn
+RUN_CHARTS = (
+    ('Peripheral charge', 'charge', ('min_charge', 'mean_charge', 'max_charge')),
+    ('Charger charge', 'charge', ('charger_charge',)),
+    ('Energy used', 'energy', ('travel_energy_used', 'transfer_energy_used')),
+    ('Energy efficiency', 'share transferred', ('energy_efficiency',)),
+)
+COLORS = ('#1f77b4', '#d62728', '#2ca02c', '#ff7f0e', '#9467bd', '#8c564b', '#e377c2', '#17becf')
+CHART_WIDTH = 720
+CHART_HEIGHT = 300
+MARGIN = (40, 20, 40, 70)  # top, right, bottom, left
+LEGEND_ROW_HEIGHT = 16
+STYLE = ('body { font-family: sans-serif; margin: 2em; color: #222; } '
+         'table { border-collapse: collapse; margin: 1em 0; } '
+         'td, th { border: 1px solid #ccc; padding: 0.3em 0.6em; text-align: right; } '
+         'th:first-child, td:first-child { text-align: left; }')
+
+
+def _format_number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float, np.integer, np.floating)):
+        return html.escape(str(value))
+    if isinstance(value, (int, np.integer)):
+        return '{:,}'.format(int(value))
+    return '{:,.4g}'.format(value) if math.isfinite(value) else html.escape(str(value))
+
+
+def _get_ticks(lower, upper, count=5):
+    # round steps of 1, 2 or 5 times a power of ten
+    step = (upper - lower) / count
+    magnitude = 10 ** math.floor(math.log10(step))
+    step = min((factor * magnitude for factor in (1, 2, 5, 10) if factor * magnitude >= step))
+    return np.arange(math.ceil(lower / step) * step, upper + step / 2, step)
+
+
+def render_chart(title, lines, bands=(), y_label='', x_label='simulated time', width=CHART_WIDTH,
+                 height=CHART_HEIGHT):
+    """
+    draw a line chart as an SVG element
+    :param lines: (label, x, y) per line
+    :param bands: (label, x, lower, upper) per shaded range, drawn below the lines in the same colour order
+    :return: the SVG markup
+    """
+    lines = [(label, np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+             for label, x, y in lines if len(x) > 0]
+    bands = [(label, np.asarray(x, dtype=np.float64), np.asarray(lower, dtype=np.float64),
+              np.asarray(upper, dtype=np.float64)) for label, x, lower, upper in bands if len(x) > 0]
+    top, right, bottom, left = MARGIN
+    # the legend goes under the chart, a row per line
+    svg = ['<svg xmlns="http://www.w3.org/2000/svg" width="{}" height="{}" font-size="12">'.format(
+               width, height + LEGEND_ROW_HEIGHT * len(lines)),
+           '<text x="{}" y="20" font-size="14" font-weight="bold">{}</text>'.format(left, html.escape(title))]
+    x_values = [x for _, x, _ in lines] + [x for _, x, _, _ in bands]
+    y_values = [y for _, _, y in lines] + [values for _, _, lower, upper in bands for values in (lower, upper)]
+    y_values = [y[~np.isnan(y)] for y in y_values]
+    if not any(len(y) for y in y_values):
+        svg.append('<text x="{}" y="{}">no data</text></svg>'.format(left, height // 2))
+        return '\n'.join(svg)
+
+    x_lower = min(float(x.min()) for x in x_values)
+    x_upper = max(float(x.max()) for x in x_values)
+    y_lower = min(float(y.min()) for y in y_values if len(y))
+    y_upper = max(float(y.max()) for y in y_values if len(y))
+    if x_upper == x_lower:
+        x_upper = x_lower + 1
+    if y_upper == y_lower:
+        y_lower, y_upper = y_lower - 0.5, y_upper + 0.5
+    plot_width = width - left - right
+    plot_height = height - top - bottom
+
+    def to_x(x):
+        return left + (x - x_lower) / (x_upper - x_lower) * plot_width
+
+    def to_y(y):
+        return top + (y_upper - y) / (y_upper - y_lower) * plot_height
+
+    def to_points(x, y):
+        kept = ~np.isnan(y)
+        return ' '.join('{:.1f},{:.1f}'.format(px, py) for px, py in zip(to_x(x[kept]), to_y(y[kept])))
+
+    svg.append('<rect x="{}" y="{}" width="{}" height="{}" fill="none" stroke="#999"/>'.format(
+        left, top, plot_width, plot_height))
+    for tick in _get_ticks(x_lower, x_upper):
+        svg.append('<line x1="{0:.1f}" y1="{1}" x2="{0:.1f}" y2="{2}" stroke="#eee"/>'
+                   '<text x="{0:.1f}" y="{3}" text-anchor="middle">{4:g}</text>'.format(
+                       to_x(tick), top, top + plot_height, top + plot_height + 15, tick))
+    for tick in _get_ticks(y_lower, y_upper):
+        svg.append('<line x1="{0}" y1="{1:.1f}" x2="{2}" y2="{1:.1f}" stroke="#eee"/>'
+                   '<text x="{3}" y="{4:.1f}" text-anchor="end">{5:g}</text>'.format(
+                       left, to_y(tick), left + plot_width, left - 5, to_y(tick) + 4, tick))
+    svg.append('<text x="{}" y="{}" text-anchor="middle">{}</text>'.format(
+        left + plot_width / 2, height - 5, html.escape(x_label)))
+    svg.append('<text transform="translate(15 {}) rotate(-90)" text-anchor="middle">{}</text>'.format(
+        top + plot_height / 2, html.escape(y_label)))
+
+    for index, (label, x, lower, upper) in enumerate(bands):
+        svg.append('<polygon points="{} {}" fill="{}" fill-opacity="0.15" stroke="none"><title>{}</title>'
+                   '</polygon>'.format(to_points(x, upper), to_points(x[::-1], lower[::-1]),
+                                       COLORS[index % len(COLORS)], html.escape(label)))
+    for index, (label, x, y) in enumerate(lines):
+        color = COLORS[index % len(COLORS)]
+        svg.append('<polyline points="{}" fill="none" stroke="{}" stroke-width="1.2"><title>{}</title>'
+                   '</polyline>'.format(to_points(x, y), color, html.escape(label)))
+        legend_y = height + LEGEND_ROW_HEIGHT * index
+        svg.append('<rect x="{}" y="{}" width="10" height="10" fill="{}"/><text x="{}" y="{}">{}</text>'.format(
+            left, legend_y, color, left + 15, legend_y + 9, html.escape(label)))
+    svg.append('</svg>')
+    return '\n'.join(svg)
+
+
+def _render_table(headers, rows):
+    table = ['<table>', '<tr>' + ''.join('<th>{}</th>'.format(html.escape(header)) for header in headers) + '</tr>']
+    for row in rows:
+        table.append('<tr>' + ''.join('<td>{}</td>'.format(_format_number(value)) for value in row) + '</tr>')
+    table.append('</table>')
+    return '\n'.join(table)
+
+
+def _write_page(path, title, sections):
+    with open(path, 'w') as f:
+        f.write('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{0}</title><style>{1}</style></head>\n'
+                '<body>\n<h1>{0}</h1>\n{2}\n</body></html>\n'.format(html.escape(title), STYLE, '\n'.join(sections)))
+    return path
+
+
+def write_run_report(path, downsampler, summary=None, title='Simulation run', points=PLOT_POINTS):
+    """
+    write the charts of one run, and its summary if given, to an HTML file
+    :param downsampler: the Analytics.downsampling.TelemetryDownsampler the run was recorded with
+    :param summary: the run summary, e.g. Simulation.get_summary()
+    :param points: points drawn per line
+    :return: path
+    """
+    series = downsampler.get_series(points)
+    sections = []
+    if summary:
+        sections.append(_render_table(('figure', 'value'), sorted(summary.items())))
+    for chart_title, y_label, names in RUN_CHARTS:
+        sections.append(render_chart(chart_title, [(name.replace('_', ' '), *series[name]) for name in names],
+                                     y_label=y_label))
+    sections.append('<p>{:,} rows downsampled to at most {} points per line.</p>'.format(len(downsampler), points))
+    return _write_page(path, title, sections)
+
+
+class SweepComparison:
+    """
+    the runs of a sweep, grouped by strategy, threshold and cluster radius
+    Each run is read off at the same number of evenly spaced times (see TelemetryDownsampler.resample), so the runs of
+    a group line up point by point and only their running sum and range are kept
+    """
+
+    def __init__(self, series=COMPARED_SERIES, figures=COMPARED_FIGURES):
+        """
+        :param series: the series compared, names from Analytics.downsampling.SERIES
+        :param figures: the summary figures compared
+        """
+        for name in series:
+            if name not in SERIES:
+                raise KeyError('No series named {}. Available series: {}'.format(name, ', '.join(SERIES)))
+        self.series = tuple(series)
+        self.figures = tuple(figures)
+        # group label: {'runs', 'time', name: (sum, minimum, maximum) per series, 'figures': {name: (sum, count)}}
+        self.groups = {}
+
+    def __len__(self):
+        return sum(group['runs'] for group in self.groups.values())
+
+    @staticmethod
+    def get_group_label(summary):
+        label = summary['strategy']
+        if summary.get('charge_percentage_threshold') is not None:
+            label += ' threshold {:g}'.format(summary['charge_percentage_threshold'])
+        if summary.get('cluster_radius') is not None:
+            label += ' radius {:g}'.format(summary['cluster_radius'])
+        return label
+
+    def add(self, summary):
+        """
+        fold in the summary of a run. its series are taken from summary['series'], as the sweep runner leaves them
+        """
+        label = SweepComparison.get_group_label(summary)
+        group = self.groups.get(label)
+        resampled = summary['series']
+        if group is None:
+            group = self.groups[label] = {'runs': 0, 'time': np.zeros(len(resampled['time'])), 'figures': {}}
+            for name in self.series:
+                values = np.asarray(resampled[name], dtype=np.float64)
+                group[name] = (np.zeros(len(values)), np.full(len(values), np.inf), np.full(len(values), -np.inf))
+        elif len(resampled['time']) != len(group['time']):
+            raise ValueError('Expected series of {} points, got {}.'.format(len(group['time']),
+                                                                             len(resampled['time'])))
+        group['runs'] += 1
+        group['time'] += resampled['time']
+        for name in self.series:
+            values = np.asarray(resampled[name], dtype=np.float64)
+            total, minimum, maximum = group[name]
+            total += values
+            np.fmin(minimum, values, out=minimum)
+            np.fmax(maximum, values, out=maximum)
+        for figure in self.figures:
+            value = summary.get(figure)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                total, count = group['figures'].get(figure, (0, 0))
+                group['figures'][figure] = (total + value, count + 1)
+
+    def get_figures(self):
+        """
+        :return: dict of group label: dict of figure: mean over the group's runs, or None if no run had it
+        """
+        figures = {}
+        for label, group in sorted(self.groups.items()):
+            figures[label] = {'runs': group['runs']}
+            for figure in self.figures:
+                total, count = group['figures'].get(figure, (0, 0))
+                figures[label][figure] = total / count if count else None
+        return figures
+
+    def write(self, path, title='Sweep comparison'):
+        """
+        write the mean of every group over time, shaded from its lowest to its highest run, and a table of the mean
+        figures to an HTML file
+        :return: path
+        """
+        labels = sorted(self.groups)
+        sections = [_render_table(['group', 'runs'] + list(self.figures),
+                                  [[label] + list(figures.values()) for label, figures in self.get_figures().items()])]
+        for name in self.series:
+            lines = []
+            bands = []
+            for label in labels:
+                group = self.groups[label]
+                total, minimum, maximum = group[name]
+                time = group['time'] / group['runs']
+                lines.append((label, time, total / group['runs']))
+                bands.append((label, time, minimum, maximum))
+            sections.append(render_chart(SERIES[name].capitalize(), lines, bands=bands,
+                                         y_label=name.replace('_', ' ')))
+        return _write_page(path, title, sections)
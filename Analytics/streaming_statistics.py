@@ -0,0 +1,363 @@
+import collections
+import math
+
+import numpy as np
+
+"""
+Statistics kept up to date while a simulation runs
+The simulations hand StreamingStatistics the charges of their devices once a cycle, as they do with telemetry, and
+everything below is folded in there and then: the mean and variance of the charge percentage, a sketch of its
+quantiles, how long each device has spent at or below a charge threshold and the share of the energy that went into
+charging over a sliding window of simulated time. Reading the results back never walks the devices again, however long
+the run was, but a record is one vectorized pass over the charges it is handed, so the cost is O(devices) per cycle
+rather than O(1) per event. The charge percentages are clipped at 0 and cut into quantile bins, neither of which the
+drain clock can track without looking at the rows.
+
+Every record stands for the simulated time since the one before it, and is weighted by it, so the results follow
+simulated time and not how often a simulation happened to record. An idle stretch that a simulation fast-forwards in
+one step is recorded with the number of ticks it covers and unrolled here into the records that stepping through it
+tick by tick would have made.
+"""
+
+QUANTILES = (0.01, 0.5, 0.99)  # charge percentage quantiles reported in the summary
+SKETCH_BINS = 1000  # bins of the charge percentage sketch, quantiles are within 0.1 percentage points
+THRESHOLD_PERCENTAGE = 10  # devices at or below this charge percentage count as below threshold
+WINDOW = 10000  # simulated time units the sliding energy efficiency is taken over
+IDLE_VALUES = 1 << 20  # charge percentages worked out at once when unrolling idle ticks
+
+
+class RunningMoments:
+    """
+    weighted count, mean, variance and range of a stream of values, by Welford's method
+    Batches are folded in with the pairwise form of the same update, so adding many values at once is one vectorized
+    pass and just as stable as adding them one at a time. Values of weight 0 are ignored
+    """
+
+    def __init__(self):
+        self.count = 0.0  # the total weight of the values seen
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared differences from the mean
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def add(self, value, weight=1):
+        if weight <= 0:
+            return
+        self.count += weight
+        delta = value - self.mean
+        self.mean += delta * weight / self.count
+        self.m2 += weight * delta * (value - self.mean)
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+    def add_many(self, values, weights=1):
+        """
+        :param values: array of values
+        :param weights: one weight for all of them, or an array of one per value
+        """
+        values = np.asarray(values, dtype=np.float64)
+        weights = np.broadcast_to(np.asarray(weights, dtype=np.float64), values.shape)
+        total_weight = float(weights.sum())
+        if total_weight <= 0:
+            return
+        mean = float((weights * values).sum()) / total_weight
+        deviations = values - mean
+        weighted = values[weights > 0]
+        self._merge(total_weight, mean, float((weights * deviations * deviations).sum()), float(weighted.min()),
+                    float(weighted.max()))
+
+    def merge(self, other):
+        """
+        fold in the values another RunningMoments has seen, e.g. one from a different run
+        """
+        self._merge(other.count, other.mean, other.m2, other.minimum, other.maximum)
+
+    def _merge(self, count, mean, m2, minimum, maximum):
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.minimum = min(self.minimum, minimum)
+        self.maximum = max(self.maximum, maximum)
+
+    def get_mean(self):
+        return self.mean if self.count else None
+
+    def get_variance(self):
+        """
+        :return: the population variance of the values seen, or None before any
+        """
+        return self.m2 / self.count if self.count else None
+
+    def get_standard_deviation(self):
+        return math.sqrt(self.m2 / self.count) if self.count else None
+
+
+class QuantileSketch:
+    """
+    approximate weighted quantiles of a stream of values in a known range, in a fixed amount of memory
+    The weights of the values are summed in equal width bins, anything outside of the range going to the first or last
+    bin, and values of weight 0 are ignored. A quantile is read
+    off the running total of the counts and interpolated within its bin, so it is off by at most one bin width, and
+    never outside of the smallest and largest value seen
+    """
+
+    def __init__(self, lower, upper, bins=SKETCH_BINS):
+        """
+        :param lower: the lower end of the range
+        :param upper: the upper end of the range
+        :param bins: the number of bins the range is split into
+        """
+        if not upper > lower:
+            raise ValueError('The upper end of the range ({}) must be above the lower end ({}).'.format(upper, lower))
+        if bins < 1:
+            raise ValueError('bins must be at least 1, got {}.'.format(bins))
+        self.lower = lower
+        self.upper = upper
+        self.bins = bins
+        self.bin_width = (upper - lower) / bins
+        self.counts = np.zeros(bins, dtype=np.float64)  # the weight in each bin
+        self.count = 0.0  # the total weight
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def add(self, value, weight=1):
+        if weight <= 0:
+            return
+        self.counts[min(max(int((value - self.lower) // self.bin_width), 0), self.bins - 1)] += weight
+        self.count += weight
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+    def add_many(self, values, weights=1):
+        """
+        :param values: array of values
+        :param weights: one weight for all of them, or an array of one per value
+        """
+        values = np.asarray(values, dtype=np.float64)
+        weights = np.broadcast_to(np.asarray(weights, dtype=np.float64), values.shape)
+        total_weight = float(weights.sum())
+        if total_weight <= 0:
+            return
+        # clipped before truncating, so anything below the range lands in the first bin and not in bin 0 - 1
+        bins = np.clip((values - self.lower) / self.bin_width, 0, self.bins - 1).astype(np.int64)
+        self.counts += np.bincount(bins.ravel(), weights=weights.ravel(), minlength=self.bins)
+        self.count += total_weight
+        weighted = values[weights > 0]
+        self.minimum = min(self.minimum, float(weighted.min()))
+        self.maximum = max(self.maximum, float(weighted.max()))
+
+    def merge(self, other):
+        """
+        fold in the values another sketch over the same range and bins has seen
+        """
+        if (other.lower, other.upper, other.bins) != (self.lower, self.upper, self.bins):
+            raise ValueError('Only sketches over the same range and bins can be merged.')
+        self.counts += other.counts
+        self.count += other.count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+    def get_quantile(self, quantile):
+        """
+        :param quantile: between 0 and 1, e.g. 0.5 for the median
+        :return: the approximate weighted quantile of the values seen, or None before any
+        """
+        if not 0 <= quantile <= 1:
+            raise ValueError('quantile must be between 0 and 1, got {}.'.format(quantile))
+        if self.count == 0:
+            return None
+        rank = quantile * self.count
+        totals = np.cumsum(self.counts)
+        # the first bin whose running total reaches the rank, and for a rank of 0 the first bin with anything in it
+        index = int(np.searchsorted(totals, rank, side='right' if rank == 0 else 'left'))
+        index = min(index, self.bins - 1)
+        below = totals[index] - self.counts[index]
+        fraction = (rank - below) / self.counts[index] if self.counts[index] else 0
+        value = self.lower + (index + fraction) * self.bin_width
+        return float(min(max(value, self.minimum), self.maximum))
+
+
+class StreamingStatistics:
+
+    def __init__(self, threshold_percentage=THRESHOLD_PERCENTAGE, window=WINDOW, quantiles=QUANTILES,
+                 bins=SKETCH_BINS, start_time=0):
+        """
+        :param threshold_percentage: charge percentage at or below which a device counts as below threshold
+        :param window: the simulated time the sliding energy efficiency is taken over
+        :param quantiles: the charge percentage quantiles reported by get_summary
+        :param bins: the number of bins of the charge percentage sketch
+        :param start_time: the simulated time the run starts at
+        """
+        if window <= 0:
+            raise ValueError('window must be positive, got {}.'.format(window))
+        self.threshold_percentage = threshold_percentage
+        self.window = window
+        self.quantiles = tuple(quantiles)
+        self.start_time = start_time
+        self.last_time = start_time
+        self.records = 0
+        self.charge_moments = RunningMoments()
+        self.charge_sketch = QuantileSketch(0, 100, bins)
+        # per device, in the order of the charges handed to record. set up by the first record
+        self.time_below_threshold = None
+
+        # the energy used in each record still in the window, as (time, travel, transfer), and their totals
+        self.window_records = collections.deque()
+        self.window_travel_energy = 0.0
+        self.window_transfer_energy = 0.0
+        self.last_travel_energy_used = 0
+        self.last_transfer_energy_used = 0
+        self.minimum_window_efficiency = None
+        self.maximum_window_efficiency = None
+
+    def __len__(self):
+        return self.records
+
+    def record(self, time, travel_energy_used, transfer_energy_used, charges, charge_capacities, ticks=1):
+        """
+        fold in the state of the run at the end of a cycle. it stands for the simulated time since the last record
+        :param time: the current simulated time
+        :param travel_energy_used: the travel energy used so far in the run
+        :param transfer_energy_used: the transfer energy used so far in the run
+        :param charges: array of the current charges of the devices, always in the same order
+        :param charge_capacities: array of the charge capacities of the same devices. devices with no capacity left,
+        i.e. failed ones, count as empty
+        :param ticks: the number of idle cycles of one time unit the record covers, for a simulation that skips over
+        them in one step and hands in the charges after the last of them. it is taken as the records stepping through
+        them would have made, at time and each time unit after it, every device 1 fuller in each than in the next
+        """
+        charges = np.asarray(charges, dtype=np.float64)
+        charge_capacities = np.asarray(charge_capacities, dtype=np.float64)
+        if self.time_below_threshold is None:
+            self.time_below_threshold = np.zeros(len(charges))
+        elif len(charges) != len(self.time_below_threshold):
+            raise ValueError('Expected the charges of {} devices, got {}.'.format(len(self.time_below_threshold),
+                                                                                 len(charges)))
+        # the energy was used before the first of the records, the rest only drain the devices
+        self._record_charges(time, charges[np.newaxis, :] + (ticks - 1), charge_capacities)
+        self._record_energy(time, travel_energy_used - self.last_travel_energy_used,
+                            transfer_energy_used - self.last_transfer_energy_used)
+        self.last_travel_energy_used = travel_energy_used
+        self.last_transfer_energy_used = transfer_energy_used
+        if ticks > 1:
+            # a few ticks of every device at a time, so a long stretch does not take up memory for all of them
+            ticks_at_once = max(IDLE_VALUES // max(len(charges), 1), 1)
+            for first_tick in range(1, ticks, ticks_at_once):
+                remaining = np.arange(ticks - first_tick - 1, max(ticks - first_tick - ticks_at_once, 0) - 1, -1)
+                self._record_charges(time + first_tick + (len(remaining) - 1), charges + remaining[:, np.newaxis],
+                                     charge_capacities)
+            self._advance_window(time + 1, ticks - 1)
+
+    def _record_charges(self, time, charges, charge_capacities):
+        """
+        fold in the charges of consecutive records one time unit apart, the last of them at time
+        :param charges: array of the charges of the devices, one row per record
+        """
+        records = len(charges)
+        percentages = np.zeros(charges.shape)
+        np.divide(np.maximum(charges, 0) * 100, charge_capacities, out=percentages, where=charge_capacities > 0)
+        # each record is weighted by the time since the one before it
+        weights = np.ones(records)
+        weights[0] = time - (records - 1) - self.last_time
+        self.charge_moments.add_many(percentages, weights[:, np.newaxis])
+        self.charge_sketch.add_many(percentages, weights[:, np.newaxis])
+        self.time_below_threshold += weights @ (percentages <= self.threshold_percentage)
+        self.last_time = time
+        self.records += records
+
+    def _record_energy(self, time, travel_energy, transfer_energy):
+        self.window_records.append((time, travel_energy, transfer_energy))
+        self.window_travel_energy += travel_energy
+        self.window_transfer_energy += transfer_energy
+        self._update_window(time)
+
+    def _update_window(self, time):
+        while self.window_records and self.window_records[0][0] <= time - self.window:
+            _, travel_energy, transfer_energy = self.window_records.popleft()
+            self.window_travel_energy -= travel_energy
+            self.window_transfer_energy -= transfer_energy
+
+        # windows reaching back before the start of the run are not full yet, so they do not count towards the range
+        efficiency = self.get_window_efficiency()
+        if efficiency is not None and time - self.start_time >= self.window:
+            if self.minimum_window_efficiency is None or efficiency < self.minimum_window_efficiency:
+                self.minimum_window_efficiency = efficiency
+            if self.maximum_window_efficiency is None or efficiency > self.maximum_window_efficiency:
+                self.maximum_window_efficiency = efficiency
+
+    def _advance_window(self, first_time, ticks):
+        """
+        move the window over records that used no energy, one time unit apart from first_time on
+        the window only changes when its oldest record leaves it or when it fills up, so only those times are looked at
+        :param ticks: the number of records
+        """
+        tick = 0
+        last_tick = ticks - 1
+        while tick <= last_tick:
+            self._update_window(first_time + tick)
+            if not self._window_changes_between(first_time + tick, first_time + last_tick):
+                return
+            # the changes only ever start to happen, so the first tick they do is found by bisection
+            lower, upper = tick, last_tick
+            while upper - lower > 1:
+                middle = (lower + upper) // 2
+                if self._window_changes_between(first_time + tick, first_time + middle):
+                    upper = middle
+                else:
+                    lower = middle
+            tick = upper
+
+    def _window_changes_between(self, last_update, time):
+        """
+        :return: whether the window, last updated at last_update, would change if it were updated at time with no
+        records in between
+        """
+        oldest_leaves = len(self.window_records) > 0 and self.window_records[0][0] <= time - self.window
+        fills_up = last_update - self.start_time < self.window <= time - self.start_time
+        return oldest_leaves or fills_up
+
+    def get_window_efficiency(self):
+        """
+        :return: the share of the energy used over the last window of simulated time that was transferred to
+        devices, or None if none was used
+        """
+        total_energy = self.window_travel_energy + self.window_transfer_energy
+        if total_energy <= 0:
+            return None
+        return self.window_transfer_energy / total_energy
+
+    def get_time_below_threshold(self):
+        """
+        :return: array of the simulated time each device has spent at or below the threshold, in the order of the
+        charges handed to record
+        """
+        if self.time_below_threshold is None:
+            return np.zeros(0)
+        return self.time_below_threshold.copy()
+
+    def get_summary(self):
+        """
+        :return: a dict of the statistics so far, safe to send between processes or write out as JSON
+        """
+        summary = {
+            'mean_charge_percentage': self.charge_moments.get_mean(),
+            'charge_percentage_standard_deviation': self.charge_moments.get_standard_deviation(),
+        }
+        for quantile in self.quantiles:
+            summary['charge_percentage_p{:g}'.format(quantile * 100)] = self.charge_sketch.get_quantile(quantile)
+        elapsed = self.last_time - self.start_time
+        has_time_below = self.time_below_threshold is not None and len(self.time_below_threshold) > 0
+        summary.update({
+            'mean_time_below_threshold': float(self.time_below_threshold.mean()) if has_time_below else None,
+            'maximum_time_below_threshold': float(self.time_below_threshold.max()) if has_time_below else None,
+            'fraction_of_time_below_threshold': (float(self.time_below_threshold.mean()) / elapsed
+                                                 if has_time_below and elapsed > 0 else None),
+            'window_efficiency': self.get_window_efficiency(),
+            'minimum_window_efficiency': self.minimum_window_efficiency,
+            'maximum_window_efficiency': self.maximum_window_efficiency,
+        })
+        return summary
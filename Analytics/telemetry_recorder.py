@@ -0,0 +1,151 @@
+import json
+import os
+
+import numpy as np
+
+"""
+Per-cycle telemetry for a simulation run
+The simulations hand the recorder one row per cycle. Rows collect in preallocated column buffers and every full chunk
+is appended to one raw little-endian file per column, so a run of millions of cycles is recorded in a fixed amount of
+memory. A small JSON file next to the columns describes them, and load_telemetry maps them back in without reading
+them into memory.
+"""
+
+# column name: dtype, in the order the columns are recorded
+COLUMNS = (
+    ('cycle', '<i8'),  # the cycle count after this row. idle stretches skipped in one go share a single row
+    ('time', '<f8'),  # simulated time of the row
+    ('travel_energy', '<f8'),  # travel energy used since the previous row
+    ('transfer_energy', '<f8'),  # transfer energy used since the previous row
+    ('charger_charge', '<f8'),
+    ('min_charge', '<f8'),  # over the peripherals
+    ('mean_charge', '<f8'),
+    ('max_charge', '<f8'),
+)
+CHUNK_SIZE = 4096  # rows held in memory before they are written out
+META_FILE_NAME = 'telemetry.json'
+COLUMN_FILE_EXTENSION = '.bin'
+
+
+class TelemetryRecorder:
+
+    def __init__(self, path=None, chunk_size=CHUNK_SIZE):
+        """
+        :param path: directory to stream the columns to. without one every chunk is kept in memory, which is only
+        meant for short runs
+        :param chunk_size: the number of rows buffered before they are written out
+        """
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be at least 1, got {}.'.format(chunk_size))
+        self.path = path
+        self.chunk_size = chunk_size
+        self.buffers = {name: np.empty(chunk_size, dtype=dtype) for name, dtype in COLUMNS}
+        self.buffered = 0
+        self.rows_written = 0
+        self.chunks = {name: [] for name, _ in COLUMNS}  # only used without a path
+        self.files = None
+        self.last_travel_energy_used = 0
+        self.last_transfer_energy_used = 0
+        self.closed = False
+
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            self.files = {name: open(os.path.join(path, name + COLUMN_FILE_EXTENSION), 'wb') for name, _ in COLUMNS}
+
+    def __len__(self):
+        return self.rows_written + self.buffered
+
+    def record(self, cycle, time, travel_energy_used, transfer_energy_used, charger_charge, charges):
+        """
+        add a row
+        :param cycle: the cycle count so far
+        :param time: the current simulated time
+        :param travel_energy_used: the travel energy used so far in the run. the row holds the change since the last one
+        :param transfer_energy_used: the transfer energy used so far in the run
+        :param charger_charge: the current charge of the charger
+        :param charges: array of the current peripheral charges
+        """
+        if self.closed:
+            raise AssertionError('Cannot record to a telemetry recorder that has been closed.')
+        row = self.buffered
+        buffers = self.buffers
+        buffers['cycle'][row] = cycle
+        buffers['time'][row] = time
+        buffers['travel_energy'][row] = travel_energy_used - self.last_travel_energy_used
+        buffers['transfer_energy'][row] = transfer_energy_used - self.last_transfer_energy_used
+        buffers['charger_charge'][row] = charger_charge
+        if len(charges) > 0:
+            buffers['min_charge'][row] = charges.min()
+            buffers['mean_charge'][row] = charges.mean()
+            buffers['max_charge'][row] = charges.max()
+        else:
+            buffers['min_charge'][row] = buffers['mean_charge'][row] = buffers['max_charge'][row] = np.nan
+        self.last_travel_energy_used = travel_energy_used
+        self.last_transfer_energy_used = transfer_energy_used
+
+        self.buffered += 1
+        if self.buffered == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        write out the buffered rows
+        """
+        if self.buffered == 0:
+            return
+        for name, _ in COLUMNS:
+            column = self.buffers[name][:self.buffered]
+            if self.files is None:
+                self.chunks[name].append(column.copy())
+            else:
+                column.tofile(self.files[name])
+        self.rows_written += self.buffered
+        self.buffered = 0
+        if self.files is not None:
+            for column_file in self.files.values():
+                column_file.flush()
+            self._write_meta()
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        if self.files is not None:
+            for column_file in self.files.values():
+                column_file.close()
+            self._write_meta()
+        self.closed = True
+
+    def get_columns(self):
+        """
+        :return: dict of column name: array of every row recorded so far
+        rows streamed to disk are read back as memory maps
+        """
+        self.flush()
+        if self.files is None:
+            return {name: np.concatenate(self.chunks[name]) if self.chunks[name] else np.empty(0, dtype=dtype)
+                    for name, dtype in COLUMNS}
+        return load_telemetry(self.path)
+
+    def _write_meta(self):
+        meta = {'rows': self.rows_written, 'columns': [{'name': name, 'dtype': dtype} for name, dtype in COLUMNS]}
+        with open(os.path.join(self.path, META_FILE_NAME), 'w') as meta_file:
+            json.dump(meta, meta_file)
+
+
+def load_telemetry(path):
+    """
+    map a recorded run back in
+    :param path: the directory the recorder streamed to
+    :return: dict of column name: read-only memory-mapped array
+    """
+    with open(os.path.join(path, META_FILE_NAME)) as meta_file:
+        meta = json.load(meta_file)
+    columns = {}
+    for column in meta['columns']:
+        column_path = os.path.join(path, column['name'] + COLUMN_FILE_EXTENSION)
+        if meta['rows'] == 0:
+            columns[column['name']] = np.empty(0, dtype=column['dtype'])
+        else:
+            columns[column['name']] = np.memmap(column_path, dtype=column['dtype'], mode='r', shape=(meta['rows'],))
+    return columns
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+"""
+Benchmarks for the hot kernels and for each simulation strategy
+Every benchmark is run at several sizes with a fixed seed, so two runs on the same machine time exactly the same work.
+Results are written as JSON and can be compared against a stored baseline to catch slowdowns:
+
+    python -m Benchmarks.benchmark_suite --output results.json
+    python -m Benchmarks.benchmark_suite --output results.json --baseline baseline.json
+
+The second form exits with status 1 if any benchmark got slower than the baseline by more than the tolerance.
+"""
+
+DEFAULT_SEED = 0
+DEFAULT_REPEATS = 3  # the fastest repeat is reported
+DEFAULT_TOLERANCE = 0.25  # how much slower than the baseline a benchmark may get before it counts as a regression
+PERIPHERAL_DENSITY = 0.04  # peripherals per cell when a benchmark lays out its own plane
+CLUSTER_RADIUS = 5
+STRATEGY_HORIZON = 20000  # simulated time each strategy benchmark runs for
+SETUP_HORIZON = -1  # runs a strategy to before its first event, which only sets it up
+
+
+def _make_plane(number_of_peripherals, rng):
+    """
+    lay out a square plane big enough to hold the peripherals at PERIPHERAL_DENSITY
+    :return: the plane and its peripherals
+    """
+    from Models.plane_model import Plane, Peripheral
+    side = max(int(math.ceil(math.sqrt(number_of_peripherals / PERIPHERAL_DENSITY))), 2)
+    plane = Plane(side, side)
+    peripherals = []
+    for _ in range(number_of_peripherals):
+        x_location, y_location = plane.get_random_free_coord(rng)
+        capacity = rng.randint(10, 30)
+        peripherals.append(Peripheral(x_location, y_location, plane, charge_capacity=capacity, current_charge=capacity))
+    return plane, peripherals
+
+
+def _clear_tour_cache():
+    # a warm cache would make every repeat after the first look faster than it is
+    from Services import route_services
+    route_services.tour_cache.clear()
+
+
+def _held_karp(size, rng):
+    from Services import simulation_services
+    points = np.array([(rng.randint(0, 100), rng.randint(0, 100)) for _ in range(size)], dtype=np.float64)
+    distance_matrix = np.sqrt(((points[:, None, :] - points[None, :, :]) ** 2).sum(axis=2))
+
+    def run():
+        simulation_services.held_karp(distance_matrix)
+    return run
+
+
+def _get_distance_matrix(size, rng):
+    from Models.plane_model import Cluster
+    from Services import simulation_services
+    plane, peripherals = _make_plane(size, rng)
+    cluster = Cluster(peripheral_list=peripherals, id=0)
+
+    def run():
+        simulation_services.get_distance_matrix(cluster)
+    return run
+
+
+def _generate_clusters(size, rng):
+    plane, peripherals = _make_plane(size, rng)
+    _clear_tour_cache()
+
+    def run():
+        clusters = plane.generate_clusters(peripherals_list=peripherals,
+                                           max_distance_between_point_and_centroid=CLUSTER_RADIUS)
+        return {'clusters': len(clusters)}
+    return run
+
+
+def _charge_cluster(size, rng):
+    from Models.plane_model import Cluster, ChargingNode
+    # charge_cluster imports this on its first call, which should not be timed
+    import Simulation.single_charger_simulation
+    plane, peripherals = _make_plane(size, rng)
+    cluster = Cluster(peripheral_list=peripherals, id=0)
+    # a charger with enough charge to get round the whole cluster and top everything up
+    capacity = 2 * (cluster.length_of_shortest_path + 4 * plane.get_width()) + 30 * size
+    charger = ChargingNode(0, 0, plane, charge_capacity=capacity, current_charge=capacity)
+    for peripheral in peripherals:
+        peripheral.current_charge = peripheral.charge_capacity / 2
+
+    def run():
+        charger.charge_cluster(cluster)
+    return run
+
+
+def _strategy(module_name, class_name, method_name, uses_threshold):
+    def setup(size, rng):
+        import importlib
+        from Services.scenario_service import generate_scenario, load_scenario
+        sim_class = getattr(importlib.import_module(module_name), class_name)
+        _clear_tour_cache()
+
+        # the plane grows with the peripherals, laid out by a generated scenario at its default density
+        with tempfile.TemporaryDirectory() as directory:
+            path = generate_scenario(os.path.join(directory, 'layout.scn'), size, seed=rng.randrange(2 ** 32))
+            scenario = load_scenario(path, mmap=False)
+        sim = sim_class(seed=rng.randrange(2 ** 32), scenario=scenario)
+        # a horizon before the first event sets the plane, the clusters and their tours up without running anything,
+        # so only the engine run below is timed. the set up is reported on its own
+        setup_started = time.perf_counter()
+        method = getattr(sim, method_name)
+        if uses_threshold:
+            method(10, horizon=SETUP_HORIZON)
+        else:
+            method(horizon=SETUP_HORIZON)
+        setup_seconds = time.perf_counter() - setup_started
+
+        def run():
+            sim.resume(horizon=STRATEGY_HORIZON)
+            return {'cycles': sim.cycles, 'events_processed': sim.engine.events_processed,
+                    'plane_size': sim.plane.get_width() * sim.plane.get_length(), 'setup_seconds': setup_seconds}
+        return run
+    return setup
+
+
+def _batched_single_charger_simulation(size, rng):
+    # size is the number of replicas, each on the default layout
+    from Simulation.batched_single_charger_simulation import BatchedSingleChargerSim
+    _clear_tour_cache()
+    seeds = [rng.randrange(2 ** 32) for _ in range(size)]
+
+    def run():
+        summaries = BatchedSingleChargerSim(seeds).single_charger_simulation(horizon=STRATEGY_HORIZON)
+        return {'cycles': sum(summary['cycles'] for summary in summaries)}
+    return run
+
+
+# benchmark name: (setup, sizes). setup(size, rng) prepares the input and hands back the function being timed, which
+# may return a dict of extra figures to report
+BENCHMARKS = {
+    'held_karp': (_held_karp, (8, 12, 16)),
+    'get_distance_matrix': (_get_distance_matrix, (10, 100, 1000)),
+    'generate_clusters': (_generate_clusters, (100, 1000, 10000)),
+    'charge_cluster': (_charge_cluster, (10, 100, 1000)),
+    'single_charger_simulation': (_strategy('Simulation.single_charger_simulation', 'SingleChargerSim',
+                                            'single_charger_simulation', False), (15, 150, 1500, 15000)),
+    'single_charger_simulation_with_communication': (
+        _strategy('Simulation.single_charger_simulation', 'SingleChargerSim',
+                  'single_charger_simulation_with_communication', True), (15, 150, 1500, 15000)),
+    'multi_charger_simulation_experimental': (
+        _strategy('Simulation.multi_charger_simulation_experimental', 'MultiChargerSim',
+                  'multi_charger_simulation_experimental', False), (15, 150, 1500, 15000)),
+    'multi_charger_simulation_experimental_with_communication': (
+        _strategy('Simulation.multi_charger_simulation_experimental', 'MultiChargerSim',
+                  'multi_charger_simulation_experimental_with_communication', True), (15, 150, 1500, 15000)),
+    'multi_charger_simulation_fleet': (
+        _strategy('Simulation.multi_charger_simulation_experimental', 'MultiChargerSim',
+                  'multi_charger_simulation_fleet', False), (15, 150, 1500, 15000)),
+    'batched_single_charger_simulation': (_batched_single_charger_simulation, (10, 100, 1000)),
+}
+
+
+def run_benchmark(name, size, seed=DEFAULT_SEED, repeats=DEFAULT_REPEATS):
+    """
+    time one benchmark at one size. the input is rebuilt from the seed before every repeat, and only the call being
+    benchmarked is timed
+    :return: a dict of the benchmark, its size, the fastest time and any extra figures it reports
+    """
+    setup, _ = BENCHMARKS[name]
+    timings = []
+    extra = None
+    for _ in range(repeats):
+        run = setup(size, random.Random(seed))
+        started = time.perf_counter()
+        extra = run()
+        timings.append(time.perf_counter() - started)
+
+    result = {'benchmark': name, 'size': size, 'seed': seed, 'repeats': repeats, 'seconds': min(timings)}
+    if extra:
+        result.update(extra)
+        if 'cycles' in extra and result['seconds'] > 0:
+            result['cycles_per_second'] = extra['cycles'] / result['seconds']
+    return result
+
+
+def run_benchmarks(names=None, seed=DEFAULT_SEED, repeats=DEFAULT_REPEATS, max_size=None):
+    """
+    :param names: the benchmarks to run, all of them by default
+    :param max_size: skip sizes above this, e.g. for a quick check
+    :return: a generator of results, one per benchmark and size
+    """
+    names = list(BENCHMARKS) if names is None else list(names)
+    for name in names:
+        if name not in BENCHMARKS:
+            raise KeyError('No benchmark named {}. Available benchmarks: {}'.format(name, ', '.join(BENCHMARKS)))
+    for name in names:
+        for size in BENCHMARKS[name][1]:
+            if max_size is None or size <= max_size:
+                yield run_benchmark(name, size, seed=seed, repeats=repeats)
+
+
+def write_results(results, path):
+    """
+    write the results, along with the machine they were taken on, as JSON
+    """
+    report = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'results': list(results),
+    }
+    with open(path, 'w') as results_file:
+        json.dump(report, results_file, indent=2)
+    return report
+
+
+def compare_to_baseline(results, baseline_path, tolerance=DEFAULT_TOLERANCE):
+    """
+    :param results: results from run_benchmarks
+    :param baseline_path: a file written by write_results
+    :param tolerance: the fraction slower than the baseline a benchmark may get
+    :return: a list of (benchmark, size, baseline seconds, seconds) for every benchmark that got too slow
+    benchmarks missing from the baseline are not compared
+    """
+    with open(baseline_path) as baseline_file:
+        baseline = {(result['benchmark'], result['size']): result for result in json.load(baseline_file)['results']}
+    regressions = []
+    for result in results:
+        previous = baseline.get((result['benchmark'], result['size']))
+        if previous is not None and result['seconds'] > previous['seconds'] * (1 + tolerance):
+            regressions.append((result['benchmark'], result['size'], previous['seconds'], result['seconds']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the simulator kernels and strategies.')
+    parser.add_argument('--output', required=True, help='where to write the results')
+    parser.add_argument('--baseline', help='results to compare against')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='fraction slower than the baseline that counts as a regression')
+    parser.add_argument('--benchmark', action='append', dest='names', choices=sorted(BENCHMARKS),
+                        help='only run this benchmark, may be given more than once')
+    parser.add_argument('--max-size', type=int, help='skip sizes above this')
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    args = parser.parse_args(argv)
+
+    results = []
+    for result in run_benchmarks(args.names, seed=args.seed, repeats=args.repeats, max_size=args.max_size):
+        print('{benchmark:<58} {size:>7} {seconds:>10.4f}s'.format(**result))
+        results.append(result)
+    write_results(results, args.output)
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, tolerance=args.tolerance)
+        for name, size, baseline_seconds, seconds in regressions:
+            print('REGRESSION {} at size {}: {:.4f}s -> {:.4f}s'.format(name, size, baseline_seconds, seconds))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+import heapq
+
+from Services.profiling_service import profiler
+
+
+class ChargingQueue:
+    """
+    queue of outstanding charging requests, most urgent first
+    Urgency is when the requester is predicted to run empty, in a measure that does not go stale while it waits.
+    Every device drains by the same amount at a time, so the simulations use the reading of the plane's drain clock at
+    which the requester runs out, i.e. what its row stores in PeripheralState. A charge taken at the time of the request
+    would not do: requests made at different times would be compared on charges from different moments.
+
+    Requests are kept in a heap with lazy deletion, plus a dict of live requests for O(1) membership and a dict of
+    requests per cluster so that serving a cluster clears all of its requests at once.
+    """
+
+    REMOVED = None  # marks a heap entry whose request was withdrawn
+
+    def __init__(self):
+        self.heap = []
+        self.requests = {}  # requester: heap entry
+        self.requests_by_cluster = {}  # cluster id: set of requesters
+        self.sequence = 0  # requests with the same urgency are served in the order they were made
+
+    def __len__(self):
+        return len(self.requests)
+
+    def __contains__(self, requester):
+        return requester in self.requests
+
+    @profiler.timed('charging_queue.push')
+    def push(self, requester, runs_empty_at, cluster_id=None):
+        """
+        add a charging request. a requester already in the queue keeps its place
+        :param requester: a hashable handle for the device, e.g. its row in the plane's state store
+        :param runs_empty_at: when the requester runs empty, on a clock shared by every request. lower is served first
+        :param cluster_id: the cluster the requester belongs to, for remove_cluster
+        :return: True if the request was added
+        """
+        if requester in self.requests:
+            profiler.count('charging_queue.duplicate_requests')
+            return False
+        entry = [runs_empty_at, self.sequence, requester, cluster_id]
+        self.sequence += 1
+        self.requests[requester] = entry
+        if cluster_id is not None:
+            self.requests_by_cluster.setdefault(cluster_id, set()).add(requester)
+        heapq.heappush(self.heap, entry)
+        return True
+
+    @profiler.timed('charging_queue.pop')
+    def pop(self):
+        """
+        :return: the most urgent requester, which is removed from the queue
+        raises IndexError if the queue is empty
+        """
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            requester = entry[2]
+            if requester is not ChargingQueue.REMOVED:
+                self._forget(requester, entry[3])
+                return requester
+            profiler.count('charging_queue.withdrawn_skipped')
+        raise IndexError('pop from an empty charging queue')
+
+    def peek(self):
+        """
+        :return: the most urgent requester without removing it, or None if the queue is empty
+        """
+        while self.heap and self.heap[0][2] is ChargingQueue.REMOVED:
+            heapq.heappop(self.heap)
+        return self.heap[0][2] if self.heap else None
+
+    @profiler.timed('charging_queue.remove')
+    def remove(self, requester):
+        """
+        withdraw a request, if there is one
+        """
+        entry = self.requests.get(requester)
+        if entry is None:
+            return
+        self._forget(requester, entry[3])
+        entry[2] = ChargingQueue.REMOVED
+        self._compact()
+
+    @profiler.timed('charging_queue.remove_cluster')
+    def remove_cluster(self, cluster_id):
+        """
+        withdraw every request from a cluster, e.g. once the charger has been through it
+        :return: the number of requests withdrawn
+        """
+        requesters = self.requests_by_cluster.pop(cluster_id, ())
+        for requester in requesters:
+            entry = self.requests.pop(requester)
+            entry[2] = ChargingQueue.REMOVED
+        profiler.count('charging_queue.cluster_withdrawals', len(requesters))
+        self._compact()
+        return len(requesters)
+
+    def get_requesters(self):
+        """
+        :return: the live requests as (requester, runs_empty_at, cluster_id), most urgent first
+        """
+        return [(entry[2], entry[0], entry[3]) for entry in sorted(self.requests.values())]
+
+    def _forget(self, requester, cluster_id):
+        del self.requests[requester]
+        if cluster_id is not None:
+            members = self.requests_by_cluster[cluster_id]
+            members.discard(requester)
+            if not members:
+                del self.requests_by_cluster[cluster_id]
+
+    def _compact(self):
+        # withdrawn entries are dropped lazily, rebuild once they make up most of the heap
+        if len(self.heap) > 2 * len(self.requests) + 32:
+            profiler.count('charging_queue.compactions', len(self.heap) - len(self.requests))
+            self.heap = [entry for entry in self.heap if entry[2] is not ChargingQueue.REMOVED]
+            heapq.heapify(self.heap)
@@ -0,0 +1,155 @@
+import random
+
+import numpy as np
+
+
+class Occupancy:
+    """
+    records which cells of a plane hold a peripheral or charging station
+    Starts out as a hash set of occupied cells and switches to a packed bitmap (one bit per cell) once the plane is
+    dense enough that the bitmap is the smaller of the two. Either way checking, claiming and releasing a cell is O(1)
+    """
+
+    BITMAP_FRACTION = 0.01  # switch to a bitmap once this fraction of the plane is occupied
+    FREE_LIST_FRACTION = 0.5  # past this fraction, free cells are sampled from a list instead of by rejection
+
+    def __init__(self, width, height):
+        if not isinstance(width, int) or not isinstance(height, int):
+            raise TypeError
+        self.width = width
+        self.height = height
+        self.area = width * height
+        self.count = 0
+        self.occupied = set()
+        self.bitmap = None
+        # built lazily once the plane is mostly full. may hold stale cells, which are dropped when sampled
+        self.free_cells = None
+        self.free_count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _key(self, x_coord, y_coord):
+        if not (0 <= x_coord < self.width and 0 <= y_coord < self.height):
+            raise IndexError('({}, {}) is outside of the {}x{} plane.'.format(x_coord, y_coord, self.width,
+                                                                              self.height))
+        return x_coord * self.height + y_coord
+
+    def _is_set(self, key):
+        if self.bitmap is None:
+            return key in self.occupied
+        return self.bitmap[key >> 3] >> (key & 7) & 1 == 1
+
+    def is_occupied(self, x_coord, y_coord):
+        return self._is_set(self._key(x_coord, y_coord))
+
+    def occupy(self, x_coord, y_coord):
+        """
+        claim a cell
+        raises IndexError if the cell is taken or outside of the plane
+        """
+        key = self._key(x_coord, y_coord)
+        if self._is_set(key):
+            raise IndexError('({}, {}) is already occupied.'.format(x_coord, y_coord))
+        if self.bitmap is None:
+            self.occupied.add(key)
+        else:
+            self.bitmap[key >> 3] |= 1 << (key & 7)
+        self.count += 1
+        if self.bitmap is None and self.count > Occupancy.BITMAP_FRACTION * self.area:
+            self._switch_to_bitmap()
+
+    def occupy_many(self, x_coords, y_coords):
+        """
+        claim many cells at once, e.g. for a layout loaded from a scenario file
+        raises IndexError, without claiming anything, if any cell is taken, outside of the plane or given twice
+        """
+        x_coords = np.asarray(x_coords, dtype=np.int64)
+        y_coords = np.asarray(y_coords, dtype=np.int64)
+        outside = (x_coords < 0) | (x_coords >= self.width) | (y_coords < 0) | (y_coords >= self.height)
+        if outside.any():
+            position = int(np.argmax(outside))
+            self._key(int(x_coords[position]), int(y_coords[position]))
+        keys = x_coords * self.height + y_coords
+        sorted_keys = np.sort(keys)
+        if (sorted_keys[1:] == sorted_keys[:-1]).any():
+            raise IndexError('The same cell is claimed more than once.')
+        if self.bitmap is None:
+            taken = np.isin(keys, np.fromiter(self.occupied, dtype=np.int64, count=len(self.occupied)))
+        else:
+            taken = self._get_bits(keys)
+        if taken.any():
+            position = int(np.argmax(taken))
+            raise IndexError('({}, {}) is already occupied.'.format(int(x_coords[position]),
+                                                                     int(y_coords[position])))
+
+        self.count += len(keys)
+        if self.bitmap is None and self.count > Occupancy.BITMAP_FRACTION * self.area:
+            self._switch_to_bitmap()
+        if self.bitmap is None:
+            self.occupied.update(keys.tolist())
+        else:
+            np.bitwise_or.at(np.frombuffer(self.bitmap, dtype=np.uint8), keys >> 3,
+                             np.left_shift(1, keys & 7).astype(np.uint8))
+
+    def _get_bits(self, keys):
+        bitmap = np.frombuffer(self.bitmap, dtype=np.uint8)
+        return (bitmap[keys >> 3] >> (keys & 7)) & 1 == 1
+
+    def release(self, x_coord, y_coord):
+        """
+        free up a cell, e.g. when a peripheral moves away
+        """
+        key = self._key(x_coord, y_coord)
+        if not self._is_set(key):
+            return
+        if self.bitmap is None:
+            self.occupied.discard(key)
+        else:
+            self.bitmap[key >> 3] &= ~(1 << (key & 7)) & 0xFF
+        self.count -= 1
+        if self.free_cells is not None:
+            if self.free_count == len(self.free_cells):
+                self.free_cells = np.resize(self.free_cells, max(2 * self.free_count, 1))
+            self.free_cells[self.free_count] = key
+            self.free_count += 1
+
+    def _switch_to_bitmap(self):
+        self.bitmap = bytearray((self.area + 7) // 8)
+        for key in self.occupied:
+            self.bitmap[key >> 3] |= 1 << (key & 7)
+        self.occupied = None
+
+    def _build_free_cells(self):
+        bits = np.unpackbits(np.frombuffer(self.bitmap, dtype=np.uint8), bitorder='little')[:self.area]
+        self.free_cells = np.flatnonzero(bits == 0)
+        self.free_count = len(self.free_cells)
+
+    def random_free_cell(self, rng=random):
+        """
+        pick a free cell uniformly at random
+        :param rng: the random.Random instance to draw from
+        :return: the (x, y) coordinates of the cell, which is not claimed by this call
+        raises IndexError if the plane is full
+        """
+        if self.count >= self.area:
+            raise IndexError('There are no free cells left in the plane.')
+
+        if self.count <= Occupancy.FREE_LIST_FRACTION * self.area:
+            # at least half the plane is free, so this takes fewer than two tries on average
+            while True:
+                key = rng.randrange(self.area)
+                if not self._is_set(key):
+                    return divmod(key, self.height)
+
+        if self.free_cells is None:
+            self._build_free_cells()
+        while self.free_count > 0:
+            position = rng.randrange(self.free_count)
+            key = int(self.free_cells[position])
+            if not self._is_set(key):
+                return divmod(key, self.height)
+            # the cell was claimed since the list was built, swap it out
+            self.free_count -= 1
+            self.free_cells[position] = self.free_cells[self.free_count]
+        raise IndexError('There are no free cells left in the plane.')
@@ -0,0 +1,307 @@
+import heapq
+
+import numpy as np
+
+from Services.profiling_service import profiler
+
+
+class PeripheralState:
+    """
+    struct-of-arrays store holding the energy state of every device in a plane
+    Peripheral and ChargingNode objects only remember their row in these arrays, so energy loss, charging and
+    failure checks can be done for the whole plane at once instead of walking the peripherals one at a time
+
+    Every draining row loses the same amount at a time, so instead of taking it off each of them the store keeps a
+    drain clock of everything drained so far. A draining row stores its charge plus the clock, i.e. the reading of
+    the clock at which it runs out, and its charge is that minus the current reading. Draining the plane only moves
+    the clock and the row left out of a drain gets the amount added back, so both are O(1) however many rows there
+    are. Rows that do not drain store their charge as it is.
+    The rows closest to running out are kept in a heap on what they store, so finding the rows that ran out is a look
+    at the top of the heap rather than a pass over the plane.
+    """
+
+    INITIAL_SIZE = 64
+    NO_CLUSTER = -1
+    NO_THRESHOLD = np.nan
+    DEPLETION_HEAP_SIZE = 256  # watched rows brought into the depletion heap at a time
+
+    def __init__(self, initial_size=INITIAL_SIZE):
+        initial_size = max(int(initial_size), 1)
+        self.size = 0
+        self.location = np.zeros((initial_size, 2), dtype=np.int64)
+        self.charge_capacity = np.zeros(initial_size, dtype=np.float64)
+        # the charge plus the drain clock for draining rows, the charge for the others. read through get_charges
+        self.stored_charge = np.zeros(initial_size, dtype=np.float64)
+        self.charge_threshold = np.full(initial_size, PeripheralState.NO_THRESHOLD, dtype=np.float64)
+        self.cluster_id = np.full(initial_size, PeripheralState.NO_CLUSTER, dtype=np.int64)
+        # only draining rows lose energy over time. the master charger recharges at its station and does not
+        self.draining = np.zeros(initial_size, dtype=bool)
+        # the object owning each row, so that vectorized checks can hand back peripherals
+        self.owners = []
+
+        # what every draining row has lost so far
+        self.drain_clock = 0.0
+        # rows watched for running out: those draining, with capacity and not already handed back as depleted
+        self.watched = np.zeros(initial_size, dtype=bool)
+        # (stored charge, row) with lazy deletion. holds every watched row storing at most depletion_heap_limit,
+        # the others are only brought in once the heap runs dry
+        self.depletion_heap = []
+        self.depletion_heap_limit = -np.inf
+
+    def __len__(self):
+        return self.size
+
+    def add(self, owner, x_location, y_location, charge_capacity=0, current_charge=0, draining=True):
+        """
+        append a new row to the store
+        :param owner: the object that this row describes
+        :return: the row index assigned to the owner
+        """
+        if self.size == len(self.stored_charge):
+            self._grow()
+        row = self.size
+        self.location[row] = (x_location, y_location)
+        self.charge_capacity[row] = charge_capacity
+        self.stored_charge[row] = current_charge + self.drain_clock if draining else current_charge
+        self.charge_threshold[row] = PeripheralState.NO_THRESHOLD
+        self.cluster_id[row] = PeripheralState.NO_CLUSTER
+        self.draining[row] = draining
+        self.owners.append(owner)
+        self.size += 1
+        self._watch(row)
+        return row
+
+    def add_many(self, owners, x_locations, y_locations, charge_capacities, current_charges, draining=True):
+        """
+        append a row per owner in one go
+        :param owners: the objects the new rows describe, in order
+        :return: the row indices assigned to the owners
+        """
+        rows = np.arange(self.size, self.size + len(owners), dtype=np.int64)
+        if self.size + len(owners) > len(self.stored_charge):
+            self._grow(self.size + len(owners))
+        self.location[rows, 0] = x_locations
+        self.location[rows, 1] = y_locations
+        self.charge_capacity[rows] = charge_capacities
+        self.charge_threshold[rows] = PeripheralState.NO_THRESHOLD
+        self.cluster_id[rows] = PeripheralState.NO_CLUSTER
+        self.draining[rows] = draining
+        self.stored_charge[rows] = current_charges + self.drain_clock * self.draining[rows]
+        self.owners.extend(owners)
+        self.size += len(owners)
+        self._watch_many(rows)
+        return rows
+
+    def _grow(self, minimum_size=0):
+        """
+        double the capacity of every column, or more to fit minimum_size rows. rows are kept as indices, never as
+        references into the arrays, so reallocating here is always safe
+        """
+        new_size = 2 * len(self.stored_charge)
+        while new_size < minimum_size:
+            new_size *= 2
+        self.location = np.resize(self.location, (new_size, 2))
+        self.charge_capacity = np.resize(self.charge_capacity, new_size)
+        self.stored_charge = np.resize(self.stored_charge, new_size)
+        self.charge_threshold = np.resize(self.charge_threshold, new_size)
+        self.cluster_id = np.resize(self.cluster_id, new_size)
+        self.draining = np.resize(self.draining, new_size)
+        self.watched = np.resize(self.watched, new_size)
+
+    def get_locations(self, rows=None):
+        locations = self.location[:self.size]
+        return locations if rows is None else locations[rows]
+
+    def get_charge(self, row):
+        if self.draining[row]:
+            return float(self.stored_charge[row]) - self.drain_clock
+        return float(self.stored_charge[row])
+
+    def get_charges(self, rows=None):
+        """
+        :return: a new array of the charges of every row, or of the given rows
+        """
+        if rows is None:
+            rows = slice(0, self.size)
+        return self.stored_charge[rows] - self.drain_clock * self.draining[rows]
+
+    def get_draining_rows(self):
+        return np.flatnonzero(self.draining[:self.size])
+
+    @profiler.timed('drain')
+    def drain(self, amount, exclude=None):
+        """
+        every draining row loses the same amount of energy
+        :param amount: the energy lost by each row
+        :param exclude: an optional row that keeps its charge, e.g. the peripheral currently being charged
+        """
+        self.drain_clock += amount
+        if exclude is not None and self.draining[exclude]:
+            # the excluded row is now further from running out than the others
+            profiler.count('drain.excluded_rows')
+            self.stored_charge[exclude] += amount
+            self._watch(exclude)
+
+    @profiler.timed('drain_ticks')
+    def drain_ticks(self, ticks):
+        """
+        every draining row loses 1 per tick, for a number of ticks
+        :param ticks: the number of ticks
+        """
+        if ticks > 0:
+            profiler.count('drain_ticks.ticks', ticks)
+            self.drain_clock += ticks
+
+    def get_ticks_until_below_threshold(self, rows=None):
+        """
+        how many drain_ticks it takes until a row is at or below its charge threshold
+        :param rows: the rows to watch, every draining row by default. rows without a threshold are ignored
+        :return: the number of ticks, at least 1, or None if no watched row will ever cross its threshold
+        """
+        if rows is None:
+            rows = np.flatnonzero(self.draining[:self.size])
+        else:
+            rows = np.asarray(rows, dtype=np.int64)
+            rows = rows[self.draining[rows]]
+        rows = rows[~np.isnan(self.charge_threshold[rows])]
+        if len(rows) == 0:
+            return None
+        stored_charges = self.stored_charge[rows]
+        thresholds = self.charge_threshold[rows]
+        ticks = np.maximum(np.ceil(stored_charges - self.drain_clock - thresholds), 1)
+        # the estimate is rounded, so nudge the count to the first tick whose charge, read the way get_charges reads
+        # it once the clock has moved on, really qualifies
+        ticks = np.where((ticks > 1) & (stored_charges - (self.drain_clock + (ticks - 1)) <= thresholds),
+                         ticks - 1, ticks)
+        ticks = np.where(stored_charges - (self.drain_clock + ticks) > thresholds, ticks + 1, ticks)
+        return int(ticks.min())
+
+    def transfer(self, source_row, target_row, amount):
+        """
+        move energy from one row to another
+        """
+        self.stored_charge[source_row] -= amount
+        self.stored_charge[target_row] += amount
+        self._watch(source_row)
+        self._watch(target_row)
+
+    def set_charge(self, rows, charge):
+        """
+        :param rows: a row or an array of rows
+        :param charge: the new charge, or an array of one per row
+        """
+        self.stored_charge[rows] = charge + self.drain_clock * self.draining[rows]
+        self._watch_rows(rows)
+
+    def set_charge_capacity(self, rows, charge_capacity):
+        self.charge_capacity[rows] = charge_capacity
+        self._watch_rows(rows)
+
+    def set_draining(self, rows, draining=True):
+        charges = self.get_charges(rows)
+        self.draining[rows] = draining
+        self.stored_charge[rows] = charges + self.drain_clock * self.draining[rows]
+        self._watch_rows(rows)
+
+    def _watch_rows(self, rows):
+        if isinstance(rows, (int, np.integer)):
+            self._watch(rows)
+        else:
+            self._watch_many(rows)
+
+    def _watch(self, row):
+        """
+        start or stop watching a row after its charge, capacity or draining changed
+        only draining rows with some capacity are watched
+        """
+        watched = bool(self.draining[row] and self.charge_capacity[row] > 0)
+        self.watched[row] = watched
+        if watched:
+            stored_charge = float(self.stored_charge[row])
+            if stored_charge <= self.depletion_heap_limit:
+                heapq.heappush(self.depletion_heap, (stored_charge, int(row)))
+
+    def _watch_many(self, rows):
+        rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+        watched = self.draining[rows] & (self.charge_capacity[rows] > 0)
+        self.watched[rows] = watched
+        stored_charges = self.stored_charge[rows]
+        near = watched & (stored_charges <= self.depletion_heap_limit)
+        for stored_charge, row in zip(stored_charges[near].tolist(), rows[near].tolist()):
+            heapq.heappush(self.depletion_heap, (stored_charge, row))
+
+    def _refill_depletion_heap(self):
+        """
+        rebuild the heap from the DEPLETION_HEAP_SIZE watched rows closest to running out, dropping stale entries
+        """
+        rows = np.flatnonzero(self.watched[:self.size])
+        profiler.count('depletion_heap.refills', len(rows))
+        stored_charges = self.stored_charge[rows]
+        if len(rows) > PeripheralState.DEPLETION_HEAP_SIZE:
+            limit = float(np.partition(stored_charges, PeripheralState.DEPLETION_HEAP_SIZE - 1)[
+                PeripheralState.DEPLETION_HEAP_SIZE - 1])
+            near = stored_charges <= limit
+            rows, stored_charges = rows[near], stored_charges[near]
+        else:
+            limit = np.inf
+        self.depletion_heap = list(zip(stored_charges.tolist(), rows.tolist()))
+        heapq.heapify(self.depletion_heap)
+        self.depletion_heap_limit = limit
+
+    @profiler.timed('pop_depleted_rows')
+    def pop_depleted_rows(self):
+        """
+        find the watched rows that have run out of charge. a row is only handed back once, and watched again when its
+        charge, capacity or draining is next changed
+        a row has run out once the drain clock reaches what it stores, which is the same comparison as its charge
+        being at most 0, so no rounding is involved. unlike get_failed_rows this does not look at rows that are
+        nowhere near running out
+        :return: list of the rows, in row order
+        """
+        depleted = []
+        while True:
+            if self.depletion_heap and self.depletion_heap[0][0] <= self.drain_clock:
+                stored_charge, row = heapq.heappop(self.depletion_heap)
+                if not self.watched[row] or self.stored_charge[row] != stored_charge:
+                    # the row has been charged or stopped draining since this entry was made
+                    profiler.count('depletion_heap.stale_skipped')
+                    continue
+                self.watched[row] = False
+                depleted.append(row)
+            elif self.depletion_heap_limit < self.drain_clock:
+                self._refill_depletion_heap()
+            else:
+                break
+        depleted.sort()
+        return depleted
+
+    def set_charge_threshold(self, percentage, rows=None):
+        """
+        set the charge value at which a row asks to be charged, as a percentage of its capacity
+        """
+        if rows is None:
+            rows = slice(0, self.size)
+        self.charge_threshold[rows] = percentage / 100 * self.charge_capacity[rows]
+
+    def get_failed_rows(self, rows=None):
+        """
+        :return: the draining rows (or the given rows) with no charge left
+        """
+        if rows is None:
+            return np.flatnonzero(self.draining[:self.size] & (self.stored_charge[:self.size] <= self.drain_clock))
+        rows = np.asarray(rows, dtype=np.int64)
+        return rows[self.get_charges(rows) <= 0]
+
+    def get_rows_below_threshold(self, rows=None):
+        """
+        :return: the draining rows (or the given rows) at or below their charge threshold
+        rows without a threshold never qualify
+        """
+        if rows is None:
+            return np.flatnonzero(self.draining[:self.size] & (self.get_charges() <= self.charge_threshold[:self.size]))
+        rows = np.asarray(rows, dtype=np.int64)
+        return rows[self.get_charges(rows) <= self.charge_threshold[rows]]
+
+    def any_below_threshold(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        return bool(np.any(self.get_charges(rows) <= self.charge_threshold[rows]))
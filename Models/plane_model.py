@@ -1,3 +1,10 @@
+import numpy as np
+
+from Models.occupancy_model import Occupancy
+from Models.peripheral_state_model import PeripheralState
+from Services.profiling_service import profiler
+
+
 class Plane:
     def __init__(self, x_axis_size, y_axis_size):
         """
@@ -10,11 +17,15 @@ class Plane:
             raise TypeError
         self.x_axis_size = x_axis_size
         self.y_axis_size = y_axis_size
-        self.plane = [[0 for _ in range(y_axis_size)] for _ in range(x_axis_size)]
+        # only the occupied cells are recorded, the plane itself is never materialized
+        self.occupancy = Occupancy(x_axis_size, y_axis_size)
         self.chargers = []
         self.charging_stations = []
         self.peripherals = []
         self.cluster_list = None
+        self.clusters_by_id = {}
+        # energy state of every peripheral and charger lives here, the objects themselves are views over it
+        self.state = PeripheralState()
 
     def get_number_of_peripherals(self):
         return len(self.peripherals)
@@ -26,28 +37,91 @@ class Plane:
         return self.y_axis_size
 
     def get_coord(self, x_coord, y_coord):
-        if self.plane[x_coord][y_coord] != 0:
-            return self.plane[x_coord][y_coord]
-        else:
-            return 0
+        """
+        :return: 1 if the coordinate is occupied, 0 otherwise
+        """
+        return 1 if self.occupancy.is_occupied(x_coord, y_coord) else 0
 
     def is_occupied(self, x_coord, y_coord):
         """
         check whether or not a given coordinate is occupied
         """
-        if self.plane[x_coord][y_coord] != 0:
-            return True
-        return False
+        return self.occupancy.is_occupied(x_coord, y_coord)
+
+    def release(self, x_coord, y_coord):
+        """
+        free up a cell, e.g. when a peripheral moves away
+        """
+        self.occupancy.release(x_coord, y_coord)
+
+    def occupy(self, x_coord, y_coord):
+        """
+        claim a coordinate for a peripheral or charging station
+        raises IndexError if it is already taken or outside of the plane
+        """
+        self.occupancy.occupy(x_coord, y_coord)
+
+    def get_random_free_coord(self, rng=None):
+        """
+        :param rng: optional random.Random instance to draw from
+        :return: a uniformly chosen unoccupied coordinate. it is not claimed by this call
+        """
+        if rng is None:
+            return self.occupancy.random_free_cell()
+        return self.occupancy.random_free_cell(rng)
 
     def add_peripheral(self, peripheral):
         self.peripherals.append(peripheral)
 
+    def add_peripherals(self, x_locations, y_locations, charge_capacities, current_charges):
+        """
+        place many peripherals at once, e.g. a layout loaded from a scenario file
+        raises IndexError, without placing any of them, if a location is taken, outside of the plane or repeated
+        :return: the new peripherals, in the order given
+        """
+        self.occupancy.occupy_many(x_locations, y_locations)
+        start = self.state.size
+        peripherals = [Peripheral.from_row(self, row) for row in range(start, start + len(x_locations))]
+        self.state.add_many(peripherals, x_locations, y_locations, charge_capacities, current_charges)
+        self.peripherals.extend(peripherals)
+        return peripherals
+
     def add_charger(self, charger):
         self.chargers.append(charger)
 
     def add_charging_station(self, charging_station):
         self.charging_stations.append(charging_station)
 
+    def set_draining(self, device, draining=True):
+        """
+        choose whether a device loses energy over time along with the peripherals
+        used for dedicated chargers, which sit in the field like any other peripheral
+        """
+        self.state.set_draining(device.row, draining)
+
+    def drain_peripherals(self, amount, excluded_peripheral=None):
+        """
+        every draining device in the plane loses the same amount of energy
+        :param amount: the energy lost by each device
+        :param excluded_peripheral: an optional device that keeps its charge, e.g. the one being charged
+        """
+        exclude = excluded_peripheral.row if excluded_peripheral is not None else None
+        self.state.drain(amount, exclude=exclude)
+
+    def get_failed_peripherals(self):
+        """
+        :return: the draining devices that have run out of charge, in the order they were added to the plane
+        """
+        return [self.state.owners[row] for row in self.state.get_failed_rows()]
+
+    def get_peripherals_below_threshold(self):
+        """
+        :return: the draining devices at or below their charge threshold, in the order they were added to the plane
+        """
+        return [self.state.owners[row] for row in self.state.get_rows_below_threshold()]
+
+    @profiler.timed('generate_clusters',
+                    items=lambda plane, peripherals_list=(), *args, **kwargs: len(peripherals_list))
     def generate_clusters(self, peripherals_list=[], max_distance_between_point_and_centroid=1):
         """
         generate a series of clusters that the charging node can operate on
@@ -62,46 +136,42 @@ class Plane:
         if len(peripherals_list) == 0:
             return []
 
+        for peripheral in peripherals_list:
+            if type(peripheral) != Peripheral:
+                raise TypeError
+
+        from Services.spatial_index_service import GridIndex
+        # every radius query only has to look at the grid cells next to the centroid
+        rows = np.array([peripheral.row for peripheral in peripherals_list], dtype=np.int64)
+        locations = self.state.get_locations(rows)
+        cell_size = max_distance_between_point_and_centroid if max_distance_between_point_and_centroid > 0 else 1
+        index = GridIndex(locations, cell_size=cell_size)
+
         cluster_list = []
-        centroid_set = False
-        current_cluster_list = []
-        centroid_location_x = 0
-        centroid_location_y = 0
         id = 0
         # clear previous cluster list, if one exists
         if not self.cluster_list:
             self.cluster_list = None
 
-        while len(peripherals_list) > 0:
-            if not centroid_set:
-                # grab the next available peripheral and begin populating the new cluster
-                centroid = peripherals_list.pop()
-                if type(centroid) != Peripheral:
-                    raise TypeError
-                centroid_set = True
-                current_cluster_list.append(centroid)
-                centroid_location_x, centroid_location_y = centroid.get_location()
-                # we just removed the last peripheral, no need to check for adjacent points
-                if len(peripherals_list) == 0:
-                    cluster_list.append(Cluster(peripheral_list=current_cluster_list, id=id))
-            else:
-                from Services.simulation_services import get_distance_between
-                # centroid already set, we want all points within the allowed distance from it
-                for peripheral in peripherals_list:
-                    p_x, p_y = peripheral.get_location()
-                    if get_distance_between(location_1=(centroid_location_x, centroid_location_y),
-                                            location_2=(p_x, p_y)) \
-                            <= max_distance_between_point_and_centroid:
-                        p = peripherals_list.pop(peripherals_list.index(peripheral))
-                        current_cluster_list.append(p)
-
-                cluster_list.append(Cluster(peripheral_list=current_cluster_list, id=id))
-                id += 1
-                current_cluster_list = []
-                centroid_set = False
+        # centroids are taken from the back of the list, everything within range of them joins their cluster
+        for centroid_index in range(len(peripherals_list) - 1, -1, -1):
+            if not index.alive[centroid_index]:
+                continue
+            index.remove(centroid_index)
+            member_indices = index.query_radius(locations[centroid_index], max_distance_between_point_and_centroid)
+            index.remove(member_indices)
+
+            current_cluster_list = [peripherals_list[centroid_index]]
+            current_cluster_list.extend(peripherals_list[i] for i in member_indices.tolist())
+            cluster_list.append(Cluster(peripheral_list=current_cluster_list, id=id))
+            id += 1
+
+        # every peripheral is now in a cluster, the list is refilled below
+        del peripherals_list[:]
 
         # update the model with the new cluster list
         self.cluster_list = cluster_list
+        self.clusters_by_id = {cluster.get_id(): cluster for cluster in cluster_list}
 
         # the order of elements in a list persists, so we know that the first element of every cluster is the centroid
         # that is what will be used later in the sim
@@ -128,20 +198,78 @@ class Plane:
 
 
 class Peripheral:
+    # no per-instance dict: a peripheral is only a view over its row, and there can be millions of them
+    __slots__ = ('plane', 'row')
+
     def __init__(self, x_location, y_location, plane, charge_capacity=0, current_charge=0):
-        # double checking that the location is available
-        if plane.plane[x_location][y_location] != 0:
-            raise IndexError
-        self.x_location = x_location
-        self.y_location = y_location
-        self.charge_capacity = charge_capacity
-        self.current_charge = current_charge
+        # claiming the location fails with an IndexError if it is not available
+        plane.occupy(x_location, y_location)
         self.plane = plane
+        # all energy state lives in the plane's state store, this object is only a view over its row
+        self.row = plane.state.add(self, x_location, y_location, charge_capacity=charge_capacity,
+                                   current_charge=current_charge, draining=True)
         # other classes inherit from here
         if type(self) == Peripheral:
             self.plane.add_peripheral(self)
-        self.charge_threshold = None
-        self.cluster = None
+
+    @classmethod
+    def from_row(cls, plane, row):
+        """
+        a view over a row that is already in the plane's state store, e.g. one restored from a checkpoint
+        the location is not claimed again and the device is not added to the plane's lists
+        """
+        device = cls.__new__(cls)
+        device.plane = plane
+        device.row = row
+        return device
+
+    @property
+    def x_location(self):
+        return int(self.plane.state.location[self.row, 0])
+
+    @property
+    def y_location(self):
+        return int(self.plane.state.location[self.row, 1])
+
+    @property
+    def charge_capacity(self):
+        return float(self.plane.state.charge_capacity[self.row])
+
+    @charge_capacity.setter
+    def charge_capacity(self, value):
+        self.plane.state.set_charge_capacity(self.row, value)
+
+    @property
+    def current_charge(self):
+        return self.plane.state.get_charge(self.row)
+
+    @current_charge.setter
+    def current_charge(self, value):
+        self.plane.state.set_charge(self.row, value)
+
+    @property
+    def charge_threshold(self):
+        threshold = self.plane.state.charge_threshold[self.row]
+        return None if threshold != threshold else float(threshold)
+
+    @charge_threshold.setter
+    def charge_threshold(self, value):
+        self.plane.state.charge_threshold[self.row] = PeripheralState.NO_THRESHOLD if value is None else value
+
+    @property
+    def cluster(self):
+        cluster_id = int(self.plane.state.cluster_id[self.row])
+        if cluster_id == PeripheralState.NO_CLUSTER:
+            return None
+        return self.plane.clusters_by_id.get(cluster_id)
+
+    @cluster.setter
+    def cluster(self, cluster):
+        if cluster is None:
+            self.plane.state.cluster_id[self.row] = PeripheralState.NO_CLUSTER
+        else:
+            self.plane.clusters_by_id.setdefault(cluster.get_id(), cluster)
+            self.plane.state.cluster_id[self.row] = cluster.get_id()
 
     def get_location(self):
         """
@@ -177,17 +305,17 @@ class Peripheral:
         :param percentage: The percentage of the total charge that a peripheral needs to fall below for transmission
             This value can range from 0 to 100
         """
-        self.charge_threshold = percentage / 100 * self.charge_capacity
+        self.plane.state.set_charge_threshold(percentage, rows=self.row)
 
 
 class ChargingNode(Peripheral):
+    __slots__ = ()
+
     def __init__(self, x_location, y_location, plane, charge_capacity=0, current_charge=0):
-        super(Peripheral, self).__init__()
-        self.x_location = x_location
-        self.y_location = y_location
+        # chargers move around the plane, so they do not claim a spot the way peripherals do
         self.plane = plane
-        self.charge_capacity = charge_capacity
-        self.current_charge = current_charge
+        self.row = plane.state.add(self, x_location, y_location, charge_capacity=charge_capacity,
+                                   current_charge=current_charge, draining=False)
         self.plane.add_charger(self)
 
     def charge_self(self):
@@ -206,38 +334,31 @@ class ChargingNode(Peripheral):
         if not isinstance(amount, (float, int)):
             raise TypeError
 
-        self.current_charge -= amount
-        peripheral.current_charge += amount
+        self.plane.state.transfer(self.row, peripheral.row, amount)
 
     # TODO: break up this monolothic code
+    @profiler.timed('charge_cluster', items=lambda charger, cluster: cluster.get_size())
     def charge_cluster(self, cluster):
         from Simulation.single_charger_simulation import SingleChargerSim
         PERIPHERAL_ENERGY_LOSS_MULTIPLIER = SingleChargerSim.PERIPHERAL_ENERGY_LOSS_MULTIPLIER
 
         travel_energy_used = 0
         transfer_energy_used = 0
-        all_peripherals = cluster.plane.peripherals
+        plane = cluster.plane
 
         # first we deduct the energy to travel to the cluster
-        from Services.simulation_services import get_distance_between
-        amount_needed_to_travel_to_cluster = get_distance_between(location_1=(self.x_location, self.y_location),
-                                                                  location_2=(cluster.x_location, cluster.y_location))
+        amount_needed_to_travel_to_cluster, amount_needed_to_return_home = \
+            cluster.get_trip_distances(self.get_location())
         self.current_charge -= amount_needed_to_travel_to_cluster
         travel_energy_used += amount_needed_to_travel_to_cluster
 
         # all peripherals in the plane lose charge during initial travel time
-        for peripheral in all_peripherals:
-            peripheral.current_charge -= (amount_needed_to_travel_to_cluster * PERIPHERAL_ENERGY_LOSS_MULTIPLIER)
+        plane.drain_peripherals(amount_needed_to_travel_to_cluster * PERIPHERAL_ENERGY_LOSS_MULTIPLIER)
 
         # for now assume charger travels to all peripherals regardless of whether or not it charges them
         self.current_charge -= cluster.length_of_shortest_path
         travel_energy_used += cluster.length_of_shortest_path
 
-        final_peripheral_in_cluster = cluster.peripheral_list[cluster.shortest_path_through_cluster[-1]]
-        amount_needed_to_return_home = get_distance_between(location_1=(final_peripheral_in_cluster.x_location,
-                                                                        final_peripheral_in_cluster.y_location),
-                                                            location_2=(self.x_location, self.y_location))
-
         # now we charge the peripherals along the shortest path
         for peripheral_index in cluster.shortest_path_through_cluster:
             peripheral = cluster.peripheral_list[peripheral_index]
@@ -248,9 +369,8 @@ class ChargingNode(Peripheral):
             self.charge_peripheral(peripheral=peripheral, amount=amount_to_charge)
 
             # while charging, decrement all other peripherals but not the one being charged TODO: decrement all??
-            for p in all_peripherals:
-                if p is not peripheral:
-                    p.current_charge -= (amount_to_charge * PERIPHERAL_ENERGY_LOSS_MULTIPLIER)
+            plane.drain_peripherals(amount_to_charge * PERIPHERAL_ENERGY_LOSS_MULTIPLIER,
+                                    excluded_peripheral=peripheral)
 
             transfer_energy_used += amount_to_charge
             if self.current_charge == amount_needed_to_return_home:
@@ -261,20 +381,19 @@ class ChargingNode(Peripheral):
         travel_energy_used += amount_needed_to_return_home
 
         # all peripherals in the plane lose charge during this time
-        for peripheral in all_peripherals:
-            peripheral.current_charge -= (amount_needed_to_return_home * PERIPHERAL_ENERGY_LOSS_MULTIPLIER)
+        plane.drain_peripherals(amount_needed_to_return_home * PERIPHERAL_ENERGY_LOSS_MULTIPLIER)
 
         return travel_energy_used, transfer_energy_used
 
 
 class ChargingStation:
+    __slots__ = ('x_location', 'y_location', 'plane')
+
     def __init__(self, x_location, y_location, plane):
-        # double checking that the location is available
-        if plane.plane[x_location][y_location] != 0:
-            raise IndexError
+        # claiming the location fails with an IndexError if it is not available
+        plane.occupy(x_location, y_location)
         self.x_location = x_location
         self.y_location = y_location
-        # we want a weak reference available here
         self.plane = plane
         self.plane.add_charging_station(self)
 
@@ -286,22 +405,45 @@ class ChargingStation:
 
 
 class Cluster:
-    def __init__(self, peripheral_list, id):
+    __slots__ = ('id', 'peripheral_list', 'size', 'x_location', 'y_location', 'plane', 'rows', 'distance_matrix',
+                 'trip_distances', 'length_of_shortest_path', 'shortest_path_through_cluster', 'dedicated_charger',
+                 'diameter')
+
+    DISTANCE_MATRIX_DTYPE = np.float64  # float32 halves the memory of large clusters, but tours are no longer exact
+
+    def __init__(self, peripheral_list, id, tour=None):
+        """
+        :param peripheral_list: the members, the centroid first
+        :param id: the cluster id
+        :param tour: optional (length, path) of a tour already worked out, e.g. restored from a checkpoint, so it is
+        not solved again
+        """
         self.id = id
+        # we assume that all clusters must be in the same plane for now
+        self.plane = peripheral_list[0].get_plane()
+        self.set_members(peripheral_list)
+        if tour is None:
+            from Services import simulation_services
+            tour = simulation_services.traveling_salesman(self)
+        self.length_of_shortest_path, self.shortest_path_through_cluster = tour
+        self.dedicated_charger = None  # used in experimental multi charger algorithm
+
+    def set_members(self, peripheral_list):
+        """
+        work out everything that follows from who is in the cluster, apart from the tour
+        the first peripheral is the centroid. when the members change after the cluster is made, the caller is
+        responsible for the tour, see Services/cluster_manager_service.py
+        """
         self.peripheral_list = peripheral_list
         self.size = len(peripheral_list)
-        if self.size > 0:
-            self.x_location, self.y_location = self.peripheral_list[0].get_location()
-        else:
-            self.x_location = 0
-            self.y_location = 0
-        # we assume that all clusters must be in the same plane for now
-        self.plane = self.peripheral_list[0].get_plane()
+        self.x_location, self.y_location = self.peripheral_list[0].get_location()
+        # rows of the members in the plane's state store, for checking the whole cluster at once
+        self.rows = np.array([peripheral.row for peripheral in self.peripheral_list], dtype=np.int64)
         from Services import simulation_services
-        self.length_of_shortest_path, self.shortest_path_through_cluster = \
-            simulation_services.traveling_salesman(self)
-        self.dedicated_charger = None  # used in experimental multi charger algorithm
-        self.diameter = max(max(row) for row in simulation_services.get_distance_matrix(self))
+        # distances between the members are worked out once, the tour and the diameter both come from them
+        self.distance_matrix = simulation_services.get_distance_matrix(self, dtype=Cluster.DISTANCE_MATRIX_DTYPE)
+        self.trip_distances = {}  # charger location: distances in and out of the cluster, see get_trip_distances
+        self.diameter = float(self.distance_matrix.max())
 
     def get_location(self):
         return self.x_location, self.y_location
@@ -315,5 +457,23 @@ class Cluster:
     def get_id(self):
         return self.id
 
+    def get_distance_matrix(self):
+        return self.distance_matrix
+
+    def get_trip_distances(self, location):
+        """
+        chargers keep coming back to the same cluster from the same place, so the distances are remembered
+        :param location: where the charger comes from and returns to
+        :return: the distance from location to the centroid, and from the last peripheral on the tour back to location
+        """
+        distances = self.trip_distances.get(location)
+        if distances is None:
+            from Services.simulation_services import get_distance_between
+            final_peripheral = self.peripheral_list[self.shortest_path_through_cluster[-1]]
+            distances = (get_distance_between(location_1=location, location_2=(self.x_location, self.y_location)),
+                         get_distance_between(location_1=final_peripheral.get_location(), location_2=location))
+            self.trip_distances[location] = distances
+        return distances
+
     def set_dedicated_charger(self, charger):
         self.dedicated_charger = charger
@@ -1,20 +1,32 @@
-import datetime
+import numpy as np
+
 from Analytics.basic_analysis import *
 from Services.format_service import pretty_print
+from Services.profiling_service import profiler
 
 
 class Simulation:
-    def __init__(self, peripheral_list):
+    def __init__(self, peripheral_list, start_time=0, cluster_manager=None, statistics=None):
+        """
+        :param peripheral_list: the peripherals being simulated
+        :param start_time: the simulated time the run starts at. failure timestamps are in the same units
+        :param cluster_manager: optional Services.cluster_manager_service.ClusterManager. with one, failed peripherals
+        are taken out of their clusters so chargers stop visiting them
+        :param statistics: optional Analytics.streaming_statistics.StreamingStatistics the simulation keeps up to date,
+        reported along with the results
+        """
+        self.cluster_manager = cluster_manager
+        self.statistics = statistics
 
         self.travel_energy_used = None
         self.transfer_energy_used = None
         self.total_energy_used = None
-        self.peripheral_list_after_15_cycles = None
+        self.charges_after_15_cycles = None
         self.peripheral_list = peripheral_list
         self.time_of_peripheral_failures = {peripheral: None for peripheral in self.peripheral_list}
         self.peripheral_failure_count = 0
         self.time_of_earliest_failute = None
-        self.start_time = datetime.datetime.now()
+        self.start_time = start_time
 
         self.effective_energy_percentage = None
         self.ineffective_energy_percentage = None
@@ -22,22 +34,40 @@ class Simulation:
         self.time_until_earliest_failure = None
 
     def peripheral_failure(self, peripheral_list_index, timestamp):
+        self.record_peripheral_failure(self.peripheral_list[peripheral_list_index], timestamp)
+
+    def record_peripheral_failure(self, peripheral, timestamp):
+        """
+        :param peripheral: the peripheral found with no charge left
+        :param timestamp: when it was found
+        """
         if not self.time_of_earliest_failute:
             self.time_of_earliest_failute = timestamp
-        peripheral = self.peripheral_list[peripheral_list_index]
-        self.time_of_peripheral_failures[peripheral] = timestamp
+            # track how long the algorithm runs before a failure occurs
+            self.time_until_earliest_failure = timestamp - self.start_time
+        # a peripheral found empty again later keeps the time it first failed at
+        if self.time_of_peripheral_failures.get(peripheral) is None:
+            self.time_of_peripheral_failures[peripheral] = timestamp
         # this peripheral will no longer be charged
         # TODO: should it be?
         if peripheral.charge_capacity > 0:
             self.peripheral_failure_count += 1
         peripheral.current_charge = 0
         peripheral.charge_capacity = 0
+        if self.cluster_manager is not None and peripheral.cluster is not None:
+            # a dead peripheral is no longer drained, and its cluster's tour is repaired to go around it
+            peripheral.get_plane().set_draining(peripheral, False)
+            self.cluster_manager.remove_peripheral(peripheral)
 
-        # track how long the algorithm runs before a failure occurs
-        self.time_until_earliest_failure = timestamp - self.start_time
+    def record_charges_after_15_cycles(self):
+        # copy the charges rather than the peripherals, which keep changing for the rest of the run
+        self.charges_after_15_cycles = [peripheral.current_charge for peripheral in self.peripheral_list]
+        self.calculate_average_charge_at_15_cycles()
 
     def calculate_average_charge_at_15_cycles(self):
-        self.average_charge_at_15_cycles = average_charge_percentage(self.peripheral_list_after_15_cycles)
+        # runs that end before 15 cycles have no snapshot to average
+        if self.charges_after_15_cycles is not None:
+            self.average_charge_at_15_cycles = average_charge(self.charges_after_15_cycles)
 
     def set_effective_energy_percentage(self):
         if self.transfer_energy_used and self.total_energy_used:
@@ -56,13 +86,42 @@ class Simulation:
                                  'before assignment.')
 
     def set_peripheral_failure_count(self):
-        total_number_of_peripherals = len(self.peripheral_list)
-        failed_peripherals = 0
-        for peripheral in self.peripheral_list:
-            if peripheral.current_charge <= 0:
-                failed_peripherals += 1
+        return self.get_failed_peripheral_fraction()
 
-        return (failed_peripherals / total_number_of_peripherals)
+    def get_failed_peripheral_fraction(self):
+        """
+        :return: the fraction of the peripherals with no charge left, or None if there are none
+        """
+        if not self.peripheral_list:
+            return None
+        # the peripherals are views over one state store, so their charges are looked up there in one go
+        state = self.peripheral_list[0].get_plane().state
+        rows = [peripheral.row for peripheral in self.peripheral_list]
+        return int(np.count_nonzero(state.get_charges(rows) <= 0)) / len(rows)
+
+    def get_summary(self):
+        """
+        :return: a dict of the headline results of the run, safe to send between processes or write out as JSON
+        """
+        total_energy_used = self.total_energy_used or 0
+        summary = {
+            'travel_energy_used': self.travel_energy_used,
+            'transfer_energy_used': self.transfer_energy_used,
+            'total_energy_used': self.total_energy_used,
+            'effective_energy_percentage': (calculate_effective_energy_percentage(self.transfer_energy_used,
+                                                                                  total_energy_used)
+                                            if total_energy_used else None),
+            'ineffective_energy_percentage': (calculate_ineffective_energy_percentage(self.travel_energy_used,
+                                                                                      total_energy_used)
+                                              if total_energy_used else None),
+            'average_charge_at_15_cycles': self.average_charge_at_15_cycles,
+            'peripheral_failure_count': self.peripheral_failure_count,
+            'failed_peripheral_fraction': self.get_failed_peripheral_fraction(),
+            'time_of_earliest_failure': self.time_of_earliest_failute,
+        }
+        if self.statistics is not None:
+            summary.update(self.statistics.get_summary())
+        return summary
 
     def run_analytics_on_simulation(self):
         """
@@ -73,7 +132,7 @@ class Simulation:
         self.set_ineffective_energy_percentage()
         self.calculate_average_charge_at_15_cycles()
         if self.time_of_earliest_failute:
-            pretty_print('At least one peripheral failed within the 5 minute window. Algorithm may be ineffective.',
+            pretty_print('At least one peripheral failed within the simulated horizon. Algorithm may be ineffective.',
                          'red')
 
         print('Effective Energy Percentage: ', self.effective_energy_percentage)
@@ -81,9 +140,12 @@ class Simulation:
         print('Average Charge at 15 Cycles: ', self.average_charge_at_15_cycles)
         if self.time_of_earliest_failute:
             print('Running Time Until Peripheral Failure: ', self.time_of_earliest_failute - self.start_time)
-        total_number_of_peripherals = len(self.peripheral_list)
-        failed_peripherals = 0
-        for peripheral in self.peripheral_list:
-            if peripheral.current_charge <= 0:
-                failed_peripherals += 1
-        print('Failed Peripherals: ', failed_peripherals / total_number_of_peripherals)
+        print('Failed Peripherals: ', self.get_failed_peripheral_fraction())
+
+        if self.statistics is not None:
+            for name, value in self.statistics.get_summary().items():
+                print('{}: '.format(name.replace('_', ' ').title()), value)
+
+        # where the time went, if the run was profiled
+        if profiler.enabled:
+            profiler.print_breakdown()
@@ -0,0 +1,372 @@
+import importlib
+import json
+import os
+import random
+
+import numpy as np
+
+"""
+Checkpoints of running simulations
+A checkpoint is a directory. The state store columns and the occupancy record are written as .npy files, everything
+else (counters, the random generator, the clusters and their tours, pending events, the charging queue and the
+Simulation object's records) goes into one JSON file next to them. Loading maps the arrays back in copy-on-write, so
+restoring is quick however large the plane and every restored simulation is independent of the others:
+
+    save_checkpoint(sim, 'warm')
+    for threshold in (10, 20, 30):
+        fork = load_checkpoint('warm')
+        fork.plane.state.set_charge_threshold(threshold, rows=fork.peripheral_rows)
+        summaries.append(fork.resume(horizon=200000).get_summary())
+
+Streaming statistics are saved with the simulation and carry on where they left off. Telemetry recorders are not part
+of a checkpoint, give the restored simulation a new one if it should keep recording.
+"""
+
+CHECKPOINT_VERSION = 1
+META_FILE_NAME = 'checkpoint.json'
+ARRAY_FILE_EXTENSION = '.npy'
+STATE_COLUMNS = ('location', 'charge_capacity', 'stored_charge', 'charge_threshold', 'cluster_id', 'draining',
+                 'watched')
+
+# plain attributes of the simulations that are saved as they are, whichever of them a simulation has
+SIMULATION_ATTRIBUTES = (
+    'seed', 'maximum_cluster_radius', 'repair_clusters', 'travel_energy_used', 'transfer_energy_used',
+    'total_energy_used', 'cycles', 'length_of_path_through_clusters', 'shortest_path_through_clusters',
+    'last_drain_time', 'route', 'route_distances_from_home', 'route_leg_distances', 'dedicated_charger_busy',
+    'dedicated_charger_topped_up', 'failed_rows',
+)
+# plain attributes of the Simulation object kept for the analytics
+RECORD_ATTRIBUTES = (
+    'travel_energy_used', 'transfer_energy_used', 'total_energy_used', 'charges_after_15_cycles',
+    'peripheral_failure_count', 'time_of_earliest_failute', 'start_time', 'effective_energy_percentage',
+    'ineffective_energy_percentage', 'average_charge_at_15_cycles', 'time_until_earliest_failure',
+)
+
+
+def _to_json(value):
+    # numpy scalars and arrays turn up in counters and event payloads
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.bool_):
+        return bool(value)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError('Cannot save a {} in a checkpoint.'.format(type(value).__name__))
+
+
+def _to_tuples(value):
+    # event payloads are tuples, which JSON hands back as lists
+    if isinstance(value, list):
+        return tuple(_to_tuples(item) for item in value)
+    return value
+
+
+def _save_array(path, name, array):
+    np.save(os.path.join(path, name + ARRAY_FILE_EXTENSION), np.ascontiguousarray(array))
+
+
+def _load_array(path, name, mmap):
+    return np.load(os.path.join(path, name + ARRAY_FILE_EXTENSION), mmap_mode='c' if mmap else None)
+
+
+def _save_statistics(statistics, path):
+    """
+    write the arrays of a StreamingStatistics next to the meta file
+    :return: everything else about it, for the meta file
+    """
+    if statistics is None:
+        return None
+    moments = statistics.charge_moments
+    sketch = statistics.charge_sketch
+    _save_array(path, 'statistics_sketch_counts', sketch.counts)
+    if statistics.time_below_threshold is not None:
+        _save_array(path, 'statistics_time_below_threshold', statistics.time_below_threshold)
+    return {
+        'threshold_percentage': statistics.threshold_percentage,
+        'window': statistics.window,
+        'quantiles': list(statistics.quantiles),
+        'start_time': statistics.start_time,
+        'last_time': statistics.last_time,
+        'records': statistics.records,
+        'moments': [moments.count, moments.mean, moments.m2, moments.minimum, moments.maximum],
+        'sketch': [sketch.lower, sketch.upper, sketch.bins, sketch.count, sketch.minimum, sketch.maximum],
+        'has_time_below_threshold': statistics.time_below_threshold is not None,
+        'window_records': [list(window_record) for window_record in statistics.window_records],
+        'window_travel_energy': statistics.window_travel_energy,
+        'window_transfer_energy': statistics.window_transfer_energy,
+        'last_travel_energy_used': statistics.last_travel_energy_used,
+        'last_transfer_energy_used': statistics.last_transfer_energy_used,
+        'minimum_window_efficiency': statistics.minimum_window_efficiency,
+        'maximum_window_efficiency': statistics.maximum_window_efficiency,
+    }
+
+
+def save_checkpoint(sim, path):
+    """
+    write the full state of a simulation that has been set up, whether or not it has run yet
+    :param sim: a SingleChargerSim or MultiChargerSim
+    :param path: the directory to write to. it is created if needed and files already in it are overwritten
+    :return: the path
+    """
+    from Models.plane_model import ChargingNode
+    if sim.engine is None:
+        raise AssertionError('Only a simulation that has been set up can be checkpointed.')
+    os.makedirs(path, exist_ok=True)
+    plane = sim.plane
+    state = plane.state
+
+    for column in STATE_COLUMNS:
+        _save_array(path, 'state_' + column, getattr(state, column)[:state.size])
+    occupancy = plane.occupancy
+    if occupancy.bitmap is not None:
+        _save_array(path, 'occupancy_bitmap', np.frombuffer(bytes(occupancy.bitmap), dtype=np.uint8))
+    else:
+        _save_array(path, 'occupancy_cells', np.array(sorted(occupancy.occupied), dtype=np.int64))
+    if occupancy.free_cells is not None:
+        _save_array(path, 'occupancy_free_cells', occupancy.free_cells[:occupancy.free_count])
+
+    clusters = {}
+    for cluster in list(plane.clusters_by_id.values()) + list(plane.cluster_list or ()) + list(sim.clusters):
+        clusters[cluster.get_id()] = {
+            'id': cluster.get_id(),
+            'rows': [peripheral.row for peripheral in cluster.peripheral_list],
+            'length_of_shortest_path': cluster.length_of_shortest_path,
+            'shortest_path_through_cluster': list(cluster.shortest_path_through_cluster),
+            'dedicated_charger': cluster.dedicated_charger.row if cluster.dedicated_charger is not None else None,
+        }
+
+    engine = sim.engine
+    charging_queue = None
+    if sim.charging_queue is not None:
+        charging_queue = {'sequence': sim.charging_queue.sequence,
+                          'requests': [list(entry) for entry in sim.charging_queue.requests.values()]}
+
+    record = sim.simulation
+    meta = {
+        'version': CHECKPOINT_VERSION,
+        'module': type(sim).__module__,
+        'class': type(sim).__name__,
+        'attributes': {name: getattr(sim, name) for name in SIMULATION_ATTRIBUTES if hasattr(sim, name)},
+        'random': sim.random.getstate() if isinstance(sim.random, random.Random) else None,
+        'plane': {
+            'x_axis_size': plane.x_axis_size,
+            'y_axis_size': plane.y_axis_size,
+            'state_size': state.size,
+            'drain_clock': state.drain_clock,
+            'chargers': [row for row in range(state.size) if isinstance(state.owners[row], ChargingNode)],
+            'charging_stations': [station.get_location() for station in plane.charging_stations],
+            'plane_peripherals': [peripheral.row for peripheral in plane.peripherals],
+            'plane_chargers': [charger.row for charger in plane.chargers],
+            'occupancy_count': occupancy.count,
+            'cluster_list': (None if plane.cluster_list is None
+                             else [cluster.get_id() for cluster in plane.cluster_list]),
+            'clusters_by_id': list(plane.clusters_by_id),
+        },
+        'clusters': list(clusters.values()),
+        'sim_clusters': [cluster.get_id() for cluster in sim.clusters],
+        'sim_clusters_shared': sim.clusters is plane.cluster_list,
+        'peripherals': [peripheral.row for peripheral in sim.peripherals],
+        'charger': sim.charger.row,
+        'dedicated_chargers': [charger.row for charger in getattr(sim, 'dedicated_charger_list', ())],
+        'engine': {
+            'now': engine.now,
+            'horizon': engine.horizon,
+            'sequence': engine.sequence,
+            'events_processed': engine.events_processed,
+            'queue': [list(event) for event in engine.queue],
+            'handlers': {kind: handler.__name__ for kind, handler in engine.handlers.items()},
+        },
+        'charging_queue': charging_queue,
+        'statistics': _save_statistics(getattr(sim, 'statistics', None), path),
+        'cluster_manager': None if getattr(sim, 'cluster_manager', None) is None else {
+            'radius': sim.cluster_manager.radius,
+            'repair_max_moves': sim.cluster_manager.repair_max_moves,
+            'next_id': sim.cluster_manager.next_id,
+        },
+        'simulation': {
+            'attributes': {name: getattr(record, name) for name in RECORD_ATTRIBUTES},
+            'time_of_peripheral_failures': [[peripheral.row, timestamp] for peripheral, timestamp
+                                            in record.time_of_peripheral_failures.items()],
+        },
+    }
+    with open(os.path.join(path, META_FILE_NAME), 'w') as meta_file:
+        json.dump(meta, meta_file, default=_to_json)
+    return path
+
+
+def _restore_plane(path, meta, mmap):
+    """
+    :return: the plane, with every device a view over its restored row
+    """
+    from Models.plane_model import Plane, Peripheral, ChargingNode, ChargingStation
+    plane_meta = meta['plane']
+    plane = Plane(plane_meta['x_axis_size'], plane_meta['y_axis_size'])
+    for x_location, y_location in plane_meta['charging_stations']:
+        ChargingStation(x_location, y_location, plane)
+
+    occupancy = plane.occupancy
+    if os.path.exists(os.path.join(path, 'occupancy_bitmap' + ARRAY_FILE_EXTENSION)):
+        occupancy.bitmap = bytearray(_load_array(path, 'occupancy_bitmap', False).tobytes())
+        occupancy.occupied = None
+    else:
+        occupancy.occupied = set(_load_array(path, 'occupancy_cells', False).tolist())
+    occupancy.count = plane_meta['occupancy_count']
+    if os.path.exists(os.path.join(path, 'occupancy_free_cells' + ARRAY_FILE_EXTENSION)):
+        occupancy.free_cells = np.array(_load_array(path, 'occupancy_free_cells', False))
+        occupancy.free_count = len(occupancy.free_cells)
+
+    state = plane.state
+    state.size = plane_meta['state_size']
+    if 'drain_clock' in plane_meta:
+        for column in STATE_COLUMNS:
+            setattr(state, column, _load_array(path, 'state_' + column, mmap))
+        # the depletion heap is rebuilt from the watched rows on the first failure check
+        state.drain_clock = plane_meta['drain_clock']
+    else:
+        # checkpoints from before the drain clock hold the charges themselves, which is what the rows store while
+        # the clock is at 0. every row is watched afresh
+        for column in ('location', 'charge_capacity', 'charge_threshold', 'cluster_id', 'draining'):
+            setattr(state, column, _load_array(path, 'state_' + column, mmap))
+        state.stored_charge = _load_array(path, 'state_current_charge', mmap)
+        state.watched = np.zeros(len(state.stored_charge), dtype=bool)
+        state._watch_many(np.arange(state.size))
+    chargers = set(plane_meta['chargers'])
+    state.owners = [(ChargingNode if row in chargers else Peripheral).from_row(plane, row)
+                    for row in range(state.size)]
+    plane.peripherals = [state.owners[row] for row in plane_meta['plane_peripherals']]
+    plane.chargers = [state.owners[row] for row in plane_meta['plane_chargers']]
+    return plane
+
+
+def _restore_simulation_record(sim, meta):
+    from Models.simulation_model import Simulation
+    record = Simulation(sim.peripherals, statistics=getattr(sim, 'statistics', None))
+    for name, value in meta['simulation']['attributes'].items():
+        setattr(record, name, value)
+    owners = sim.plane.state.owners
+    record.time_of_peripheral_failures = {owners[row]: timestamp
+                                          for row, timestamp in meta['simulation']['time_of_peripheral_failures']}
+    return record
+
+
+def _restore_statistics(path, statistics_meta):
+    """
+    :return: a StreamingStatistics in the state it was saved in
+    """
+    from Analytics.streaming_statistics import StreamingStatistics
+    lower, upper, bins, sketch_count, sketch_minimum, sketch_maximum = statistics_meta['sketch']
+    statistics = StreamingStatistics(threshold_percentage=statistics_meta['threshold_percentage'],
+                                     window=statistics_meta['window'], quantiles=statistics_meta['quantiles'],
+                                     bins=bins, start_time=statistics_meta['start_time'])
+    statistics.last_time = statistics_meta['last_time']
+    statistics.records = statistics_meta['records']
+    moments = statistics.charge_moments
+    moments.count, moments.mean, moments.m2, moments.minimum, moments.maximum = statistics_meta['moments']
+    sketch = statistics.charge_sketch
+    sketch.lower, sketch.upper = lower, upper
+    sketch.bin_width = (upper - lower) / bins
+    # checkpoints from before the sketch was weighted by time count the values in it as integers
+    sketch.counts = np.array(_load_array(path, 'statistics_sketch_counts', False), dtype=np.float64)
+    sketch.count, sketch.minimum, sketch.maximum = sketch_count, sketch_minimum, sketch_maximum
+    if statistics_meta['has_time_below_threshold']:
+        # the statistics carry on updating these, so they are read rather than mapped
+        statistics.time_below_threshold = np.array(_load_array(path, 'statistics_time_below_threshold', False))
+    statistics.window_records.extend(tuple(window_record) for window_record in statistics_meta['window_records'])
+    for name in ('window_travel_energy', 'window_transfer_energy', 'last_travel_energy_used',
+                 'last_transfer_energy_used', 'minimum_window_efficiency', 'maximum_window_efficiency'):
+        setattr(statistics, name, statistics_meta[name])
+    return statistics
+
+
+def load_checkpoint(path, mmap=True):
+    """
+    restore a simulation from a checkpoint, ready to carry on with resume()
+    every call hands back a new, independent simulation, so a checkpoint can be loaded many times to fork variants
+    :param path: a directory written by save_checkpoint
+    :param mmap: map the state arrays in copy-on-write rather than reading them. changes are never written back
+    :return: the simulation
+    """
+    from Models.charging_queue_model import ChargingQueue
+    from Models.plane_model import Cluster
+    from Simulation.event_engine import EventEngine
+
+    with open(os.path.join(path, META_FILE_NAME)) as meta_file:
+        meta = json.load(meta_file)
+    if meta['version'] != CHECKPOINT_VERSION:
+        raise ValueError('Checkpoint version {} is not supported, expected {}.'.format(meta['version'],
+                                                                                       CHECKPOINT_VERSION))
+
+    attributes = meta['attributes']
+    sim_class = getattr(importlib.import_module(meta['module']), meta['class'])
+    sim = sim_class(seed=attributes.get('seed'), maximum_cluster_radius=attributes.get('maximum_cluster_radius'))
+    for name, value in attributes.items():
+        setattr(sim, name, value)
+    if meta['random'] is not None:
+        version, internal_state, gauss_next = meta['random']
+        sim.random.setstate((version, tuple(internal_state), gauss_next))
+
+    plane = _restore_plane(path, meta, mmap)
+    owners = plane.state.owners
+    sim.plane = plane
+    sim.peripherals = [owners[row] for row in meta['peripherals']]
+    sim.peripheral_rows = np.array(meta['peripherals'], dtype=np.int64)
+    sim.charger = owners[meta['charger']]
+    if hasattr(sim, 'dedicated_charger_list'):
+        sim.dedicated_charger_list = [owners[row] for row in meta['dedicated_chargers']]
+    if hasattr(sim, 'failed_rows') and 'failed_rows' not in attributes:
+        # checkpoints from before failed rows were kept, a failed peripheral is the one left without capacity
+        sim.failed_rows = [int(row) for row in sim.peripheral_rows if plane.state.charge_capacity[row] == 0]
+
+    # the tours are restored rather than solved again
+    clusters = {}
+    for cluster_meta in meta['clusters']:
+        cluster = Cluster(peripheral_list=[owners[row] for row in cluster_meta['rows']], id=cluster_meta['id'],
+                          tour=(cluster_meta['length_of_shortest_path'],
+                                cluster_meta['shortest_path_through_cluster']))
+        if cluster_meta['dedicated_charger'] is not None:
+            cluster.set_dedicated_charger(owners[cluster_meta['dedicated_charger']])
+        clusters[cluster.get_id()] = cluster
+    if meta['plane']['cluster_list'] is not None:
+        plane.cluster_list = [clusters[cluster_id] for cluster_id in meta['plane']['cluster_list']]
+    plane.clusters_by_id = {cluster_id: clusters[cluster_id] for cluster_id in meta['plane']['clusters_by_id']}
+    sim.clusters = plane.cluster_list if meta['sim_clusters_shared'] else \
+        [clusters[cluster_id] for cluster_id in meta['sim_clusters']]
+
+    # checkpoints from before statistics were saved have none
+    if meta.get('statistics') is not None:
+        sim.statistics = _restore_statistics(path, meta['statistics'])
+    sim.simulation = _restore_simulation_record(sim, meta)
+    if meta['cluster_manager'] is not None:
+        from Services.cluster_manager_service import ClusterManager, REPAIR_MAX_MOVES
+        manager_meta = meta['cluster_manager']
+        # checkpoints from before the repair was bounded by moves carry a time budget instead, which is not kept
+        sim.cluster_manager = ClusterManager(plane, manager_meta['radius'],
+                                             manager_meta.get('repair_max_moves', REPAIR_MAX_MOVES))
+        sim.cluster_manager.next_id = manager_meta['next_id']
+        sim.simulation.cluster_manager = sim.cluster_manager
+
+    if meta['charging_queue'] is not None:
+        charging_queue = ChargingQueue()
+        for entry in meta['charging_queue']['requests']:
+            charging_queue.requests[entry[2]] = entry
+            if entry[3] is not None:
+                charging_queue.requests_by_cluster.setdefault(entry[3], set()).add(entry[2])
+        # withdrawn requests are not saved, the heap is rebuilt from the live ones
+        charging_queue.heap = list(charging_queue.requests.values())
+        charging_queue.heap.sort()
+        charging_queue.sequence = meta['charging_queue']['sequence']
+        sim.charging_queue = charging_queue
+
+    engine_meta = meta['engine']
+    engine = EventEngine(engine_meta['horizon'], start_time=engine_meta['now'])
+    for kind, handler_name in engine_meta['handlers'].items():
+        engine.on(kind, getattr(sim, handler_name))
+    # the saved queue is already in heap order
+    engine.queue = [(time, sequence, kind, _to_tuples(payload))
+                    for time, sequence, kind, payload in engine_meta['queue']]
+    engine.sequence = engine_meta['sequence']
+    engine.events_processed = engine_meta['events_processed']
+    sim.engine = engine
+    return sim
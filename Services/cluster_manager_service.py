@@ -0,0 +1,183 @@
+import math
+
+import numpy as np
+
+from Services import route_services
+
+"""
+keeps the clusters of a plane up to date as peripherals fail, arrive or move
+Only the cluster a peripheral leaves or joins is touched. Its tour is patched, by dropping the peripheral or putting it
+where it adds the least length, and then tidied up with a short burst of local search, instead of being solved again.
+"""
+
+REPAIR_MAX_MOVES = 200  # improving moves of local search after each change to a cluster
+
+
+class ClusterManager:
+
+    def __init__(self, plane, max_distance_between_point_and_centroid, repair_max_moves=REPAIR_MAX_MOVES):
+        """
+        :param plane: a plane whose clusters have already been generated
+        :param max_distance_between_point_and_centroid: maximum radius of the clusters, as given to generate_clusters
+        :param repair_max_moves: improving moves of local search allowed after each change
+        """
+        if plane.cluster_list is None:
+            plane.cluster_list = []
+        self.plane = plane
+        self.radius = max_distance_between_point_and_centroid
+        self.cell_size = max_distance_between_point_and_centroid if max_distance_between_point_and_centroid > 0 else 1
+        self.repair_max_moves = repair_max_moves
+        # clusters by the grid cell their centroid is in, so finding one in range only looks at neighbouring cells
+        self.cells = {}
+        self.cell_of_cluster = {}
+        self.next_id = 0
+        for cluster in plane.cluster_list:
+            self._index(cluster)
+            self.next_id = max(self.next_id, cluster.get_id() + 1)
+
+    def remove_peripheral(self, peripheral):
+        """
+        take a peripheral out of its cluster, e.g. when it fails. it stays on the plane
+        a cluster left empty is dropped. if the centroid leaves, the next peripheral on the tour takes over and any
+        members now out of its range are found new clusters
+        :return: the cluster the peripheral was in, or None if it was not in one
+        """
+        cluster = peripheral.cluster
+        if cluster is None:
+            return None
+        tour = self._get_tour(cluster)
+        was_centroid = tour[0] is peripheral
+        tour.remove(peripheral)
+        peripheral.cluster = None
+
+        if not tour:
+            self._drop_cluster(cluster)
+            return cluster
+
+        evicted = []
+        if was_centroid:
+            centroid_location = np.array(tour[0].get_location(), dtype=np.float64)
+            locations = self.plane.state.get_locations([member.row for member in tour]).astype(np.float64)
+            in_range = np.sqrt(((locations - centroid_location) ** 2).sum(axis=1)) <= self.radius
+            evicted = [member for member, keep in zip(tour, in_range.tolist()) if not keep]
+            tour = [member for member, keep in zip(tour, in_range.tolist()) if keep]
+
+        self._unindex(cluster)
+        self._repair(cluster, tour)
+        self._index(cluster)
+
+        for member in evicted:
+            member.cluster = None
+            self.insert_peripheral(member)
+        return cluster
+
+    def insert_peripheral(self, peripheral):
+        """
+        add a peripheral to the closest cluster whose centroid is in range, or start a new cluster around it
+        :return: the cluster the peripheral joined
+        """
+        if peripheral.cluster is not None:
+            return peripheral.cluster
+        cluster = self._find_cluster(peripheral.get_location())
+        if cluster is None:
+            from Models.plane_model import Cluster
+            cluster = Cluster(peripheral_list=[peripheral], id=self.next_id)
+            self.next_id += 1
+            self.plane.cluster_list.append(cluster)
+            self.plane.clusters_by_id[cluster.get_id()] = cluster
+            peripheral.cluster = cluster
+            self._index(cluster)
+            return cluster
+
+        tour = self._get_tour(cluster)
+        tour.insert(self._cheapest_insertion(tour, peripheral) + 1, peripheral)
+        peripheral.cluster = cluster
+        self._repair(cluster, tour)
+        return cluster
+
+    def move_peripheral(self, peripheral, x_location, y_location):
+        """
+        move a peripheral to a new spot on the plane, and into whichever cluster covers it
+        raises IndexError if the new spot is taken or outside of the plane
+        :return: the cluster the peripheral ended up in
+        """
+        old_x_location, old_y_location = peripheral.get_location()
+        self.plane.occupy(x_location, y_location)
+        self.plane.release(old_x_location, old_y_location)
+        self.remove_peripheral(peripheral)
+        self.plane.state.location[peripheral.row] = (x_location, y_location)
+        return self.insert_peripheral(peripheral)
+
+    def _get_tour(self, cluster):
+        # the members in the order they are visited, starting at the centroid
+        return [cluster.peripheral_list[index] for index in cluster.shortest_path_through_cluster]
+
+    def _cheapest_insertion(self, tour, peripheral):
+        """
+        :return: the position in the tour the peripheral adds the least length after
+        """
+        locations = self.plane.state.get_locations([member.row for member in tour]).astype(np.float64)
+        location = np.array(peripheral.get_location(), dtype=np.float64)
+        next_locations = np.roll(locations, -1, axis=0)
+        to_peripheral = np.sqrt(((locations - location) ** 2).sum(axis=1))
+        from_peripheral = np.sqrt(((next_locations - location) ** 2).sum(axis=1))
+        existing_edge = np.sqrt(((next_locations - locations) ** 2).sum(axis=1))
+        return int(np.argmin(to_peripheral + from_peripheral - existing_edge))
+
+    def _repair(self, cluster, tour):
+        """
+        make the peripherals of the patched tour the members of the cluster, visited in that order, and improve it
+        with local search. node 0, the centroid, stays at the front
+        """
+        cluster.set_members(tour)
+        distances = np.asarray(cluster.get_distance_matrix(), dtype=np.float64)
+        path = np.arange(cluster.get_size())
+        if cluster.get_size() > 3:
+            # bounded by a move count rather than a deadline, so the repaired tour is the same on every run
+            remaining = self.repair_max_moves
+            improved = True
+            while improved and remaining > 0:
+                moves = route_services.two_opt(distances, path, max_moves=remaining)
+                if moves < remaining:
+                    moves += route_services.or_opt(distances, path, max_moves=remaining - moves)
+                remaining -= moves
+                improved = moves > 0
+        cluster.shortest_path_through_cluster = [int(node) for node in path]
+        cluster.length_of_shortest_path = route_services.tour_length(distances, path)
+
+    def _find_cluster(self, location):
+        """
+        :return: the cluster with the closest centroid within range of the location, or None
+        """
+        cell_x, cell_y = self._cell(location)
+        reach = int(math.ceil(self.radius / self.cell_size))
+        best, best_distance = None, None
+        for x in range(cell_x - reach, cell_x + reach + 1):
+            for y in range(cell_y - reach, cell_y + reach + 1):
+                for cluster in self.cells.get((x, y), ()):
+                    distance = math.hypot(cluster.x_location - location[0], cluster.y_location - location[1])
+                    if distance > self.radius:
+                        continue
+                    if best is None or (distance, cluster.get_id()) < (best_distance, best.get_id()):
+                        best, best_distance = cluster, distance
+        return best
+
+    def _cell(self, location):
+        return int(location[0] // self.cell_size), int(location[1] // self.cell_size)
+
+    def _index(self, cluster):
+        cell = self._cell(cluster.get_location())
+        self.cells.setdefault(cell, []).append(cluster)
+        self.cell_of_cluster[cluster.get_id()] = cell
+
+    def _unindex(self, cluster):
+        cell = self.cell_of_cluster.pop(cluster.get_id())
+        clusters = self.cells[cell]
+        clusters.remove(cluster)
+        if not clusters:
+            del self.cells[cell]
+
+    def _drop_cluster(self, cluster):
+        self._unindex(cluster)
+        self.plane.cluster_list.remove(cluster)
+        del self.plane.clusters_by_id[cluster.get_id()]
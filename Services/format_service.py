@@ -12,6 +12,6 @@ color = {
 }
 
 
-def pretty_print(text, format):
+def pretty_print(text, format, file=None):
     if str(format) in color:
-        print(color[format] + str(text) + color['end'])
\ No newline at end of file
+        print(color[format] + str(text) + color['end'], file=file)
\ No newline at end of file
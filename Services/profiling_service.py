@@ -0,0 +1,98 @@
+import functools
+import time
+
+from Services.format_service import pretty_print
+
+"""
+named timers and counters for the hot paths of the simulator
+The functions worth watching are wrapped with profiler.timed. While the profiler is disabled, which it is by default,
+a wrapped call costs one attribute check on top of the call itself. Enable it before a run to see where the time goes:
+
+    from Services.profiling_service import profiler
+    profiler.enable()
+    SingleChargerSim().single_charger_simulation().run_analytics_on_simulation()  # ends with the breakdown
+"""
+
+
+class Profiler:
+    """
+    Phases are timed inclusively: a phase that runs inside another, e.g. the drains inside charge_cluster, counts
+    towards both of them
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.phases = {}  # phase name: [calls, total seconds, items processed]
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.phases = {}
+
+    def record(self, name, seconds=0.0, items=0, calls=1):
+        """
+        add to a phase's totals, whether or not the profiler is enabled
+        """
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = [0, 0.0, 0]
+        phase[0] += calls
+        phase[1] += seconds
+        phase[2] += items
+
+    def count(self, name, items=1):
+        """
+        count an untimed event, e.g. one pass of a loop
+        """
+        if self.enabled:
+            self.record(name, items=items)
+
+    def timed(self, name, items=None):
+        """
+        decorator that times every call of a function under a phase name
+        :param name: the phase the calls are recorded under
+        :param items: optional function called with the same arguments, returning how many items the call processed.
+        it is only called while the profiler is enabled
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - started,
+                                items(*args, **kwargs) if items is not None else 0)
+            return wrapper
+        return decorator
+
+    def get_breakdown(self):
+        """
+        :return: one dict per phase, the most expensive first
+        """
+        breakdown = []
+        for name, (calls, total_seconds, items) in self.phases.items():
+            breakdown.append({'phase': name, 'calls': calls, 'total_seconds': total_seconds,
+                              'mean_seconds': total_seconds / calls if calls else 0.0, 'items': items})
+        breakdown.sort(key=lambda phase: phase['total_seconds'], reverse=True)
+        return breakdown
+
+    def print_breakdown(self):
+        if not self.phases:
+            return
+        pretty_print('Time per phase (phases nest, so totals overlap):', 'bold')
+        print('{:<40} {:>10} {:>12} {:>12} {:>12}'.format('phase', 'calls', 'total (s)', 'mean (ms)', 'items'))
+        for phase in self.get_breakdown():
+            print('{:<40} {:>10} {:>12.4f} {:>12.4f} {:>12}'.format(phase['phase'], phase['calls'],
+                                                                    phase['total_seconds'],
+                                                                    phase['mean_seconds'] * 1000, phase['items']))
+
+
+# the instance every module records to
+profiler = Profiler()
@@ -1,10 +1,19 @@
-import subprocess, sys
+import json
+import os
+import subprocess
+import sys
 
 """
 basic script to automate installation of necessary modules
+check_requirements only looks at what is installed locally and caches its answer, so it is cheap enough to run on every
+launch. run_requirement_check installs and upgrades everything with pip, which needs network access and takes a while
 TODO: move this from current location to independent personal script library
 """
 
+REQUIREMENTS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'requirements.txt')
+CACHE_PATH = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                          'fau_isense_simulator', 'requirements_check.json')
+
 
 def install_and_upgrade(requirement):
     subprocess.check_call([sys.executable, '-m', 'pip', 'install', requirement, '-U'])
@@ -16,4 +25,80 @@ def run_requirement_check():
         requirement_list = f.readlines()
         for r in requirement_list:
             if len(r) > 0:
-                install_and_upgrade(r)
\ No newline at end of file
+                install_and_upgrade(r)
+
+
+def parse_requirement(line):
+    """
+    :param line: a line of a requirements file
+    :return: the package name and the exact version pinned with ==, if any, or None for blank lines and comments
+    other version specifiers are not checked, only that the package is there
+    """
+    line = line.split('#', 1)[0].strip()
+    if not line:
+        return None
+    if '==' in line:
+        name, version = line.split('==', 1)
+        return name.strip(), version.strip()
+    for separator in ('>=', '<=', '~=', '!=', '>', '<', '[', ';'):
+        line = line.split(separator, 1)[0]
+    return line.strip(), None
+
+
+def _get_cache_key(requirements_path):
+    # the answer only changes when the requirements, the interpreter or the installed packages do. installing or
+    # removing a package touches its site-packages directory
+    status = os.stat(requirements_path)
+    site_packages = [path for path in sys.path if path.endswith('site-packages') and os.path.isdir(path)]
+    return {
+        'requirements': os.path.abspath(requirements_path),
+        'requirements_modified': status.st_mtime_ns,
+        'requirements_size': status.st_size,
+        'python': sys.executable,
+        'python_version': sys.version,
+        'site_packages': [[path, os.stat(path).st_mtime_ns] for path in site_packages],
+    }
+
+
+def check_requirements(requirements_path=REQUIREMENTS_PATH, cache_path=CACHE_PATH):
+    """
+    check the installed packages against a requirements file, without installing anything or going online
+    the result is cached, so only the first launch after the requirements or the installed packages change pays for it
+    :param cache_path: where to cache the result, None to always check
+    :return: a list of problems, e.g. 'numpy is not installed'. empty when everything is in place
+    """
+    key = _get_cache_key(requirements_path)
+    if cache_path is not None:
+        try:
+            with open(cache_path) as cache_file:
+                cached = json.load(cache_file)
+            if cached.get('key') == key:
+                return cached['problems']
+        except (OSError, ValueError):
+            pass
+
+    from importlib import metadata
+    problems = []
+    with open(requirements_path) as requirements_file:
+        for line in requirements_file:
+            requirement = parse_requirement(line)
+            if requirement is None:
+                continue
+            name, version = requirement
+            try:
+                installed_version = metadata.version(name)
+            except metadata.PackageNotFoundError:
+                problems.append('{} is not installed'.format(name))
+                continue
+            if version is not None and installed_version != version:
+                problems.append('{} {} is installed, {} is required'.format(name, installed_version, version))
+
+    if cache_path is not None:
+        # a cache that cannot be written, e.g. on a read-only home directory, only costs the next launch a check
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(cache_path, 'w') as cache_file:
+                json.dump({'key': key, 'problems': problems}, cache_file)
+        except OSError:
+            pass
+    return problems
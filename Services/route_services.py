@@ -0,0 +1,347 @@
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from Services.simulation_services import get_size_of_square_matrix, held_karp
+
+"""
+route solvers for the tour through a cluster
+every solver takes a square distance matrix and returns (cost, path) the same way held_karp does:
+the path starts at node 0 and the cost includes the edge from the last node back to node 0
+"""
+
+EXACT_SOLVER_MAX_NODES = 16  # clusters up to this size are solved exactly
+OPTIMALITY_GAP_MAX_NODES = 20  # largest cluster we are willing to run Held-Karp on just to measure a gap
+HEURISTIC_MAX_ITERATIONS = 5000  # improving moves per tour, a fixed count so tours do not depend on machine speed
+IMPROVEMENT_TOLERANCE = 1e-9
+TOUR_CACHE_SIZE = 4096  # number of tours remembered by the shared tour cache
+
+
+def exact_tsp(distance_matrix, stats=None):
+    """
+    exact solver, see simulation_services.held_karp
+    """
+    return held_karp(distance_matrix, stats=stats)
+
+
+def heuristic_tsp(distance_matrix, stats=None, time_budget=None, max_iterations=None):
+    """
+    Nearest neighbour construction followed by 2-opt and Or-opt local search
+    :param distance_matrix: a square distance matrix, list of lists or NumPy array
+    :param stats: optional dict, filled in with the number of improving moves and passes made
+    :param time_budget: optional seconds of local search allowed, None for no deadline. A deadline makes the tour
+        depend on machine speed and load, so leave it off wherever results have to be reproducible
+    :param max_iterations: improving moves allowed, defaults to HEURISTIC_MAX_ITERATIONS
+    :return: the cost of the tour and the tour itself
+    """
+    number_of_nodes = get_size_of_square_matrix(distance_matrix)
+    if type(number_of_nodes) is not int:
+        raise TypeError('Distance matrix is incorrectly formed. Check your input and try again.')
+    if number_of_nodes == 1:
+        return 0, [0]
+
+    if max_iterations is None:
+        max_iterations = HEURISTIC_MAX_ITERATIONS
+
+    distances = np.asarray(distance_matrix, dtype=np.float64)
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    tour = nearest_neighbour_tour(distances)
+
+    moves = 0
+    passes = 0
+    improved = True
+    while improved and (deadline is None or time.perf_counter() < deadline) and \
+            (max_iterations is None or moves < max_iterations):
+        remaining = None if max_iterations is None else max_iterations - moves
+        two_opt_moves = two_opt(distances, tour, deadline, remaining)
+        remaining = None if max_iterations is None else remaining - two_opt_moves
+        or_opt_moves = 0
+        if remaining is None or remaining > 0:
+            or_opt_moves = or_opt(distances, tour, deadline, remaining)
+        moves += two_opt_moves + or_opt_moves
+        passes += 1
+        improved = two_opt_moves + or_opt_moves > 0
+
+    if stats is not None:
+        stats['iterations'] = moves
+        stats['passes'] = passes
+        stats['converged'] = not improved
+
+    return tour_length(distances, tour), [int(node) for node in tour]
+
+
+def nearest_neighbour_tour(distances):
+    """
+    build a tour by always travelling to the closest node not yet visited, starting at node 0
+    :param distances: square NumPy distance matrix
+    :return: the tour as a NumPy array of node indices
+    """
+    number_of_nodes = len(distances)
+    visited = np.zeros(number_of_nodes, dtype=bool)
+    tour = np.empty(number_of_nodes, dtype=np.int64)
+    current = 0
+    for position in range(number_of_nodes):
+        tour[position] = current
+        visited[current] = True
+        if position == number_of_nodes - 1:
+            break
+        candidates = np.where(visited, np.inf, distances[current])
+        current = int(np.argmin(candidates))
+    return tour
+
+
+def two_opt(distances, tour, deadline=None, max_moves=None):
+    """
+    reverse segments of the tour in place while doing so shortens it. node 0 stays at the front
+    :return: the number of improving moves made
+    """
+    number_of_nodes = len(tour)
+    moves = 0
+    for i in range(number_of_nodes - 2):
+        if deadline is not None and time.perf_counter() >= deadline:
+            break
+        if max_moves is not None and moves >= max_moves:
+            break
+        a, b = tour[i], tour[i + 1]
+        # when i is 0, j may not be the last position, the two edges would share node 0
+        last_j = number_of_nodes - 1 if i > 0 else number_of_nodes - 2
+        js = np.arange(i + 2, last_j + 1)
+        if len(js) == 0:
+            continue
+        c = tour[js]
+        d = tour[(js + 1) % number_of_nodes]
+        delta = distances[a, c] + distances[b, d] - distances[a, b] - distances[c, d]
+        best = int(np.argmin(delta))
+        if delta[best] < -IMPROVEMENT_TOLERANCE:
+            j = int(js[best])
+            tour[i + 1:j + 1] = tour[i + 1:j + 1][::-1].copy()
+            moves += 1
+    return moves
+
+
+def or_opt(distances, tour, deadline=None, max_moves=None, max_segment_length=3):
+    """
+    move short segments of the tour, possibly reversed, to wherever they are cheapest. node 0 stays at the front
+    :return: the number of improving moves made
+    """
+    number_of_nodes = len(tour)
+    moves = 0
+    for segment_length in range(1, max_segment_length + 1):
+        if number_of_nodes - segment_length < 2:
+            break
+        i = 1
+        while i + segment_length <= number_of_nodes:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return moves
+            if max_moves is not None and moves >= max_moves:
+                return moves
+            segment = tour[i:i + segment_length].copy()
+            first, last = segment[0], segment[-1]
+            before, after = tour[i - 1], tour[(i + segment_length) % number_of_nodes]
+            removal_gain = distances[before, first] + distances[last, after] - distances[before, after]
+
+            rest = np.concatenate((tour[:i], tour[i + segment_length:]))
+            left = rest
+            right = np.roll(rest, -1)
+            edge = distances[left, right]
+            forward = distances[left, first] + distances[last, right] - edge
+            backward = distances[left, last] + distances[first, right] - edge
+            # putting the segment back where it came from is not a move
+            forward[i - 1] = np.inf
+            backward[i - 1] = np.inf
+
+            best_forward = int(np.argmin(forward))
+            best_backward = int(np.argmin(backward))
+            if forward[best_forward] <= backward[best_backward]:
+                position, insertion_cost = best_forward, forward[best_forward]
+            else:
+                position, insertion_cost = best_backward, backward[best_backward]
+                segment = segment[::-1]
+
+            if insertion_cost - removal_gain < -IMPROVEMENT_TOLERANCE:
+                tour[:] = np.concatenate((rest[:position + 1], segment, rest[position + 1:]))
+                moves += 1
+            else:
+                i += 1
+    return moves
+
+
+def tour_length(distances, tour):
+    """
+    :return: the length of the closed tour, including the edge back to the first node
+    """
+    tour = np.asarray(tour, dtype=np.int64)
+    return float(distances[tour, np.roll(tour, -1)].sum())
+
+
+def optimality_gap(distance_matrix, cost):
+    """
+    compare a tour cost against the exact optimum
+    :param distance_matrix: the distance matrix the tour was computed on
+    :param cost: the cost of the tour being checked
+    :return: (cost - optimum) / optimum, or None if the cluster is too large to solve exactly
+    """
+    number_of_nodes = get_size_of_square_matrix(distance_matrix)
+    if type(number_of_nodes) is not int:
+        raise TypeError('Distance matrix is incorrectly formed. Check your input and try again.')
+    if number_of_nodes > OPTIMALITY_GAP_MAX_NODES:
+        return None
+    optimum, _ = held_karp(distance_matrix)
+    if optimum == 0:
+        return 0.0
+    return (cost - optimum) / optimum
+
+
+SOLVERS = {
+    'exact': exact_tsp,
+    'heuristic': heuristic_tsp,
+}
+
+
+def register_solver(name, solver):
+    """
+    make a new route solver available to solve_route
+    :param name: the name used to select the solver
+    :param solver: a function taking (distance_matrix, stats=None) and returning (cost, path)
+    """
+    if name == 'auto':
+        raise ValueError('"auto" is reserved for automatic solver selection.')
+    SOLVERS[name] = solver
+
+
+def choose_solver(number_of_nodes):
+    """
+    :return: the name of the solver used for a cluster of this size when method is 'auto'
+    """
+    return 'exact' if number_of_nodes <= EXACT_SOLVER_MAX_NODES else 'heuristic'
+
+
+def solve_route(distance_matrix, method='auto', stats=None, report_gap=False):
+    """
+    find a short tour through every node of a distance matrix
+    :param distance_matrix: a square distance matrix, list of lists or NumPy array
+    :param method: the name of a registered solver, or 'auto' to pick exact or heuristic by size
+    :param stats: optional dict, filled in with the solver used, its own stats, and the optimality gap if requested
+    :param report_gap: also compare the result against Held-Karp, when the size allows it
+    :return: the cost of the tour and the tour itself
+    """
+    number_of_nodes = get_size_of_square_matrix(distance_matrix)
+    if type(number_of_nodes) is not int:
+        raise TypeError('Distance matrix is incorrectly formed. Check your input and try again.')
+
+    if method == 'auto':
+        method = choose_solver(number_of_nodes)
+    if method not in SOLVERS:
+        raise KeyError('No route solver named {}. Available solvers: {}'.format(method, ', '.join(SOLVERS)))
+
+    solver_stats = {} if stats is not None else None
+    started = time.perf_counter()
+    cost, path = SOLVERS[method](distance_matrix, stats=solver_stats)
+
+    if stats is not None:
+        stats.update(solver_stats)
+        stats['method'] = method
+        stats['number_of_nodes'] = number_of_nodes
+        stats['solve_time'] = time.perf_counter() - started
+        if report_gap:
+            stats['optimality_gap'] = 0.0 if method == 'exact' else optimality_gap(distance_matrix, cost)
+
+    return cost, path
+
+
+class TourCache:
+    """
+    LRU cache of solved tours, keyed by the shape of a cluster rather than where it sits in the plane
+    Locations are translated so their smallest x and y are 0 and then sorted, so any two clusters with the same
+    relative geometry share an entry no matter where they are or what order their peripherals are listed in
+    """
+
+    def __init__(self, maxsize=TOUR_CACHE_SIZE):
+        if maxsize < 1:
+            raise ValueError('Tour cache needs room for at least one tour.')
+        self.maxsize = maxsize
+        self.tours = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.tours)
+
+    def lookup(self, locations, method):
+        """
+        :param locations: the (x, y) location of every node, in the order the tour should refer to them
+        :param method: the concrete solver name the tour should have come from
+        :return: (cost, path) in terms of the given locations, with the path starting at node 0, or None on a miss
+        """
+        key, order = self._make_key(locations, method)
+        cached = self.tours.get(key)
+        if cached is None:
+            self.misses += 1
+            return None
+        self.tours.move_to_end(key)
+        self.hits += 1
+        cost, canonical_path = cached
+        return cost, from_canonical_path(canonical_path, order)
+
+    def store(self, locations, method, cost, path):
+        """
+        remember a solved tour, evicting the least recently used one if the cache is full
+        """
+        key, order = self._make_key(locations, method)
+        canonical_position = np.empty(len(order), dtype=np.int64)
+        canonical_position[order] = np.arange(len(order))
+        self.tours[key] = (cost, canonical_position[np.asarray(path, dtype=np.int64)])
+        self.tours.move_to_end(key)
+        while len(self.tours) > self.maxsize:
+            self.tours.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.tours.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def info(self):
+        """
+        :return: a dict of the cache counters
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self.tours),
+                'maxsize': self.maxsize}
+
+    @staticmethod
+    def _make_key(locations, method):
+        """
+        :return: the canonical key for these locations and the order that sorts them into it
+        """
+        translated, order = canonical_order(locations)
+        return (method, translated[order].tobytes(), translated.dtype.str), order
+
+
+def canonical_order(locations):
+    """
+    put a set of locations into a form that does not depend on where they are or what order they were listed in
+    :param locations: the (x, y) location of every node
+    :return: the locations translated so their smallest x and y are 0, and the order that sorts them by (x, y)
+    """
+    locations = np.asarray(locations)
+    translated = locations - locations.min(axis=0)
+    order = np.lexsort((translated[:, 1], translated[:, 0]))
+    return translated, order
+
+
+def from_canonical_path(canonical_path, order):
+    """
+    map a tour over canonically ordered nodes back onto the original node order
+    :param canonical_path: the tour, as positions in the canonical order
+    :param order: the order returned by canonical_order
+    :return: the tour as original node indices, rotated to start at node 0
+    """
+    path = np.asarray(order)[np.asarray(canonical_path, dtype=np.int64)]
+    start = int(np.flatnonzero(path == 0)[0])
+    return [int(node) for node in np.roll(path, -start)]
+
+
+tour_cache = TourCache()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+
+import numpy as np
+
+"""
+Scenario files: plane layouts stored as fixed-width binary records
+A scenario file is a 32 byte header (a magic string, the width and height of the plane and the number of peripherals)
+followed by one 24 byte record per peripheral: its x and y location, its charge capacity and its initial charge, all
+little-endian. load_scenario maps the records in without reading them, and the simulations take a scenario in place of
+their random layout. generate_scenario writes layouts of millions of peripherals without ever retrying a collision:
+
+    python -m Services.scenario_service layout.scn 5000000
+"""
+
+MAGIC = b'FAUSCN01'
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('width', '<i8'), ('height', '<i8'), ('count', '<i8')])
+RECORD_DTYPE = np.dtype([('x', '<i4'), ('y', '<i4'), ('charge_capacity', '<f8'), ('current_charge', '<f8')])
+CHUNK_SIZE = 1 << 20  # records generated and written at a time
+PERIPHERAL_DENSITY = 0.04  # peripherals per cell of the plane when no size is given
+CAPACITY_RANGE = (10, 30)  # inclusive, as the simulations lay out their peripherals
+# the simulations place peripherals from here onwards, clear of the charging station and charger in the corner
+MINIMUM_LOCATION = (1, 2)
+
+
+class Scenario:
+
+    def __init__(self, width, height, records, path=None):
+        """
+        :param width: the size of the plane along the x-axis
+        :param height: the size of the plane along the y-axis
+        :param records: array of RECORD_DTYPE, one per peripheral. may be a memory map
+        :param path: the file the scenario was loaded from, if any
+        """
+        self.width = width
+        self.height = height
+        self.records = records
+        self.path = path
+
+    def __len__(self):
+        return len(self.records)
+
+    def add_to_plane(self, plane):
+        """
+        place every peripheral of the scenario on the plane
+        :return: the new peripherals, in the order of the records
+        """
+        if plane.get_width() != self.width or plane.get_length() != self.height:
+            raise ValueError('The scenario is laid out on a {}x{} plane, not a {}x{} one.'.format(
+                self.width, self.height, plane.get_width(), plane.get_length()))
+        return plane.add_peripherals(self.records['x'], self.records['y'], self.records['charge_capacity'],
+                                     self.records['current_charge'])
+
+
+def _header(width, height, count):
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header[0] = (MAGIC, width, height, count)
+    return header.tobytes()
+
+
+def write_scenario(path, width, height, x_locations, y_locations, charge_capacities, current_charges=None):
+    """
+    write a layout to a scenario file
+    :param current_charges: the initial charges, full by default
+    :return: the path
+    """
+    records = np.empty(len(x_locations), dtype=RECORD_DTYPE)
+    records['x'] = x_locations
+    records['y'] = y_locations
+    records['charge_capacity'] = charge_capacities
+    records['current_charge'] = charge_capacities if current_charges is None else current_charges
+    with open(path, 'wb') as scenario_file:
+        scenario_file.write(_header(width, height, len(records)))
+        scenario_file.write(records.tobytes())
+    return path
+
+
+def load_scenario(path, mmap=True):
+    """
+    :param path: a file written by write_scenario or generate_scenario
+    :param mmap: map the records in read-only rather than reading them
+    :return: a Scenario
+    """
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+    if len(header) == 0 or header[0]['magic'] != MAGIC:
+        raise ValueError('{} is not a scenario file.'.format(path))
+    width, height, count = (int(header[0][name]) for name in ('width', 'height', 'count'))
+    expected_size = HEADER_DTYPE.itemsize + count * RECORD_DTYPE.itemsize
+    if os.path.getsize(path) != expected_size:
+        raise ValueError('{} should be {} bytes long for {} peripherals.'.format(path, expected_size, count))
+    if count == 0:
+        records = np.empty(0, dtype=RECORD_DTYPE)
+    elif mmap:
+        records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_DTYPE.itemsize, shape=(count,))
+    else:
+        records = np.fromfile(path, dtype=RECORD_DTYPE, count=count, offset=HEADER_DTYPE.itemsize)
+    return Scenario(width, height, records, path=path)
+
+
+def sample_cells(rng, number_of_cells, area):
+    """
+    pick distinct cells uniformly at random, without trying them one at a time
+    cells are drawn in batches and duplicates dropped until there are enough. the distinct cells of uniform draws are
+    a uniformly random set, so taking a random subset of them in random order is too
+    :param rng: a numpy random Generator
+    :return: array of number_of_cells cell indices in [0, area), in random order
+    raises IndexError if there are fewer cells than asked for
+    """
+    if number_of_cells > area:
+        raise IndexError('Cannot pick {} distinct cells out of {}.'.format(number_of_cells, area))
+    if 2 * number_of_cells > area:
+        # most of the cells are needed, shuffling all of them is cheaper than drawing
+        return rng.permutation(area)[:number_of_cells]
+    cells = np.empty(0, dtype=np.int64)
+    while len(cells) < number_of_cells:
+        missing = number_of_cells - len(cells)
+        draws = rng.integers(0, area, size=missing + missing // 8 + 16, dtype=np.int64)
+        cells = np.sort(np.concatenate((cells, draws)))
+        cells = cells[np.concatenate(([True], cells[1:] != cells[:-1]))]
+    return rng.permutation(cells)[:number_of_cells]
+
+
+def generate_scenario(path, number_of_peripherals, width=None, height=None, seed=None,
+                      capacity_range=CAPACITY_RANGE, chunk_size=CHUNK_SIZE):
+    """
+    write a random layout with every peripheral on its own cell, full to start with
+    :param width: the size of the plane along the x-axis. without width and height the plane is a square holding
+    the peripherals at PERIPHERAL_DENSITY
+    :param height: the size of the plane along the y-axis
+    :param seed: seed for the layout
+    :param capacity_range: the lowest and highest charge capacity, capacities are whole numbers in between
+    :param chunk_size: records built and written at a time
+    :return: the path
+    """
+    if width is None or height is None:
+        side = int(np.ceil(np.sqrt(number_of_peripherals / PERIPHERAL_DENSITY))) + max(MINIMUM_LOCATION)
+        width = side if width is None else width
+        height = side if height is None else height
+    minimum_x, minimum_y = MINIMUM_LOCATION
+    usable_height = height - minimum_y
+    area = max(width - minimum_x, 0) * max(usable_height, 0)
+
+    rng = np.random.default_rng(seed)
+    cells = sample_cells(rng, number_of_peripherals, area)
+    with open(path, 'wb') as scenario_file:
+        scenario_file.write(_header(width, height, number_of_peripherals))
+        for start in range(0, number_of_peripherals, chunk_size):
+            chunk = cells[start:start + chunk_size]
+            records = np.empty(len(chunk), dtype=RECORD_DTYPE)
+            records['x'] = chunk // usable_height + minimum_x
+            records['y'] = chunk % usable_height + minimum_y
+            records['charge_capacity'] = rng.integers(capacity_range[0], capacity_range[1] + 1, size=len(chunk))
+            records['current_charge'] = records['charge_capacity']
+            scenario_file.write(records.tobytes())
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a random scenario file.')
+    parser.add_argument('path')
+    parser.add_argument('peripherals', type=int)
+    parser.add_argument('--width', type=int)
+    parser.add_argument('--height', type=int)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+    generate_scenario(args.path, args.peripherals, width=args.width, height=args.height, seed=args.seed)
+    scenario = load_scenario(args.path)
+    print('{} peripherals on a {}x{} plane written to {}'.format(len(scenario), scenario.width, scenario.height,
+                                                                 args.path))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,10 @@
-import math, itertools
+import math
+
+import numpy as np
+
+from Services.profiling_service import profiler
+
+HELD_KARP_MEMORY_LIMIT = 2 ** 30  # bytes, enough for clusters of up to 23 nodes
 
 
 def get_distance_between(location_1=(0, 0), location_2=(0, 0)):
@@ -11,50 +17,83 @@ def get_distance_between(location_1=(0, 0), location_2=(0, 0)):
     return math.hypot(location_2[0] - location_1[0], location_2[1] - location_1[1])
 
 
-def traveling_salesman(cluster):
+@profiler.timed('traveling_salesman', items=lambda cluster, *args, **kwargs: cluster.get_size())
+def traveling_salesman(cluster, method='auto', stats=None, use_cache=True):
     """
     We want a minimum weight Hamiltonian path through the peripherals in this cluster
     However, it seems that we have stumbled upon a NP-Hard problem
+    Small clusters are solved exactly, large ones with local search heuristics, see Services/route_services.py
+    Tours are remembered by the shape of the cluster, so a layout we have already seen is never solved twice
     :param cluster: the cluster we want to move throughout
+    :param method: the route solver to use, 'auto' picks one by cluster size
+    :param stats: optional dict, filled in with details of the solve
+    :param use_cache: look the tour up in route_services.tour_cache before solving
     :return: a Hamiltonian (possibly) path through the cluster
     """
     from Models.plane_model import Cluster
+    from Services import route_services
     if type(cluster) is not Cluster:
         raise TypeError('Non-cluster object passed to traveling_salesman in Services/simulation_'
                         'services.py\nCheck your code.')
 
-    distance_matrix = get_distance_matrix(cluster)
-    shortest_hamiltonian_path = held_karp(distance_matrix)
+    if method == 'auto':
+        method = route_services.choose_solver(cluster.get_size())
+
+    locations = [peripheral.get_location() for peripheral in cluster.get_peripherals()]
+    if use_cache:
+        cached = route_services.tour_cache.lookup(locations, method)
+        if stats is not None:
+            stats['cache_hit'] = cached is not None
+        if cached is not None:
+            return cached
+
+    # always solve in the canonical node order, so a cached tour and a freshly solved one are the same tour
+    _, order = route_services.canonical_order(locations)
+    distance_matrix = cluster.get_distance_matrix()[np.ix_(order, order)]
+    cost, canonical_path = route_services.solve_route(distance_matrix, method=method, stats=stats)
+    shortest_hamiltonian_path = cost, route_services.from_canonical_path(canonical_path, order)
+
+    if use_cache:
+        route_services.tour_cache.store(locations, method, *shortest_hamiltonian_path)
 
     return shortest_hamiltonian_path
 
 
-def get_distance_matrix(cluster):
+def get_distance_matrix(cluster, dtype=np.float64):
     """
     Create a distance matrix for the nodes in a cluster
+    Coordinates are whole numbers, so the squared differences are summed exactly and every distance comes out exactly
+    as get_distance_between gives it
     :param cluster: the cluster of nodes we are interested in traveling through
-    :return: a list of lists forming a distance matrix
+    :param dtype: float32 halves the memory of the matrix, at the cost of distances that are no longer exact
+    :return: a square NumPy array forming a distance matrix
     """
-    distance_matrix = []
-    nodes = cluster.get_peripherals()
-
-    for r in range(cluster.get_size()):
-        row = []
-        for node in nodes:
-            row.append(get_distance_between(location_1=(nodes[r].get_location()), location_2=node.get_location()))
-        distance_matrix.append(row)
-
-    return distance_matrix
-
-
-def held_karp(distance_matrix):
+    locations = cluster.plane.state.get_locations(cluster.rows).astype(np.float64)
+    x_differences = locations[:, 0, None] - locations[None, :, 0]
+    y_differences = locations[:, 1, None] - locations[None, :, 1]
+    np.multiply(x_differences, x_differences, out=x_differences)
+    np.multiply(y_differences, y_differences, out=y_differences)
+    np.add(x_differences, y_differences, out=x_differences)
+    del y_differences
+    distance_matrix = np.sqrt(x_differences, out=x_differences)
+    return distance_matrix if distance_matrix.dtype == dtype else distance_matrix.astype(dtype)
+
+
+def held_karp(distance_matrix, stats=None, memory_limit=None):
     """
     An implementation of the Held-Karp Algorithm to solve the Traveling Salesman Problem
     :param distance_matrix: a distance matrix of the nodes in the plane
-    This should be a list of lists, each of the same size
+    This should be a list of lists (or a square NumPy array), each of the same size
+    :param stats: optional dict, filled in with the memory used by the solve under 'peak_memory_bytes'
+    :param memory_limit: refuse to solve if the DP tables would need more than this many bytes.
+    Defaults to HELD_KARP_MEMORY_LIMIT
     Runtime should be O(n^2 * 2^n)
     :return: the path and its cost
     adapted from CarlEkerot github
+
+    The DP table is a flat array indexed by [subset bitmask, last node], where bit j of the mask stands for node
+    j + 1 (node 0 is always the start). Subsets are processed one size at a time so that the min over predecessors
+    is a single NumPy reduction per (subset size, last node) pair.
     """
 
     # first some error checking
@@ -64,47 +103,86 @@ def held_karp(distance_matrix):
 
     # if we only have one node, no need for all this
     if number_of_nodes == 1:
+        if stats is not None:
+            stats['peak_memory_bytes'] = 0
         return 0, [0]
 
-    C = {}
-
-    for k in range(1, number_of_nodes):
-        C[(1 << k, k)] = (distance_matrix[0][k], 0)
-
-    for subset_size in range(2, number_of_nodes):
-        for subset in itertools.combinations(range(1, number_of_nodes), subset_size):
-            bits = 0
-            for bit in subset:
-                bits |= 1 << bit
-
-            for k in subset:
-                prev = bits & ~(1 << k)
-                res = []
-                for m in subset:
-                    if m == 0 or m == k:
-                        continue
-                    res.append((C[(prev, m)][0] + distance_matrix[m][k], m))
-                C[(bits, k)] = min(res)
-
-    bits = (2**number_of_nodes - 1) - 1
-    res = []
-
-    for k in range(1, number_of_nodes):
-        res.append((C[(bits, k)][0] + distance_matrix[k][0], k))
-    opt, parent = min(res)
+    if memory_limit is None:
+        memory_limit = HELD_KARP_MEMORY_LIMIT
+    memory_needed = held_karp_memory_estimate(number_of_nodes)
+    if memory_needed > memory_limit:
+        raise MemoryError('Held-Karp on {} nodes needs about {} bytes, more than the {} byte limit.'
+                          .format(number_of_nodes, memory_needed, memory_limit))
+
+    distances = np.asarray(distance_matrix, dtype=np.float64)
+    number_of_bits = number_of_nodes - 1
+    number_of_subsets = 1 << number_of_bits
+    between = distances[1:, 1:]
+
+    # cost[bits, k] is the cheapest path from node 0 through every node in bits, ending at node k + 1
+    cost = np.full((number_of_subsets, number_of_bits), np.inf)
+    parent = np.zeros((number_of_subsets, number_of_bits), dtype=np.int8)
+    single_bits = np.arange(number_of_bits)
+    cost[1 << single_bits, single_bits] = distances[0, 1:]
+
+    # group every subset by its size
+    subsets = np.arange(number_of_subsets, dtype=np.int64)
+    subset_sizes = np.zeros(number_of_subsets, dtype=np.int8)
+    for bit in range(number_of_bits):
+        subset_sizes += ((subsets >> bit) & 1).astype(np.int8)
+    subsets_by_size = np.argsort(subset_sizes, kind='stable')
+    size_boundaries = np.searchsorted(subset_sizes[subsets_by_size], np.arange(number_of_bits + 2))
+    del subset_sizes
+
+    peak_temporary_bytes = 0
+    for subset_size in range(2, number_of_bits + 1):
+        layer = subsets_by_size[size_boundaries[subset_size]:size_boundaries[subset_size + 1]]
+        for k in range(number_of_bits):
+            bits = layer[(layer >> k) & 1 == 1]
+            prev = bits & ~(1 << k)
+            # nodes outside prev still hold inf, so they never win the min
+            candidates = cost[prev] + between[:, k]
+            best = np.argmin(candidates, axis=1)
+            cost[bits, k] = candidates[np.arange(len(bits)), best]
+            parent[bits, k] = best
+            peak_temporary_bytes = max(peak_temporary_bytes, candidates.nbytes + best.nbytes + 2 * bits.nbytes)
+
+    bits = number_of_subsets - 1
+    total = cost[bits] + distances[1:, 0]
+    last = int(np.argmin(total))
+    opt = float(total[last])
 
     path = []
     for i in range(number_of_nodes - 1):
-        path.append(parent)
-        new_bits = bits & ~(1 << parent)
-        _, parent = C[(bits, parent)]
+        path.append(last + 1)
+        new_bits = bits & ~(1 << last)
+        last = int(parent[bits, last])
         bits = new_bits
 
     path.append(0)
 
+    if stats is not None:
+        stats['peak_memory_bytes'] = int(cost.nbytes + parent.nbytes + subsets.nbytes + subsets_by_size.nbytes +
+                                         peak_temporary_bytes)
+
     return opt, list(reversed(path))
 
 
+def held_karp_memory_estimate(number_of_nodes):
+    """
+    Upper bound on the memory held_karp needs for a problem of this size
+    :param number_of_nodes: the number of nodes in the distance matrix
+    :return: the number of bytes
+    """
+    if number_of_nodes <= 1:
+        return 0
+    number_of_bits = number_of_nodes - 1
+    number_of_subsets = 1 << number_of_bits
+    # cost (float64) and parent (int8) tables, the subset index arrays, and one layer of candidates
+    largest_layer = math.comb(number_of_bits - 1, (number_of_bits - 1) // 2)
+    return (9 * number_of_bits + 17) * number_of_subsets + largest_layer * (8 * number_of_bits + 24)
+
+
 def get_size_of_square_matrix(matrix):
     """
     Check whether or not a matrix is square.
@@ -112,6 +190,11 @@ def get_size_of_square_matrix(matrix):
     :return: the length/width of the matrix, or False
     """
 
+    if isinstance(matrix, np.ndarray):
+        if matrix.ndim != 2 or matrix.shape[0] != matrix.shape[1]:
+            return False
+        return int(matrix.shape[0])
+
     if type(matrix) is not list:
         raise TypeError('Distance matrix must be a list of lists. Check your input and try again.')
 
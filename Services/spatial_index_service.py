@@ -0,0 +1,77 @@
+import math
+
+import numpy as np
+
+
+class GridIndex:
+    """
+    uniform grid over a fixed set of points, used to answer "which points are within r of here" without looking
+    at every point in the plane. Points are referred to by their position in the locations array they were built from
+    With the cell size equal to the query radius, a radius query only has to look at the 3x3 block of cells around
+    the query point.
+    """
+
+    def __init__(self, locations, cell_size):
+        """
+        :param locations: an (n, 2) array-like of point coordinates
+        :param cell_size: the side length of each grid cell, normally the radius that will be queried
+        """
+        if cell_size <= 0:
+            raise ValueError('Grid cell size must be positive.')
+        self.locations = np.asarray(locations, dtype=np.float64).reshape(-1, 2)
+        self.cell_size = cell_size
+        self.alive = np.ones(len(self.locations), dtype=bool)
+        self.cells = {}
+
+        if len(self.locations) == 0:
+            return
+        cell_coordinates = np.floor(self.locations / cell_size).astype(np.int64)
+        # a stable sort keeps the points in each cell in ascending order, which keeps queries deterministic
+        order = np.lexsort((cell_coordinates[:, 1], cell_coordinates[:, 0]))
+        sorted_cells = cell_coordinates[order]
+        boundaries = np.flatnonzero(np.any(sorted_cells[1:] != sorted_cells[:-1], axis=1)) + 1
+        starts = np.concatenate(([0], boundaries))
+        ends = np.concatenate((boundaries, [len(order)]))
+        for start, end, (cell_x, cell_y) in zip(starts.tolist(), ends.tolist(), sorted_cells[starts].tolist()):
+            self.cells[(cell_x, cell_y)] = order[start:end]
+
+    def __len__(self):
+        return int(np.count_nonzero(self.alive))
+
+    def remove(self, points):
+        """
+        take points out of the index so later queries no longer return them
+        :param points: a point index or an array of point indices
+        """
+        self.alive[points] = False
+
+    def query_radius(self, location, radius):
+        """
+        :param location: the (x, y) centre of the query
+        :param radius: points at most this far from the centre are returned
+        :return: a sorted array of the indices of every point still in the index within the radius
+        """
+        reach = max(int(math.ceil(radius / self.cell_size)), 0)
+        centre_x = int(math.floor(location[0] / self.cell_size))
+        centre_y = int(math.floor(location[1] / self.cell_size))
+
+        candidates = []
+        for cell_x in range(centre_x - reach, centre_x + reach + 1):
+            for cell_y in range(centre_y - reach, centre_y + reach + 1):
+                points = self.cells.get((cell_x, cell_y))
+                if points is None:
+                    continue
+                points = points[self.alive[points]]
+                # drop removed points from the cell as we go, so later queries do not scan them again
+                if len(points) == 0:
+                    del self.cells[(cell_x, cell_y)]
+                    continue
+                self.cells[(cell_x, cell_y)] = points
+                candidates.append(points)
+
+        if not candidates:
+            return np.empty(0, dtype=np.int64)
+        candidates = np.concatenate(candidates)
+        offsets = self.locations[candidates] - np.asarray(location, dtype=np.float64)
+        within = np.hypot(offsets[:, 0], offsets[:, 1]) <= radius
+        return np.sort(candidates[within])
@@ -0,0 +1,353 @@
+import numpy as np
+
+from Analytics.basic_analysis import calculate_effective_energy_percentage, calculate_ineffective_energy_percentage
+from Simulation.single_charger_simulation import SingleChargerSim
+
+"""
+Many replicas of the single charger strategies, run together
+Each replica is a layout from its own seed, set up exactly as SingleChargerSim sets it up. From then on the state of
+every replica lives in (replica x peripheral) arrays and each step advances all of them by one charging trip at once,
+with the per-replica branches of the event handlers turned into masks. Every replica keeps its own simulated clock and
+its own drain clock, stored the way PeripheralState stores them, so each replica does the same floating-point operations
+as a single run and ends up with exactly the results it gets when run on its own. This is purely a way to run thousands
+of small layouts on one core, e.g. for variance estimates.
+"""
+
+PERIPHERAL_ENERGY_LOSS_MULTIPLIER = SingleChargerSim.PERIPHERAL_ENERGY_LOSS_MULTIPLIER
+
+
+class BatchedSingleChargerSim:
+
+    def __init__(self, seeds, maximum_cluster_radius=None):
+        """
+        :param seeds: one seed per replica
+        :param maximum_cluster_radius: the radius of the clusters, SingleChargerSim.MAXIMUM_CLUSTER_RADIUS by default
+        """
+        self.seeds = list(seeds)
+        self.maximum_cluster_radius = maximum_cluster_radius
+        self.replicas = len(self.seeds)
+
+    def _set_up_replicas(self):
+        """
+        lay out every replica with SingleChargerSim and copy what the run needs into padded arrays
+        peripheral columns follow the rows of each replica's state store, so requests are queued in the same order as
+        in a single run
+        """
+        sims = []
+        for seed in self.seeds:
+            sim = SingleChargerSim(seed=seed, maximum_cluster_radius=self.maximum_cluster_radius)
+            sim._set_up_plane()
+            sims.append(sim)
+
+        replicas = self.replicas
+        peripherals = max(len(sim.peripherals) for sim in sims)
+        clusters = max(len(sim.clusters) for sim in sims)
+        cluster_size = max(cluster.get_size() for sim in sims for cluster in sim.clusters)
+
+        # as in PeripheralState, a draining column stores its charge plus its replica's drain clock
+        self.stored_charges = np.zeros((replicas, peripherals))
+        self.drain_clocks = np.zeros(replicas)
+        self.capacities = np.zeros((replicas, peripherals))
+        self.thresholds = np.full((replicas, peripherals), np.nan)
+        self.draining = np.zeros((replicas, peripherals), dtype=bool)
+        self.cluster_of = np.full((replicas, peripherals), -1, dtype=np.int64)
+        self.tours = np.zeros((replicas, clusters, cluster_size), dtype=np.int64)
+        self.tour_sizes = np.zeros((replicas, clusters), dtype=np.int64)
+        self.tour_lengths = np.zeros((replicas, clusters))
+        self.distances_in = np.zeros((replicas, clusters))
+        self.distances_out = np.zeros((replicas, clusters))
+        self.number_of_clusters = np.zeros(replicas, dtype=np.int64)
+        self.charger_charges = np.zeros(replicas)
+        self.charger_capacities = np.zeros(replicas)
+        # columns in the order of each replica's peripheral list, which is the order its averages are summed in
+        self.peripheral_orders = []
+
+        for replica, sim in enumerate(sims):
+            state = sim.plane.state
+            rows = np.array([peripheral.row for peripheral in sim.peripherals], dtype=np.int64)
+            ordered_rows = np.sort(rows)
+            number_of_peripherals = len(rows)
+            self.stored_charges[replica, :number_of_peripherals] = state.stored_charge[ordered_rows]
+            self.drain_clocks[replica] = state.drain_clock
+            self.capacities[replica, :number_of_peripherals] = state.charge_capacity[ordered_rows]
+            self.draining[replica, :number_of_peripherals] = state.draining[ordered_rows]
+            self.peripheral_orders.append(np.searchsorted(ordered_rows, rows))
+
+            charger_location = sim.charger.get_location()
+            for position, cluster in enumerate(sim.clusters):
+                # communication runs look clusters up by id, which is their position in the list
+                if cluster.get_id() != position:
+                    raise AssertionError('Cluster ids are expected to match their position in the cluster list.')
+                tour_rows = [cluster.peripheral_list[index].row for index in cluster.shortest_path_through_cluster]
+                tour_columns = np.searchsorted(ordered_rows, tour_rows)
+                self.tours[replica, position, :len(tour_columns)] = tour_columns
+                self.tour_sizes[replica, position] = len(tour_columns)
+                self.tour_lengths[replica, position] = cluster.length_of_shortest_path
+                self.distances_in[replica, position], self.distances_out[replica, position] = \
+                    cluster.get_trip_distances(charger_location)
+                self.cluster_of[replica, tour_columns] = position
+            self.number_of_clusters[replica] = len(sim.clusters)
+            self.charger_charges[replica] = sim.charger.current_charge
+            self.charger_capacities[replica] = sim.charger.charge_capacity
+
+        self.columns = np.arange(peripherals)
+        self.travel_energy_used = np.zeros(replicas)
+        self.transfer_energy_used = np.zeros(replicas)
+        self.total_energy_used = np.zeros(replicas)
+        self.cycles = np.zeros(replicas, dtype=np.int64)
+        self.now = np.zeros(replicas)
+        self.peripheral_failure_count = np.zeros(replicas, dtype=np.int64)
+        self.time_of_earliest_failure = np.full(replicas, np.nan)
+        self.average_charge_at_15_cycles = np.full(replicas, np.nan)
+
+    def _get_charges(self):
+        """
+        the batched PeripheralState.get_charges
+        """
+        return self.stored_charges - self.drain_clocks[:, None] * self.draining
+
+    def _drain(self, amounts, excluded_columns=None):
+        """
+        the batched PeripheralState.drain, amounts is one amount per replica
+        """
+        self.drain_clocks += amounts
+        if excluded_columns is not None:
+            replicas = np.arange(self.replicas)
+            # the excluded column gets the amount added back
+            self.stored_charges[replicas, excluded_columns] += np.where(self.draining[replicas, excluded_columns],
+                                                                        amounts, 0.0)
+
+    def _drain_ticks(self, ticks):
+        """
+        the batched PeripheralState.drain_ticks, ticks is one count per replica
+        """
+        self.drain_clocks += np.maximum(ticks, 0)
+
+    def _charge_clusters(self, serving, cluster_positions):
+        """
+        the batched ChargingNode.charge_cluster: the charger of every serving replica goes round one of its clusters
+        replicas that are not serving are given zero amounts, which leave their state exactly as it was
+        :return: the travel and transfer energy used by each replica
+        """
+        replicas = np.arange(self.replicas)
+        positions = np.where(serving, cluster_positions, 0)
+        distances_in = np.where(serving, self.distances_in[replicas, positions], 0.0)
+        tour_lengths = np.where(serving, self.tour_lengths[replicas, positions], 0.0)
+        distances_out = np.where(serving, self.distances_out[replicas, positions], 0.0)
+        tour_sizes = np.where(serving, self.tour_sizes[replicas, positions], 0)
+
+        # travel to the cluster
+        self.charger_charges -= distances_in
+        travel_energy_used = distances_in.copy()
+        self._drain(distances_in * PERIPHERAL_ENERGY_LOSS_MULTIPLIER)
+
+        self.charger_charges -= tour_lengths
+        travel_energy_used += tour_lengths
+
+        # charge the peripherals along the tour until the charger only has enough left to get home
+        transfer_energy_used = np.zeros(self.replicas)
+        charging = serving.copy()
+        for step in range(self.tours.shape[2]):
+            charging &= step < tour_sizes
+            if not charging.any():
+                break
+            columns = self.tours[replicas, positions, step]
+            amount_of_charge_needed = self.capacities[replicas, columns] - \
+                (self.stored_charges[replicas, columns] - self.drain_clocks)
+            charge_available = self.charger_charges - distances_out
+            amounts_to_charge = np.where(charging, np.minimum(amount_of_charge_needed, charge_available), 0.0)
+            self.charger_charges -= amounts_to_charge
+            self.stored_charges[replicas, columns] += amounts_to_charge
+            self._drain(amounts_to_charge * PERIPHERAL_ENERGY_LOSS_MULTIPLIER, excluded_columns=columns)
+            transfer_energy_used += amounts_to_charge
+            charging &= self.charger_charges != distances_out
+
+        # and back home
+        self.charger_charges -= distances_out
+        travel_energy_used += distances_out
+        self._drain(distances_out * PERIPHERAL_ENERGY_LOSS_MULTIPLIER)
+        return travel_energy_used, transfer_energy_used
+
+    def _recharge_and_check_for_failures(self, recharging, amounts_needed_to_replenish):
+        """
+        the batched SingleChargerSim._recharge_and_check_for_failures, followed by counting the cycle
+        """
+        self.charger_charges = np.where(recharging, self.charger_capacities, self.charger_charges)
+        self._drain(np.where(recharging, amounts_needed_to_replenish * PERIPHERAL_ENERGY_LOSS_MULTIPLIER, 0.0))
+
+        # peripherals that failed before, the ones left without capacity, are emptied again by storing the drain clock
+        drain_clocks = np.broadcast_to(self.drain_clocks[:, None], self.stored_charges.shape)
+        emptied = recharging[:, None] & self.draining & (self.capacities == 0)
+        self.stored_charges[emptied] = drain_clocks[emptied]
+
+        # a column has run out once the drain clock reaches what it stores, as in PeripheralState.pop_depleted_rows
+        failed = recharging[:, None] & self.draining & (self.capacities > 0) & \
+            (self.stored_charges <= self.drain_clocks[:, None])
+        self.peripheral_failure_count += failed.sum(axis=1)
+        # a failure at time 0 does not count as the earliest one, just as in Simulation.peripheral_failure
+        no_failure_yet = np.isnan(self.time_of_earliest_failure) | (self.time_of_earliest_failure == 0)
+        self.time_of_earliest_failure = np.where(failed.any(axis=1) & no_failure_yet, self.now,
+                                                 self.time_of_earliest_failure)
+        self.stored_charges[failed] = drain_clocks[failed]
+        self.capacities[failed] = 0
+
+        self.cycles += recharging
+        for replica in np.flatnonzero(recharging & (self.cycles == 15 * self.number_of_clusters)).tolist():
+            charges = (self.stored_charges[replica, self.peripheral_orders[replica]] -
+                       self.drain_clocks[replica]).tolist()
+            self.average_charge_at_15_cycles[replica] = sum(charges) / len(charges)
+
+    def _ticks_until_below_threshold(self, horizon):
+        """
+        the batched PeripheralState.get_ticks_until_below_threshold, cut short at the horizon
+        """
+        watched = self.draining & ~np.isnan(self.thresholds)
+        stored_charges = self.stored_charges
+        drain_clocks = self.drain_clocks[:, None]
+        with np.errstate(invalid='ignore'):
+            ticks = np.maximum(np.ceil(stored_charges - drain_clocks - self.thresholds), 1)
+            ticks = np.where((ticks > 1) & (stored_charges - (drain_clocks + (ticks - 1)) <= self.thresholds),
+                             ticks - 1, ticks)
+            ticks = np.where(stored_charges - (drain_clocks + ticks) > self.thresholds, ticks + 1, ticks)
+        ticks = np.where(watched, ticks, np.inf).min(axis=1, initial=np.inf)
+        ticks_within_horizon = np.maximum(np.floor(horizon - self.now) + 1, 0)
+        return np.minimum(ticks, ticks_within_horizon)
+
+    def single_charger_simulation(self, horizon=None):
+        """
+        run SingleChargerSim.single_charger_simulation on every replica
+        :param horizon: the simulated time the run lasts, SingleChargerSim.SIMULATED_HORIZON by default
+        :return: a summary per replica, see get_summaries
+        """
+        horizon = horizon if horizon is not None else SingleChargerSim.SIMULATED_HORIZON
+        self._set_up_replicas()
+        travel_times = np.zeros(self.replicas)
+
+        while True:
+            serving = travel_times <= horizon
+            if not serving.any():
+                break
+            self.now = np.where(serving, travel_times, self.now)
+            travel_energy_used, transfer_energy_used = self._charge_clusters(
+                serving, self.cycles % self.number_of_clusters)
+            self.travel_energy_used += travel_energy_used
+            self.transfer_energy_used += transfer_energy_used
+            self.total_energy_used += transfer_energy_used + travel_energy_used
+
+            arrival_times = travel_times + np.maximum(travel_energy_used + transfer_energy_used, 0)
+            arrived = serving & (arrival_times <= horizon)
+            self.now = np.where(arrived, arrival_times, self.now)
+
+            # recharging takes one time unit per unit of charge
+            amounts_needed_to_replenish = self.charger_capacities - self.charger_charges
+            recharge_times = arrival_times + amounts_needed_to_replenish
+            recharged = arrived & (recharge_times <= horizon)
+            self.now = np.where(recharged, recharge_times, self.now)
+            self._recharge_and_check_for_failures(recharged, amounts_needed_to_replenish)
+
+            # replicas that did not make it back and recharge within the horizon are done
+            travel_times = np.where(recharged, recharge_times, np.inf)
+
+        return self.get_summaries()
+
+    def single_charger_simulation_with_communication(self, charge_percentage_threshold, horizon=None):
+        """
+        run SingleChargerSim.single_charger_simulation_with_communication on every replica
+        each replica keeps its charging queue as (replica x peripheral) arrays of who is queued, how urgently and in
+        which order they asked, so serving the most urgent request is a masked argmin
+        :return: a summary per replica, see get_summaries
+        """
+        horizon = horizon if horizon is not None else SingleChargerSim.SIMULATED_HORIZON
+        self._set_up_replicas()
+        self.thresholds = np.where(self.draining, charge_percentage_threshold / 100 * self.capacities, np.nan)
+        queued = np.zeros(self.stored_charges.shape, dtype=bool)
+        urgencies = np.zeros(self.stored_charges.shape)
+        request_order = np.zeros(self.stored_charges.shape, dtype=np.int64)
+        requests_made = np.zeros(self.replicas, dtype=np.int64)
+        replicas = np.arange(self.replicas)
+        check_times = np.zeros(self.replicas)
+
+        while True:
+            checking = check_times <= horizon
+            if not checking.any():
+                break
+            self.now = np.where(checking, check_times, self.now)
+
+            # peripherals at or below their threshold join the queue, in row order
+            charges = self._get_charges()
+            new_requests = checking[:, None] & self.draining & (charges <= self.thresholds) & ~queued
+            request_order = np.where(new_requests, requests_made[:, None] + np.cumsum(new_requests, axis=1) - 1,
+                                     request_order)
+            # keyed on the drain clock reading at which a peripheral runs empty, as in SingleChargerSim
+            urgencies = np.where(new_requests, self.stored_charges, urgencies)
+            queued |= new_requests
+            requests_made += new_requests.sum(axis=1)
+
+            # serve the most urgent request, the earliest one of equally urgent requests
+            serving = checking & queued.any(axis=1)
+            queued_urgencies = np.where(queued, urgencies, np.inf)
+            most_urgent = queued & (queued_urgencies == queued_urgencies.min(axis=1, initial=np.inf)[:, None])
+            next_in_line = np.argmin(np.where(most_urgent, request_order, np.iinfo(np.int64).max), axis=1)
+            queued[replicas[serving], next_in_line[serving]] = False
+            cluster_positions = self.cluster_of[replicas, next_in_line]
+
+            travel_energy_used, transfer_energy_used = self._charge_clusters(serving, cluster_positions)
+            arrival_times = check_times + np.maximum(travel_energy_used + transfer_energy_used, 0)
+            arrived = serving & (arrival_times <= horizon)
+            self.now = np.where(arrived, arrival_times, self.now)
+
+            # back home, every request from the cluster just charged is dropped and the energy is logged
+            queued &= ~(arrived[:, None] & (self.cluster_of == cluster_positions[:, None]))
+            self.travel_energy_used += np.where(arrived, travel_energy_used, 0.0)
+            self.transfer_energy_used += np.where(arrived, transfer_energy_used, 0.0)
+            self.total_energy_used += np.where(arrived, transfer_energy_used + travel_energy_used, 0.0)
+
+            amounts_needed_to_replenish = self.charger_capacities - self.charger_charges
+            recharge_times = arrival_times + amounts_needed_to_replenish
+            recharged = arrived & (recharge_times <= horizon)
+            self.now = np.where(recharged, recharge_times, self.now)
+            self._recharge_and_check_for_failures(recharged, amounts_needed_to_replenish)
+
+            # replicas with nothing to charge skip straight to the next threshold crossing
+            idle = checking & ~serving
+            ticks = np.where(idle, self._ticks_until_below_threshold(horizon), 0)
+            self._drain_ticks(ticks)
+
+            check_times = np.where(serving, np.where(recharged, recharge_times, np.inf),
+                                   np.where(idle, check_times + ticks, np.inf))
+
+        return self.get_summaries()
+
+    def get_summaries(self):
+        """
+        :return: one dict per replica with the same keys as Simulation.get_summary, plus the seed, the number of cycles
+        and the simulated time of the last event
+        """
+        summaries = []
+        charges = self._get_charges()
+        for replica, seed in enumerate(self.seeds):
+            order = self.peripheral_orders[replica]
+            total_energy_used = float(self.total_energy_used[replica])
+            travel_energy_used = float(self.travel_energy_used[replica])
+            transfer_energy_used = float(self.transfer_energy_used[replica])
+            earliest_failure = float(self.time_of_earliest_failure[replica])
+            average_charge = float(self.average_charge_at_15_cycles[replica])
+            summaries.append({
+                'seed': seed,
+                'travel_energy_used': travel_energy_used,
+                'transfer_energy_used': transfer_energy_used,
+                'total_energy_used': total_energy_used,
+                'effective_energy_percentage': (calculate_effective_energy_percentage(transfer_energy_used,
+                                                                                      total_energy_used)
+                                                if total_energy_used else None),
+                'ineffective_energy_percentage': (calculate_ineffective_energy_percentage(travel_energy_used,
+                                                                                          total_energy_used)
+                                                  if total_energy_used else None),
+                'average_charge_at_15_cycles': None if average_charge != average_charge else average_charge,
+                'peripheral_failure_count': int(self.peripheral_failure_count[replica]),
+                'failed_peripheral_fraction': float(np.count_nonzero(charges[replica, order] <= 0)) / len(order),
+                'time_of_earliest_failure': None if earliest_failure != earliest_failure else earliest_failure,
+                'cycles': int(self.cycles[replica]),
+                'simulated_time': float(self.now[replica]),
+            })
+        return summaries
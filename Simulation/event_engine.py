@@ -0,0 +1,95 @@
+import heapq
+import math
+
+
+class EventEngine:
+    """
+    discrete-event core shared by the simulations
+    Events sit in a heap ordered by their simulated timestamp. Running the engine pops them one at a time and jumps
+    simulated time straight to each one, so how long a run lasts depends on the simulated horizon and not on how fast
+    the machine happens to be.
+
+    Simulated time is measured in the same units as energy: travelling one unit of distance, transferring one unit of
+    charge or recharging a charger by one unit all take one unit of time.
+    """
+
+    # the kinds of events the simulations schedule
+    TRAVEL = 'travel'  # a charger sets out on a trip
+    ARRIVAL = 'arrival'  # a charger is back at its charging station
+    CHARGE = 'charge'  # a charger has finished recharging at its station
+    THRESHOLD = 'threshold'  # devices are checked against their charge thresholds
+    ROUND = 'round'  # a dedicated charger sets out round its cluster
+    ROUND_FINISHED = 'round_finished'  # a dedicated charger is back from a round of its cluster
+
+    def __init__(self, horizon, start_time=0):
+        """
+        :param horizon: the simulated time at which the run ends. events after it are left in the queue
+        :param start_time: the simulated time the run starts at
+        """
+        self.now = start_time
+        self.horizon = horizon
+        self.queue = []
+        self.handlers = {}
+        self.sequence = 0  # breaks ties between events at the same time, first scheduled runs first
+        self.events_processed = 0
+        self.stopped = False
+
+    def __len__(self):
+        return len(self.queue)
+
+    def on(self, kind, handler):
+        """
+        register the function called for every event of a kind
+        :param handler: called with the event payload, after simulated time has moved to the event
+        """
+        self.handlers[kind] = handler
+
+    def schedule(self, time, kind, payload=None):
+        """
+        add an event to the queue
+        :param time: the simulated time the event happens at. it may not be in the past
+        """
+        if time < self.now:
+            raise ValueError('Cannot schedule a {} event at {}, simulated time is already {}.'.format(kind, time,
+                                                                                                     self.now))
+        if kind not in self.handlers:
+            raise KeyError('No handler registered for {} events.'.format(kind))
+        heapq.heappush(self.queue, (time, self.sequence, kind, payload))
+        self.sequence += 1
+
+    def schedule_after(self, delay, kind, payload=None):
+        self.schedule(self.now + delay, kind, payload)
+
+    def peek_time(self):
+        """
+        :return: the time of the next event, or None if the queue is empty
+        """
+        return self.queue[0][0] if self.queue else None
+
+    def ticks_within_horizon(self):
+        """
+        :return: how many events one time unit apart, the first of them now, happen no later than the horizon
+        """
+        return max(int(math.floor(self.horizon - self.now)) + 1, 0)
+
+    def stop(self):
+        """
+        end the current run after the event being handled
+        """
+        self.stopped = True
+
+    def run(self, horizon=None):
+        """
+        process events in time order until the queue empties, stop() is called or the horizon is reached
+        :param horizon: optionally move the horizon, e.g. to continue a run that has already finished
+        :return: the simulated time of the last event handled
+        """
+        if horizon is not None:
+            self.horizon = horizon
+        self.stopped = False
+        while self.queue and not self.stopped and self.queue[0][0] <= self.horizon:
+            time, _, kind, payload = heapq.heappop(self.queue)
+            self.now = time
+            self.handlers[kind](payload)
+            self.events_processed += 1
+        return self.now
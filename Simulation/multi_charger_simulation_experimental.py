@@ -1,11 +1,13 @@
-from random import randint
-from itertools import cycle
-from collections import deque
+import random
+
+import numpy as np
 
 from Models.plane_model import *
+from Models.charging_queue_model import ChargingQueue
 from Services import simulation_services
 from Models.simulation_model import Simulation
-import datetime
+from Services.profiling_service import profiler
+from Simulation.event_engine import EventEngine
 
 
 class MultiChargerSim:
@@ -17,231 +19,474 @@ class MultiChargerSim:
     NUMBER_OF_PERIPHERALS = 15
     LOCATION_OF_CHARGING_STATION = ORIGIN  # the other option is to set it to the middle of the plane
     PERIPHERAL_ENERGY_LOSS_MULTIPLIER = 0.005  # how fast peripherals lose energy per time unit
-
-    def __init__(self):
-        self.plane = Plane(MultiChargerSim.PLANE_HEIGHT, MultiChargerSim.PLANE_WIDTH)
+    SIMULATED_HORIZON = 100000  # simulated time units a run lasts, see Simulation/event_engine.py
+    MAXIMUM_CLUSTER_RADIUS = 5
+
+    def __init__(self, seed=None, maximum_cluster_radius=None, telemetry=None, scenario=None, statistics=None):
+        """
+        :param seed: seed for laying out the plane, so a run can be repeated exactly. without one the global
+        random module is used
+        :param maximum_cluster_radius: the radius of the clusters, MAXIMUM_CLUSTER_RADIUS by default
+        :param telemetry: an optional Analytics.telemetry_recorder.TelemetryRecorder, fed a row every cycle
+        :param scenario: an optional Services.scenario_service.Scenario, or the path of a scenario file, to take the
+        plane and the peripherals from instead of laying them out at random
+        :param statistics: an optional Analytics.streaming_statistics.StreamingStatistics, updated every cycle and
+        reported with the results
+        """
+        if scenario is not None and not hasattr(scenario, 'records'):
+            from Services.scenario_service import load_scenario
+            scenario = load_scenario(scenario)
+        self.scenario = scenario
+        self.telemetry = telemetry
+        self.statistics = statistics
+        self.peripheral_rows = None
+        self.seed = seed
+        self.random = random.Random(seed) if seed is not None else random
+        self.maximum_cluster_radius = maximum_cluster_radius if maximum_cluster_radius is not None \
+            else MultiChargerSim.MAXIMUM_CLUSTER_RADIUS
+        if scenario is not None:
+            self.plane = Plane(scenario.width, scenario.height)
+        else:
+            self.plane = Plane(MultiChargerSim.PLANE_HEIGHT, MultiChargerSim.PLANE_WIDTH)
         self.peripherals = []
         self.travel_energy_used = 0
         self.transfer_energy_used = 0
         self.total_energy_used = 0
         self.cycles = 0
-        self.start_time = datetime.datetime.now()
-        self.running_sim = True
-
-    def multi_charger_simulation_experimental(self):
-
+        self.engine = None
+        self.charger = None
+        self.clusters = []
+        self.dedicated_charger_list = []
+        self.shortest_path_through_clusters = None
+        self.length_of_path_through_clusters = None
+        self.simulation = None
+        self.charging_queue = None
+        # fleet mode only, see multi_charger_simulation_fleet
+        self.last_drain_time = 0
+        self.route = None
+        self.route_distances_from_home = None
+        self.route_leg_distances = None
+        self.dedicated_charger_busy = None
+        self.dedicated_charger_topped_up = None
+
+    def _set_up_plane(self):
+        """
+        place the master charging station and charger and the peripherals, split the peripherals into clusters and
+        give each cluster its own dedicated charger
+        """
         # add a single master charging station and master charging node
         charging_station = ChargingStation(MultiChargerSim.LOCATION_OF_CHARGING_STATION[0],
                                            MultiChargerSim.LOCATION_OF_CHARGING_STATION[1], self.plane)
-        charger = ChargingNode(MultiChargerSim.LOCATION_OF_CHARGING_STATION[0],
-                               MultiChargerSim.LOCATION_OF_CHARGING_STATION[1] + 1, self.plane,
-                               charge_capacity=80, current_charge=80)
-
-        # add a series of peripherals at random locations
-        while self.plane.get_number_of_peripherals() < MultiChargerSim.NUMBER_OF_PERIPHERALS:
-            try:
-                capacity = randint(10, 30)
-                self.peripherals.append(Peripheral(randint(1, 20), randint(2, 20), self.plane, charge_capacity=capacity,
-                                                   current_charge=capacity))
-            # IndexError indicates that the location is occupied. Just allow and try again
-            except IndexError:
-                pass
-
-        simulation = Simulation(self.peripherals)
+        self.charger = ChargingNode(MultiChargerSim.LOCATION_OF_CHARGING_STATION[0],
+                                    MultiChargerSim.LOCATION_OF_CHARGING_STATION[1] + 1, self.plane,
+                                    charge_capacity=80, current_charge=80)
+
+        # take the peripherals from the scenario, or add a series of peripherals at random locations
+        if self.scenario is not None:
+            self.peripherals.extend(self.scenario.add_to_plane(self.plane))
+        else:
+            while self.plane.get_number_of_peripherals() < MultiChargerSim.NUMBER_OF_PERIPHERALS:
+                try:
+                    capacity = self.random.randint(10, 30)
+                    # clear of the charging station and charger in the corner, and within the plane
+                    self.peripherals.append(Peripheral(self.random.randint(1, self.plane.get_width() - 1),
+                                                       self.random.randint(2, self.plane.get_length() - 1),
+                                                       self.plane, charge_capacity=capacity, current_charge=capacity))
+                # IndexError indicates that the location is occupied. Just allow and try again
+                except IndexError:
+                    pass
+
+        self.simulation = Simulation(self.peripherals, statistics=self.statistics)
 
         # generate clusters
         # TODO: calculate the max allowable distance here
-        maximum_cluster_radius = 5
-        clusters = self.plane.generate_clusters(peripherals_list=self.peripherals,
-                                                max_distance_between_point_and_centroid=maximum_cluster_radius)
+        self.clusters = self.plane.generate_clusters(
+            peripherals_list=self.peripherals, max_distance_between_point_and_centroid=self.maximum_cluster_radius)
 
         # instantiate a dedicated charger for each cluster
-        dedicated_charger_list = []
-        for cluster in clusters:
+        for cluster in self.clusters:
             dedicated_charger = ChargingNode(plane=self.plane, x_location=cluster.x_location,
                                              y_location=cluster.y_location, charge_capacity=60,
                                              current_charge=60)
             cluster.set_dedicated_charger(dedicated_charger)
-            dedicated_charger_list.append(dedicated_charger)
+            self.dedicated_charger_list.append(dedicated_charger)
             self.peripherals.append(dedicated_charger)
+            # dedicated chargers stay out in the field and lose energy like the peripherals do
+            self.plane.set_draining(dedicated_charger)
+        self.peripheral_rows = np.array([peripheral.row for peripheral in self.peripherals], dtype=np.int64)
 
         # grab the shortest hamiltonian path through the clusters if we need it
-        length_of_path_through_clusters, shortest_path_through_clusters = \
-            simulation_services.traveling_salesman(Cluster(id=-1, peripheral_list=dedicated_charger_list))
-
-        # cycle through clusters one at a time, return home, charge, go on to the next cluster
-        while self.running_sim:
-            for cluster in cycle(clusters):
-
-                dedicated_charger = cluster.dedicated_charger
-                charge_needed = dedicated_charger.get_charge_needed()
-                distance_to_travel = 2 * simulation_services.get_distance_between(charger.get_location(),
-                                                                                  dedicated_charger.get_location())
-                charger.current_charge -= distance_to_travel
-
-                # decrement energy of all peripherals
-                for p in self.peripherals:
-                    p.current_charge -= distance_to_travel * MultiChargerSim.PERIPHERAL_ENERGY_LOSS_MULTIPLIER
+        self.length_of_path_through_clusters, self.shortest_path_through_clusters = \
+            simulation_services.traveling_salesman(Cluster(id=-1, peripheral_list=self.dedicated_charger_list))
 
-                self.travel_energy_used += distance_to_travel
-                self.total_energy_used += distance_to_travel
-                charge_available = charger.current_charge
+    def _run(self, horizon):
+        """
+        process events until the simulated horizon and hand back the simulation object
+        """
+        self.engine.run(horizon if horizon is not None else MultiChargerSim.SIMULATED_HORIZON)
 
-                # charge the dedicated charger either to full, or as much as possible
-                amount_to_charge = min(charge_needed, charge_available)
-                charger.charge_peripheral(dedicated_charger, amount_to_charge)
-
-                # we want to decrement the length of the path from the dedicated charger first
-                dedicated_charger.current_charge -= cluster.length_of_shortest_path
-                # this was originally considered transfer energy but it's now travel energy
-                self.travel_energy_used += cluster.length_of_shortest_path
-                self.total_energy_used += cluster.length_of_shortest_path
-
-                # dedicated charger now charges the cluster
-                for peripheral_index in cluster.shortest_path_through_cluster:
-                    peripheral = cluster.peripheral_list[peripheral_index]
-                    amount_of_charge_needed = peripheral.charge_capacity - peripheral.current_charge
-                    charge_available = dedicated_charger.current_charge
-                    amount_to_charge = min(amount_of_charge_needed, charge_available)
-                    dedicated_charger.charge_peripheral(peripheral=peripheral, amount=amount_to_charge)
-                    self.transfer_energy_used += amount_to_charge
-                    self.total_energy_used += amount_to_charge
-
-                # recharge the charger, decrement the amount of charge held by all devices
-                amount_needed_to_replenish = charger.charge_capacity - charger.current_charge
-                charger.charge_self()
-                for peripheral in self.peripherals:
-                    peripheral.current_charge -= (amount_needed_to_replenish *
-                                                  MultiChargerSim.PERIPHERAL_ENERGY_LOSS_MULTIPLIER)
-
-                self.cycles += 1
-                if self.cycles == 15 * len(clusters):
-                    # shallow copy of the list at 15 minutes
-                    simulation.peripheral_list_after_15_cycles = self.peripherals[:]
-                    simulation.calculate_average_charge_at_15_cycles()
-
-                # stop running the sim at 5 minutes
-                if datetime.datetime.now() - self.start_time >= datetime.timedelta(minutes=5):
-                    self.running_sim = False
-                    break
+        if self.telemetry is not None:
+            self.telemetry.flush()
 
         # record energy used
         # peripherals are still correctly tracked here
-        simulation.total_energy_used = self.total_energy_used
-        simulation.transfer_energy_used = self.transfer_energy_used
-        simulation.travel_energy_used = self.travel_energy_used
-
-        return simulation
-
-    def multi_charger_simulation_experimental_with_communication(self, charge_percentage_threshold):
-        # add a single master charging station and master charging node
-        charging_station = ChargingStation(MultiChargerSim.LOCATION_OF_CHARGING_STATION[0],
-                                           MultiChargerSim.LOCATION_OF_CHARGING_STATION[1], self.plane)
-        charger = ChargingNode(MultiChargerSim.LOCATION_OF_CHARGING_STATION[0],
-                               MultiChargerSim.LOCATION_OF_CHARGING_STATION[1] + 1, self.plane,
-                               charge_capacity=80, current_charge=80)
-
-        # add a series of peripherals at random locations
-        while self.plane.get_number_of_peripherals() < MultiChargerSim.NUMBER_OF_PERIPHERALS:
-            try:
-                capacity = randint(10, 30)
-                self.peripherals.append(Peripheral(randint(1, 20), randint(2, 20), self.plane, charge_capacity=capacity,
-                                                   current_charge=capacity))
-            # IndexError indicates that the location is occupied. Just allow and try again
-            except IndexError:
-                pass
-
-        simulation = Simulation(self.peripherals)
-
-        # generate clusters
-        maximum_cluster_radius = 5
-        clusters = self.plane.generate_clusters(peripherals_list=self.peripherals,
-                                                max_distance_between_point_and_centroid=maximum_cluster_radius)
+        self.simulation.total_energy_used = self.total_energy_used
+        self.simulation.transfer_energy_used = self.transfer_energy_used
+        self.simulation.travel_energy_used = self.travel_energy_used
+
+        return self.simulation
+
+    def resume(self, horizon=None):
+        """
+        carry on with a run that has already been set up, e.g. one restored from a checkpoint or one that reached
+        its horizon
+        :param horizon: the simulated time to run to, the current horizon by default
+        :return: The simulation object
+        """
+        return self._run(horizon if horizon is not None else self.engine.horizon)
+
+    def _count_cycle(self, cycles=1):
+        self.cycles += cycles
+        if self.cycles == 15 * len(self.clusters):
+            self.simulation.record_charges_after_15_cycles()
+        if self.telemetry is not None:
+            self.telemetry.record(self.cycles, self.engine.now, self.travel_energy_used, self.transfer_energy_used,
+                                  self.charger.current_charge, self.plane.state.get_charges(self.peripheral_rows))
+        if self.statistics is not None:
+            state = self.plane.state
+            self.statistics.record(self.engine.now, self.travel_energy_used, self.transfer_energy_used,
+                                   state.get_charges(self.peripheral_rows), state.charge_capacity[self.peripheral_rows],
+                                   ticks=cycles)
+
+    def _top_up_dedicated_charger(self, dedicated_charger):
+        """
+        the master charger makes a round trip to a dedicated charger and charges it as much as it can
+        :return: the distance travelled and the amount of charge handed over
+        """
+        charge_needed = dedicated_charger.get_charge_needed()
+        distance_to_travel = 2 * simulation_services.get_distance_between(self.charger.get_location(),
+                                                                          dedicated_charger.get_location())
+        self.charger.current_charge -= distance_to_travel
+
+        # decrement energy of all peripherals
+        self.plane.drain_peripherals(distance_to_travel * MultiChargerSim.PERIPHERAL_ENERGY_LOSS_MULTIPLIER)
+
+        self.travel_energy_used += distance_to_travel
+        self.total_energy_used += distance_to_travel
+        charge_available = self.charger.current_charge
+
+        # charge the dedicated charger either to full, or as much as possible
+        amount_to_charge = min(charge_needed, charge_available)
+        self.charger.charge_peripheral(dedicated_charger, amount_to_charge)
+
+        return distance_to_travel, amount_to_charge
+
+    @profiler.timed('charge_cluster_with_dedicated_charger',
+                    items=lambda sim, cluster, dedicated_charger: cluster.get_size())
+    def _charge_cluster_with(self, cluster, dedicated_charger):
+        """
+        a dedicated charger walks the cluster tour, charging each peripheral as much as it can
+        :return: the amount of charge transferred
+        """
+        transferred = 0
+        for peripheral_index in cluster.shortest_path_through_cluster:
+            peripheral = cluster.peripheral_list[peripheral_index]
+            amount_of_charge_needed = peripheral.charge_capacity - peripheral.current_charge
+            charge_available = dedicated_charger.current_charge
+            amount_to_charge = min(amount_of_charge_needed, charge_available)
+            dedicated_charger.charge_peripheral(peripheral=peripheral, amount=amount_to_charge)
+            self.transfer_energy_used += amount_to_charge
+            self.total_energy_used += amount_to_charge
+            transferred += amount_to_charge
+        return transferred
+
+    def _arrive_home(self, _):
+        # recharging takes one time unit per unit of charge
+        amount_needed_to_replenish = self.charger.charge_capacity - self.charger.current_charge
+        self.engine.schedule_after(amount_needed_to_replenish, EventEngine.CHARGE, amount_needed_to_replenish)
+
+    def _recharge_master_charger(self, amount_needed_to_replenish):
+        # recharge the charger, decrement the amount of charge held by all devices
+        self.charger.charge_self()
+        self.plane.drain_peripherals(amount_needed_to_replenish * MultiChargerSim.PERIPHERAL_ENERGY_LOSS_MULTIPLIER)
+
+    def _travel_to_next_cluster(self, cluster_position):
+        cluster = self.clusters[cluster_position]
+        dedicated_charger = cluster.dedicated_charger
+        distance_to_travel, amount_topped_up = self._top_up_dedicated_charger(dedicated_charger)
+
+        # we want to decrement the length of the path from the dedicated charger first
+        dedicated_charger.current_charge -= cluster.length_of_shortest_path
+        # this was originally considered transfer energy but it's now travel energy
+        self.travel_energy_used += cluster.length_of_shortest_path
+        self.total_energy_used += cluster.length_of_shortest_path
+
+        # dedicated charger now charges the cluster
+        transferred = self._charge_cluster_with(cluster, dedicated_charger)
+
+        # the trip takes one time unit per unit of energy spent on it
+        trip_duration = max(distance_to_travel + amount_topped_up + cluster.length_of_shortest_path + transferred, 0)
+        self.engine.schedule_after(trip_duration, EventEngine.ARRIVAL, cluster_position)
+
+    def _finish_charging_between_clusters(self, amount_needed_to_replenish):
+        self._recharge_master_charger(amount_needed_to_replenish)
+        self._count_cycle()
 
-        # instantiate a dedicated charger for each cluster
-        dedicated_charger_list = []
-        for cluster in clusters:
-            dedicated_charger = ChargingNode(plane=self.plane, x_location=cluster.x_location,
-                                             y_location=cluster.y_location, charge_capacity=60,
-                                             current_charge=60)
-            cluster.set_dedicated_charger(dedicated_charger)
-            dedicated_charger_list.append(dedicated_charger)
-            self.peripherals.append(dedicated_charger)
+        # cycle through clusters one at a time, return home, charge, go on to the next cluster
+        self.engine.schedule_after(0, EventEngine.TRAVEL, self.cycles % len(self.clusters))
+
+    @profiler.timed('check_thresholds')
+    def _check_thresholds(self, _):
+        # we assume that dedicated chargers all start with full power
+        # we check if any DEDICATED CHARGER is below the threshold
+        # the dedicated charger that will run out first is served first. requests are keyed on the drain clock reading
+        # at which it runs empty, which does not change while it waits
+        state = self.plane.state
+        for dedicated_charger_position, dedicated_charger in enumerate(self.dedicated_charger_list):
+            if dedicated_charger.current_charge <= dedicated_charger.charge_threshold and \
+                    dedicated_charger_position not in self.charging_queue:
+                self.charging_queue.push(dedicated_charger_position, float(state.stored_charge[dedicated_charger.row]))
+
+        # check if the queue is empty. If it is, decrement everything by 1 every time unit until a dedicated charger
+        # drops to its threshold. each time unit counts as a cycle, so skip straight to that one in a single step
+        if len(self.charging_queue) > 0:
+            self.engine.schedule_after(0, EventEngine.TRAVEL, self.charging_queue.pop())
+        else:
+            ticks = self._ticks_until_next_request()
+            self.plane.state.drain_ticks(ticks)
+            self._count_cycle(ticks)
+            self.engine.schedule_after(ticks, EventEngine.THRESHOLD)
+
+    def _ticks_until_next_request(self):
+        """
+        :return: how many idle time units pass before a dedicated charger drops to its threshold, cut short at the
+        horizon and at the cycle the 15 cycle snapshot is taken
+        """
+        ticks = self.plane.state.get_ticks_until_below_threshold(
+            [dedicated_charger.row for dedicated_charger in self.dedicated_charger_list])
+        ticks_within_horizon = self.engine.ticks_within_horizon()
+        ticks = ticks_within_horizon if ticks is None else min(ticks, ticks_within_horizon)
+        cycles_until_snapshot = 15 * len(self.clusters) - self.cycles
+        if 0 < cycles_until_snapshot < ticks:
+            ticks = cycles_until_snapshot
+        return ticks
+
+    def _travel_to_requesting_charger(self, dedicated_charger_position):
+        dedicated_charger = self.dedicated_charger_list[dedicated_charger_position]
+        distance_to_travel, amount_topped_up = self._top_up_dedicated_charger(dedicated_charger)
+
+        # at this step, we cycle through each cluster and see if the dedicated charger gets activated
+        transferred = 0
+        for cluster in self.clusters:
+            if self.plane.state.any_below_threshold(cluster.rows):
+                # dedicated charger now charges the cluster
+                transferred += self._charge_cluster_with(cluster, dedicated_charger)
+
+        # the trip takes one time unit per unit of energy spent on it
+        trip_duration = max(distance_to_travel + amount_topped_up + transferred, 0)
+        self.engine.schedule_after(trip_duration, EventEngine.ARRIVAL, dedicated_charger_position)
+
+    def _finish_charging_on_request(self, amount_needed_to_replenish):
+        self._recharge_master_charger(amount_needed_to_replenish)
+        self._count_cycle()
+        self.engine.schedule_after(0, EventEngine.THRESHOLD)
+
+    def _drain_until_now(self):
+        """
+        in fleet mode chargers work at the same time, so devices lose energy with simulated time rather than with each
+        charger's activity. drain them for the time since this was last called
+        """
+        elapsed = self.engine.now - self.last_drain_time
+        if elapsed > 0:
+            self.plane.drain_peripherals(elapsed * MultiChargerSim.PERIPHERAL_ENERGY_LOSS_MULTIPLIER)
+        self.last_drain_time = self.engine.now
+
+    def _set_up_fleet(self):
+        """
+        lay out the master charger's route: the precomputed path through the dedicated chargers, out from and back to
+        the charging station. distances along it are worked out once
+        """
+        self.route = list(self.shortest_path_through_clusters)
+        home = self.charger.get_location()
+        stops = [self.dedicated_charger_list[position].get_location() for position in self.route]
+        # distances are symmetric, so these are also the distances back home from each stop
+        self.route_distances_from_home = [simulation_services.get_distance_between(home, stop) for stop in stops]
+        self.route_leg_distances = [simulation_services.get_distance_between(stops[stop], stops[stop + 1])
+                                    for stop in range(len(stops) - 1)]
+        self.dedicated_charger_busy = [False] * len(self.dedicated_charger_list)
+        self.dedicated_charger_topped_up = [False] * len(self.dedicated_charger_list)
+
+    def _fleet_depart_from_home(self, route_position):
+        """
+        the master charger sets out from the charging station towards a stop on the route
+        stops it could not get to and back from even on a full charge are skipped
+        """
+        for _ in range(len(self.route)):
+            distance = self.route_distances_from_home[route_position]
+            if 2 * distance <= self.charger.current_charge:
+                self.charger.current_charge -= distance
+                self.travel_energy_used += distance
+                self.total_energy_used += distance
+                self.engine.schedule_after(distance, EventEngine.TRAVEL, route_position)
+                return
+            if self.charger.current_charge < self.charger.charge_capacity:
+                # try again once recharged
+                self.engine.schedule_after(0, EventEngine.ARRIVAL, route_position)
+                return
+            route_position = (route_position + 1) % len(self.route)
+        # no stop is in reach of the master charger
+        self.engine.stop()
+
+    def _fleet_arrive_at_stop(self, route_position):
+        """
+        the master charger reaches a dedicated charger on its route, tops it up and moves on along the route
+        it heads home to recharge first if it could not fill up the next dedicated charger and still make it back, so
+        the dedicated chargers late on the route are not left with whatever happens to be left over
+        """
+        self._drain_until_now()
+        dedicated_charger_position = self.route[route_position]
+        dedicated_charger = self.dedicated_charger_list[dedicated_charger_position]
+        distance_home = self.route_distances_from_home[route_position]
+
+        # hand over as much as the dedicated charger needs, keeping enough to get home
+        amount_to_charge = max(min(dedicated_charger.get_charge_needed(),
+                                   self.charger.current_charge - distance_home), 0)
+        self.charger.charge_peripheral(dedicated_charger, amount_to_charge)
+        self._count_cycle()
+
+        # the dedicated charger sets out once topped up, or as soon as it is back from the round it is on
+        if self.dedicated_charger_busy[dedicated_charger_position]:
+            self.dedicated_charger_topped_up[dedicated_charger_position] = True
+        else:
+            self.dedicated_charger_busy[dedicated_charger_position] = True
+            self.engine.schedule_after(amount_to_charge, EventEngine.ROUND, dedicated_charger_position)
+
+        next_route_position = route_position + 1
+        if next_route_position < len(self.route):
+            leg = self.route_leg_distances[route_position]
+            next_charge_needed = self.dedicated_charger_list[self.route[next_route_position]].get_charge_needed()
+            if leg + next_charge_needed + self.route_distances_from_home[next_route_position] <= \
+                    self.charger.current_charge:
+                self.charger.current_charge -= leg
+                self.travel_energy_used += leg
+                self.total_energy_used += leg
+                self.engine.schedule_after(amount_to_charge + leg, EventEngine.TRAVEL, next_route_position)
+                return
+        else:
+            # the route is done, start it again after recharging
+            next_route_position = 0
+
+        self.charger.current_charge -= distance_home
+        self.travel_energy_used += distance_home
+        self.total_energy_used += distance_home
+        self.engine.schedule_after(amount_to_charge + distance_home, EventEngine.ARRIVAL, next_route_position)
+
+    def _fleet_arrive_home(self, route_position):
+        self._drain_until_now()
+        # recharging takes one time unit per unit of charge
+        amount_needed_to_replenish = self.charger.charge_capacity - self.charger.current_charge
+        self.engine.schedule_after(amount_needed_to_replenish, EventEngine.CHARGE, route_position)
+
+    def _fleet_finish_charging(self, route_position):
+        self._drain_until_now()
+        self.charger.charge_self()
+        self._fleet_depart_from_home(route_position)
+
+    def _fleet_start_round(self, dedicated_charger_position):
+        """
+        a dedicated charger walks its cluster's tour, charging each peripheral as much as it can
+        it stays put until the next top-up if it does not have the charge to get round
+        """
+        self._drain_until_now()
+        cluster = self.clusters[dedicated_charger_position]
+        dedicated_charger = self.dedicated_charger_list[dedicated_charger_position]
+        if dedicated_charger.current_charge < cluster.length_of_shortest_path:
+            self.dedicated_charger_busy[dedicated_charger_position] = False
+            return
+
+        dedicated_charger.current_charge -= cluster.length_of_shortest_path
+        self.travel_energy_used += cluster.length_of_shortest_path
+        self.total_energy_used += cluster.length_of_shortest_path
+        transferred = self._charge_cluster_with(cluster, dedicated_charger)
+
+        # the round takes one time unit per unit of energy spent on it
+        round_duration = max(cluster.length_of_shortest_path + transferred, 0)
+        self.engine.schedule_after(round_duration, EventEngine.ROUND_FINISHED, dedicated_charger_position)
+
+    def _fleet_finish_round(self, dedicated_charger_position):
+        if self.dedicated_charger_topped_up[dedicated_charger_position]:
+            self.dedicated_charger_topped_up[dedicated_charger_position] = False
+            self.engine.schedule_after(0, EventEngine.ROUND, dedicated_charger_position)
+        else:
+            self.dedicated_charger_busy[dedicated_charger_position] = False
+
+    def _register_fleet_handlers(self):
+        self.engine.on(EventEngine.TRAVEL, self._fleet_arrive_at_stop)
+        self.engine.on(EventEngine.ARRIVAL, self._fleet_arrive_home)
+        self.engine.on(EventEngine.CHARGE, self._fleet_finish_charging)
+        self.engine.on(EventEngine.ROUND, self._fleet_start_round)
+        self.engine.on(EventEngine.ROUND_FINISHED, self._fleet_finish_round)
+
+    def _register_handlers(self, with_communication):
+        """
+        point each kind of event at the handler for the strategy being run
+        """
+        self.engine.on(EventEngine.ARRIVAL, self._arrive_home)
+        if with_communication:
+            self.engine.on(EventEngine.THRESHOLD, self._check_thresholds)
+            self.engine.on(EventEngine.TRAVEL, self._travel_to_requesting_charger)
+            self.engine.on(EventEngine.CHARGE, self._finish_charging_on_request)
+        else:
+            self.engine.on(EventEngine.TRAVEL, self._travel_to_next_cluster)
+            self.engine.on(EventEngine.CHARGE, self._finish_charging_between_clusters)
+
+    def multi_charger_simulation_experimental(self, horizon=None):
+        """
+        :param horizon: the simulated time the run lasts, SIMULATED_HORIZON by default
+        :return: The simulation object
+        """
+        self._set_up_plane()
+        self.engine = EventEngine(horizon if horizon is not None else MultiChargerSim.SIMULATED_HORIZON)
+        self._register_handlers(with_communication=False)
+        self.engine.schedule(0, EventEngine.TRAVEL, 0)
+
+        return self._run(horizon)
+
+    def multi_charger_simulation_experimental_with_communication(self, charge_percentage_threshold, horizon=None):
+        """
+        :param charge_percentage_threshold: some value between 0 and 100 at which dedicated chargers and peripherals
+        ask to be charged
+        :param horizon: the simulated time the run lasts, SIMULATED_HORIZON by default
+        :return: The simulation object
+        """
+        self._set_up_plane()
+        self.engine = EventEngine(horizon if horizon is not None else MultiChargerSim.SIMULATED_HORIZON)
 
         # set threshold for both chargers and peripherals
         for peripheral in self.peripherals:
             peripheral.set_charge_threshold(charge_percentage_threshold)
 
-        # instantiate the charging queue. It is initially empty but will be filled with any peripherals below threshold.
-        charging_queue = deque()
-
-        while self.running_sim:
-            # we assume that dedicated chargers all start with full power
-            # we check if any DEDICATED CHARGER is below the threshold
-            for dedicated_charger in dedicated_charger_list:
-                if dedicated_charger.current_charge <= dedicated_charger.charge_threshold and \
-                        dedicated_charger not in charging_queue:
-                    charging_queue.append(dedicated_charger)
-
-            # check if the queue is empty. If it is, decrement everything by 1.
-            if len(charging_queue) > 0:
-                dedicated_charger = charging_queue.popleft()
-                charge_needed = dedicated_charger.get_charge_needed()
-                distance_to_travel = 2 * simulation_services.get_distance_between(charger.get_location(),
-                                                                                  dedicated_charger.get_location())
-                # decrement energy of all peripherals
-                for p in self.peripherals:
-                    p.current_charge -= distance_to_travel * MultiChargerSim.PERIPHERAL_ENERGY_LOSS_MULTIPLIER
-
-                charger.current_charge -= distance_to_travel
-
-                self.travel_energy_used += distance_to_travel
-                self.total_energy_used += distance_to_travel
-                charge_available = charger.current_charge
-
-                # charge the dedicated charger either to full, or as much as possible
-                amount_to_charge = min(charge_needed, charge_available)
-                charger.charge_peripheral(dedicated_charger, amount_to_charge)
-
-                # at this step, we cycle through each cluster and see if the dedicated charger gets activated
-                for cluster in clusters:
-                    for peripheral in cluster.peripheral_list:
-                        if peripheral.current_charge <= peripheral.charge_threshold:
-                            # dedicated charger now charges the cluster
-                            for peripheral_index in cluster.shortest_path_through_cluster:
-                                peripheral = cluster.peripheral_list[peripheral_index]
-                                amount_of_charge_needed = peripheral.charge_capacity - peripheral.current_charge
-                                charge_available = dedicated_charger.current_charge
-                                amount_to_charge = min(amount_of_charge_needed, charge_available)
-                                dedicated_charger.charge_peripheral(peripheral=peripheral, amount=amount_to_charge)
-                                self.transfer_energy_used += amount_to_charge
-                                self.total_energy_used += amount_to_charge
-
-                # recharge the charger, decrement the amount of charge held by all devices
-                amount_needed_to_replenish = charger.charge_capacity - charger.current_charge
-                charger.charge_self()
-                for peripheral in self.peripherals:
-                    peripheral.current_charge -= (amount_needed_to_replenish *
-                                                  MultiChargerSim.PERIPHERAL_ENERGY_LOSS_MULTIPLIER)
-
-            else:
-                for peripheral in self.peripherals:
-                    peripheral.current_charge -= 1
-
-            self.cycles += 1
-            if self.cycles == 15 * len(clusters):
-                # shallow copy of the list at 15 minutes
-                simulation.peripheral_list_after_15_cycles = self.peripherals[:]
-                simulation.calculate_average_charge_at_15_cycles()
-
-            # stop running the sim at 5 minutes
-            if datetime.datetime.now() - self.start_time >= datetime.timedelta(minutes=5):
-                self.running_sim = False
-                break
+        # instantiate the charging queue. It is initially empty but will be filled with any chargers below threshold.
+        self.charging_queue = ChargingQueue()
 
-        # record energy used
-        simulation.total_energy_used = self.total_energy_used
-        simulation.transfer_energy_used = self.transfer_energy_used
-        simulation.travel_energy_used = self.travel_energy_used
+        self._register_handlers(with_communication=True)
+        self.engine.schedule(0, EventEngine.THRESHOLD)
+
+        return self._run(horizon)
+
+    def multi_charger_simulation_fleet(self, horizon=None):
+        """
+        A variation of the multi charger paradigm where every charger keeps its own timeline. The master charger
+        follows the shortest path through the dedicated chargers, topping each one up as it passes, and every
+        dedicated charger sets out round its cluster as soon as it has been topped up, while the master moves on
+
+        :param horizon: the simulated time the run lasts, SIMULATED_HORIZON by default
+        :return: The simulation object
+        """
+        self._set_up_plane()
+        self.engine = EventEngine(horizon if horizon is not None else MultiChargerSim.SIMULATED_HORIZON)
+        self._set_up_fleet()
+        self._register_fleet_handlers()
+        self._fleet_depart_from_home(0)
 
-        return simulation
\ No newline at end of file
+        return self._run(horizon)
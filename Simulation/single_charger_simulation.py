@@ -1,10 +1,12 @@
-from random import randint
-from itertools import cycle
-import datetime
-from collections import deque
+import random
+
+import numpy as np
 
 from Models.plane_model import *
+from Models.charging_queue_model import ChargingQueue
 from Models.simulation_model import Simulation
+from Services.profiling_service import profiler
+from Simulation.event_engine import EventEngine
 
 
 class SingleChargerSim:
@@ -16,193 +18,293 @@ class SingleChargerSim:
     NUMBER_OF_PERIPHERALS = 15
     LOCATION_OF_CHARGING_STATION = ORIGIN  # the other option is to set it to the middle of the plane
     PERIPHERAL_ENERGY_LOSS_MULTIPLIER = 0.005  # how fast peripherals lose energy per time unit
+    SIMULATED_HORIZON = 100000  # simulated time units a run lasts, see Simulation/event_engine.py
+    MAXIMUM_CLUSTER_RADIUS = 5
     DEBUG = False
 
-    def __init__(self):
-        self.plane = Plane(SingleChargerSim.PLANE_HEIGHT, SingleChargerSim.PLANE_WIDTH)
+    def __init__(self, seed=None, maximum_cluster_radius=None, telemetry=None, repair_clusters=False,
+                 scenario=None, statistics=None):
+        """
+        :param seed: seed for laying out the plane, so a run can be repeated exactly. without one the global
+        random module is used
+        :param maximum_cluster_radius: the radius of the clusters, MAXIMUM_CLUSTER_RADIUS by default
+        :param telemetry: an optional Analytics.telemetry_recorder.TelemetryRecorder, fed a row every cycle
+        :param repair_clusters: take failed peripherals out of their clusters and repair the tours around them
+        :param scenario: an optional Services.scenario_service.Scenario, or the path of a scenario file, to take the
+        plane and the peripherals from instead of laying them out at random
+        :param statistics: an optional Analytics.streaming_statistics.StreamingStatistics, updated every cycle and
+        reported with the results
+        """
+        if scenario is not None and not hasattr(scenario, 'records'):
+            from Services.scenario_service import load_scenario
+            scenario = load_scenario(scenario)
+        self.scenario = scenario
+        self.repair_clusters = repair_clusters
+        self.cluster_manager = None
+        self.telemetry = telemetry
+        self.statistics = statistics
+        self.peripheral_rows = None
+        self.failed_rows = []
+        self.seed = seed
+        self.random = random.Random(seed) if seed is not None else random
+        self.maximum_cluster_radius = maximum_cluster_radius if maximum_cluster_radius is not None \
+            else SingleChargerSim.MAXIMUM_CLUSTER_RADIUS
+        if scenario is not None:
+            self.plane = Plane(scenario.width, scenario.height)
+        else:
+            self.plane = Plane(SingleChargerSim.PLANE_HEIGHT, SingleChargerSim.PLANE_WIDTH)
         self.peripherals = []
         self.travel_energy_used = 0
         self.transfer_energy_used = 0
         self.total_energy_used = 0
         self.cycles = 0
-        self.start_time = datetime.datetime.now()
-        self.running_sim = True
-
-    # go through each cluster one at a time, charging each node in the cluster, then return home
-    def single_charger_simulation(self):
+        self.engine = None
+        self.charger = None
+        self.clusters = []
+        self.simulation = None
+        self.charging_queue = None
 
+    def _set_up_plane(self):
+        """
+        place the charging station, the charger and the peripherals, then split the peripherals into clusters
+        """
         # add a single charging station and charging node
         charging_station = ChargingStation(SingleChargerSim.LOCATION_OF_CHARGING_STATION[0],
                                            SingleChargerSim.LOCATION_OF_CHARGING_STATION[1], self.plane)
-        charger = ChargingNode(SingleChargerSim.LOCATION_OF_CHARGING_STATION[0],
-                               SingleChargerSim.LOCATION_OF_CHARGING_STATION[1] + 1, self.plane,
-                               charge_capacity=60, current_charge=60)
-
-        # add a series of peripherals at random locations
-        while self.plane.get_number_of_peripherals() < SingleChargerSim.NUMBER_OF_PERIPHERALS:
-            try:
-                capacity = randint(10, 30)
-                self.peripherals.append(Peripheral(randint(1, 20), randint(2, 20), self.plane, charge_capacity=capacity,
-                                                   current_charge=capacity))
-            # IndexError indicates that the location is occupied. Just allow and try again
-            except IndexError:
-                pass
+        self.charger = ChargingNode(SingleChargerSim.LOCATION_OF_CHARGING_STATION[0],
+                                    SingleChargerSim.LOCATION_OF_CHARGING_STATION[1] + 1, self.plane,
+                                    charge_capacity=60, current_charge=60)
+
+        # take the peripherals from the scenario, or add a series of peripherals at random locations
+        if self.scenario is not None:
+            self.peripherals.extend(self.scenario.add_to_plane(self.plane))
+        else:
+            while self.plane.get_number_of_peripherals() < SingleChargerSim.NUMBER_OF_PERIPHERALS:
+                try:
+                    capacity = self.random.randint(10, 30)
+                    # clear of the charging station and charger in the corner, and within the plane
+                    self.peripherals.append(Peripheral(self.random.randint(1, self.plane.get_width() - 1),
+                                                       self.random.randint(2, self.plane.get_length() - 1),
+                                                       self.plane, charge_capacity=capacity, current_charge=capacity))
+                # IndexError indicates that the location is occupied. Just allow and try again
+                except IndexError:
+                    pass
 
         # instantiate simulation object for analysis purposes
-        simulation = Simulation(self.peripherals)
+        self.simulation = Simulation(self.peripherals, statistics=self.statistics)
 
         # generate clusters
         # TODO: calculate the max allowable distance here
-        maximum_cluster_radius = 5
-        clusters = self.plane.generate_clusters(peripherals_list=self.peripherals,
-                                                max_distance_between_point_and_centroid=maximum_cluster_radius)
+        self.clusters = self.plane.generate_clusters(
+            peripherals_list=self.peripherals, max_distance_between_point_and_centroid=self.maximum_cluster_radius)
+        self.peripheral_rows = np.array([peripheral.row for peripheral in self.peripherals], dtype=np.int64)
+        if self.repair_clusters:
+            from Services.cluster_manager_service import ClusterManager
+            self.cluster_manager = ClusterManager(self.plane, self.maximum_cluster_radius)
+            self.simulation.cluster_manager = self.cluster_manager
+
+    def _run(self, horizon):
+        """
+        process events until the simulated horizon and hand back the simulation object
+        """
+        self.engine.run(horizon if horizon is not None else SingleChargerSim.SIMULATED_HORIZON)
 
-        # cycle through clusters one at a time, return home, charge, go on to the next cluster
-        while self.running_sim:
-            for cluster in cycle(clusters):
-                # assume that it takes 1 point of energy per unit traveled
-                travel_energy_used_this_cycle, transfer_energy_used_this_cycle = charger.charge_cluster(cluster)
-
-                # log the amount of energy used
-                self.travel_energy_used += travel_energy_used_this_cycle
-                self.transfer_energy_used += transfer_energy_used_this_cycle
-                self.total_energy_used += transfer_energy_used_this_cycle + travel_energy_used_this_cycle
-
-                # recharge the charger, decrement the amount of charge held by all devices
-                amount_needed_to_replenish = charger.charge_capacity - charger.current_charge
-                charger.charge_self()
-
-                # decrement energy of all peripherals while charging
-                for peripheral in self.peripherals:
-                    peripheral.current_charge -= (amount_needed_to_replenish *
-                                                  SingleChargerSim.PERIPHERAL_ENERGY_LOSS_MULTIPLIER)
-
-                    # check whether any peripherals are dead, one at a time
-                    if peripheral.current_charge <= 0:
-                        simulation.peripheral_failure(peripheral_list_index=self.peripherals.index(peripheral),
-                                                      timestamp=datetime.datetime.now())
-
-                self.cycles += 1
-                if self.cycles == 15 * len(clusters):
-                    # shallow copy of the list at 15 minutes
-                    simulation.peripheral_list_after_15_cycles = self.peripherals[:]
-                    simulation.calculate_average_charge_at_15_cycles()
-
-                # don't keep going if we are just debugging
-                if SingleChargerSim.DEBUG and self.cycles == 5 * len(clusters):
-                    self.running_sim = False
-                    break
-
-                # stop running the sim at 5 minutes
-                if datetime.datetime.now() - self.start_time >= datetime.timedelta(minutes=5):
-                    self.running_sim = False
-                    break
+        if self.telemetry is not None:
+            self.telemetry.flush()
 
         # record energy used
-        simulation.total_energy_used = self.total_energy_used
-        simulation.transfer_energy_used = self.transfer_energy_used
-        simulation.travel_energy_used = self.travel_energy_used
+        self.simulation.total_energy_used = self.total_energy_used
+        self.simulation.transfer_energy_used = self.transfer_energy_used
+        self.simulation.travel_energy_used = self.travel_energy_used
 
-        return simulation
+        return self.simulation
 
-    def single_charger_simulation_with_communication(self, charge_percentage_threshold):
+    def resume(self, horizon=None):
         """
-        A variation of the single charger paradigm where peripherals are able to transmit signals to the charger
-        when they require more energy
+        carry on with a run that has already been set up, e.g. one restored from a checkpoint or one that reached
+        its horizon
+        :param horizon: the simulated time to run to, the current horizon by default
+        :return: The simulation object
+        """
+        return self._run(horizon if horizon is not None else self.engine.horizon)
 
-        :param charge_percentage_threshold: some value between 0 and 100 at which the signal transmission is triggered
+    def _recharge_and_check_for_failures(self, amount_needed_to_replenish):
+        """
+        the charger has finished recharging at the station, and every peripheral has drained in the meantime
+        """
+        self.charger.charge_self()
+
+        # decrement energy of all peripherals while charging
+        self.plane.drain_peripherals(amount_needed_to_replenish * SingleChargerSim.PERIPHERAL_ENERGY_LOSS_MULTIPLIER)
+
+        # without repaired clusters failed peripherals are still drained, and are emptied again at every check. they
+        # have no capacity left, so they are not watched for depletion and are emptied by storing the drain clock
+        state = self.plane.state
+        if self.failed_rows and self.cluster_manager is None:
+            state.stored_charge[self.failed_rows] = state.drain_clock
+
+        # check whether any peripherals have died since the last check
+        for row in state.pop_depleted_rows():
+            self.simulation.record_peripheral_failure(state.owners[row], timestamp=self.engine.now)
+            self.failed_rows.append(row)
+            # with repaired clusters a failed peripheral has left its cluster, so its request is void
+            if self.cluster_manager is not None and self.charging_queue is not None:
+                self.charging_queue.remove(row)
+
+    def _count_cycle(self):
+        self.cycles += 1
+        if self.cycles == 15 * len(self.clusters):
+            self.simulation.record_charges_after_15_cycles()
+        if self.telemetry is not None:
+            self.telemetry.record(self.cycles, self.engine.now, self.travel_energy_used, self.transfer_energy_used,
+                                  self.charger.current_charge, self.plane.state.get_charges(self.peripheral_rows))
+        if self.statistics is not None:
+            state = self.plane.state
+            self.statistics.record(self.engine.now, self.travel_energy_used, self.transfer_energy_used,
+                                   state.get_charges(self.peripheral_rows), state.charge_capacity[self.peripheral_rows])
+
+    def _arrive_home(self, _):
+        # recharging takes one time unit per unit of charge
+        amount_needed_to_replenish = self.charger.charge_capacity - self.charger.current_charge
+        self.engine.schedule_after(amount_needed_to_replenish, EventEngine.CHARGE, amount_needed_to_replenish)
+
+    def _travel_to_next_cluster(self, cluster_position):
+        cluster = self.clusters[cluster_position]
+        # assume that it takes 1 point of energy per unit traveled
+        travel_energy_used_this_cycle, transfer_energy_used_this_cycle = self.charger.charge_cluster(cluster)
+
+        # log the amount of energy used
+        self.travel_energy_used += travel_energy_used_this_cycle
+        self.transfer_energy_used += transfer_energy_used_this_cycle
+        self.total_energy_used += transfer_energy_used_this_cycle + travel_energy_used_this_cycle
+
+        # the trip takes one time unit per unit of energy spent on it
+        trip_duration = max(travel_energy_used_this_cycle + transfer_energy_used_this_cycle, 0)
+        self.engine.schedule_after(trip_duration, EventEngine.ARRIVAL, cluster_position)
+
+    def _finish_charging_between_clusters(self, amount_needed_to_replenish):
+        # recharge the charger, decrement the amount of charge held by all devices
+        self._recharge_and_check_for_failures(amount_needed_to_replenish)
+        self._count_cycle()
+
+        # don't keep going if we are just debugging
+        if SingleChargerSim.DEBUG and self.cycles == 5 * len(self.clusters):
+            self.engine.stop()
+            return
+
+        # every peripheral has failed and been taken out of the clusters, there is nothing left to charge
+        if not self.clusters:
+            self.engine.stop()
+            return
+
+        # cycle through clusters one at a time, return home, charge, go on to the next cluster
+        self.engine.schedule_after(0, EventEngine.TRAVEL, self.cycles % len(self.clusters))
+
+    @profiler.timed('check_thresholds')
+    def _check_thresholds(self, _):
+        # go through the peripherals. If any are below the threshold, they are placed into a queue.
+        # all peripherals drain at the same rate, so the one whose row stores the least, i.e. the drain clock reading
+        # at which it runs empty, will run out first. unlike its charge that does not change while it waits
+        state = self.plane.state
+        for row in state.get_rows_below_threshold().tolist():
+            if row not in self.charging_queue:
+                self.charging_queue.push(row, float(state.stored_charge[row]), cluster_id=int(state.cluster_id[row]))
+
+        # Charge the cluster of the most urgent peripheral in the queue
+        if len(self.charging_queue) > 0:
+            next_in_line = self.charging_queue.pop()
+            self.engine.schedule_after(0, EventEngine.TRAVEL, int(state.cluster_id[next_in_line]))
+
+        # If no peripherals are below the threshold, we wait one time unit at a time (decrement all by 1) until one is.
+        # rather than checking after every time unit, skip straight to the first time unit at which one will be
+        else:
+            ticks = self._ticks_until_next_request()
+            state.drain_ticks(ticks)
+            self.engine.schedule_after(ticks, EventEngine.THRESHOLD)
+
+    def _ticks_until_next_request(self):
+        """
+        :return: how many idle time units pass before a peripheral drops to its threshold, cut short at the horizon
+        """
+        ticks = self.plane.state.get_ticks_until_below_threshold()
+        ticks_within_horizon = self.engine.ticks_within_horizon()
+        return ticks_within_horizon if ticks is None else min(ticks, ticks_within_horizon)
+
+    def _travel_to_requesting_cluster(self, cluster_id):
+        cluster_to_charge = self.plane.clusters_by_id[cluster_id]
+        # assume that it takes 1 point of energy per unit traveled
+        travel_energy_used_this_cycle, transfer_energy_used_this_cycle = self.charger.charge_cluster(cluster_to_charge)
+        # the trip takes one time unit per unit of energy spent on it
+        trip_duration = max(travel_energy_used_this_cycle + transfer_energy_used_this_cycle, 0)
+        self.engine.schedule_after(trip_duration, EventEngine.ARRIVAL,
+                                   (cluster_id, travel_energy_used_this_cycle, transfer_energy_used_this_cycle))
+
+    def _arrive_home_from_requesting_cluster(self, trip):
+        cluster_id, travel_energy_used_this_cycle, transfer_energy_used_this_cycle = trip
+
+        # remove all nodes in the cluster from the queue
+        self.charging_queue.remove_cluster(cluster_id)
+
+        # update energy usage for analytics
+        self.travel_energy_used += travel_energy_used_this_cycle
+        self.transfer_energy_used += transfer_energy_used_this_cycle
+        self.total_energy_used += (transfer_energy_used_this_cycle + travel_energy_used_this_cycle)
+
+        self._arrive_home(trip)
+
+    def _finish_charging_on_request(self, amount_needed_to_replenish):
+        # recharge the charger and decrement all peripherals
+        self._recharge_and_check_for_failures(amount_needed_to_replenish)
+        self._count_cycle()
+        self.engine.schedule_after(0, EventEngine.THRESHOLD)
+
+    def _register_handlers(self, with_communication):
+        """
+        point each kind of event at the handler for the strategy being run
+        """
+        if with_communication:
+            self.engine.on(EventEngine.THRESHOLD, self._check_thresholds)
+            self.engine.on(EventEngine.TRAVEL, self._travel_to_requesting_cluster)
+            self.engine.on(EventEngine.ARRIVAL, self._arrive_home_from_requesting_cluster)
+            self.engine.on(EventEngine.CHARGE, self._finish_charging_on_request)
+        else:
+            self.engine.on(EventEngine.TRAVEL, self._travel_to_next_cluster)
+            self.engine.on(EventEngine.ARRIVAL, self._arrive_home)
+            self.engine.on(EventEngine.CHARGE, self._finish_charging_between_clusters)
+
+    # go through each cluster one at a time, charging each node in the cluster, then return home
+    def single_charger_simulation(self, horizon=None):
+        """
+        :param horizon: the simulated time the run lasts, SIMULATED_HORIZON by default
         :return: The simulation object
         """
+        self._set_up_plane()
+        self.engine = EventEngine(horizon if horizon is not None else SingleChargerSim.SIMULATED_HORIZON)
+        self._register_handlers(with_communication=False)
+        self.engine.schedule(0, EventEngine.TRAVEL, 0)
 
-        # add a single charging station and charging node
-        charging_station = ChargingStation(SingleChargerSim.LOCATION_OF_CHARGING_STATION[0],
-                                           SingleChargerSim.LOCATION_OF_CHARGING_STATION[1], self.plane)
-        charger = ChargingNode(SingleChargerSim.LOCATION_OF_CHARGING_STATION[0],
-                               SingleChargerSim.LOCATION_OF_CHARGING_STATION[1] + 1, self.plane,
-                               charge_capacity=60, current_charge=60)
-
-        # add a series of peripherals at random locations
-        while self.plane.get_number_of_peripherals() < SingleChargerSim.NUMBER_OF_PERIPHERALS:
-            try:
-                capacity = randint(10, 30)
-                self.peripherals.append(Peripheral(randint(1, 20), randint(2, 20), self.plane, charge_capacity=capacity,
-                                                   current_charge=capacity))
-            # IndexError indicates that the location is occupied. Just allow and try again
-            except IndexError:
-                pass
+        return self._run(horizon)
 
-        # instantiate simulation object for analysis purposes
-        simulation = Simulation(self.peripherals)
+    def single_charger_simulation_with_communication(self, charge_percentage_threshold, horizon=None):
+        """
+        A variation of the single charger paradigm where peripherals are able to transmit signals to the charger
+        when they require more energy
 
-        # generate clusters
-        maximum_cluster_radius = 5
-        clusters = self.plane.generate_clusters(peripherals_list=self.peripherals,
-                                                max_distance_between_point_and_centroid=maximum_cluster_radius)
+        :param charge_percentage_threshold: some value between 0 and 100 at which the signal transmission is triggered
+        :param horizon: the simulated time the run lasts, SIMULATED_HORIZON by default
+        :return: The simulation object
+        """
+        self._set_up_plane()
+        self.engine = EventEngine(horizon if horizon is not None else SingleChargerSim.SIMULATED_HORIZON)
 
         # calculate the percentage threshold for each peripheral and assign it to the peripheral
         for peripheral in self.peripherals:
             peripheral.set_charge_threshold(charge_percentage_threshold)
 
         # instantiate the charging queue. It is initially empty but will be filled with any peripherals below threshold.
-        charging_queue = deque()
-
-        while self.running_sim:
-            # go through the peripherals. If any are below the threshold, they are placed into a queue.
-            for peripheral in self.peripherals:
-                if peripheral.current_charge <= peripheral.charge_threshold and peripheral not in charging_queue:
-                    charging_queue.append(peripheral)
-
-            # Charge next cluster in the queue and remove all corresponding peripherals from the queue
-            if len(charging_queue) > 0:
-                next_in_line = charging_queue.popleft()
-                cluster_to_charge = next_in_line.cluster
-
-                # assume that it takes 1 point of energy per unit traveled
-                travel_energy_used_this_cycle, transfer_energy_used_this_cycle = \
-                    charger.charge_cluster(cluster_to_charge)
-
-                # recharge the charger and decrement all peripherals
-                amount_needed_to_replenish = charger.charge_capacity - charger.current_charge
-                charger.charge_self()
-
-                # decrement energy of all peripherals while charging
-                for peripheral in self.peripherals:
-                    peripheral.current_charge -= (amount_needed_to_replenish *
-                                                  SingleChargerSim.PERIPHERAL_ENERGY_LOSS_MULTIPLIER)
-
-                    # check whether any peripherals are dead, one at a time
-                    if peripheral.current_charge <= 0:
-                        simulation.peripheral_failure(peripheral_list_index=self.peripherals.index(peripheral),
-                                                      timestamp=datetime.datetime.now())
-
-                # remove all nodes in the cluster from the queue
-                charging_queue = deque(peripheral for peripheral in charging_queue if peripheral not in
-                                       cluster_to_charge.peripheral_list)
-
-                # update energy usage for analytics
-                self.travel_energy_used += travel_energy_used_this_cycle
-                self.transfer_energy_used += transfer_energy_used_this_cycle
-                self.total_energy_used += (transfer_energy_used_this_cycle + travel_energy_used_this_cycle)
-
-                self.cycles += 1
-                if self.cycles == 15 * len(clusters):
-                    # shallow copy of the list at 15 minutes
-                    simulation.peripheral_list_after_15_cycles = self.peripherals[:]
-                    simulation.calculate_average_charge_at_15_cycles()
-
-            # If no peripherals are below the threshold, we wait one time unit (decrement all by 1)
-            else:
-                for peripheral in self.peripherals:
-                    peripheral.current_charge -= 1
-
-            # stop running the sim at 5 minutes
-            if datetime.datetime.now() - self.start_time >= datetime.timedelta(minutes=5):
-                self.running_sim = False
-                break
+        self.charging_queue = ChargingQueue()
 
-        # record energy used
-        simulation.total_energy_used = self.total_energy_used
-        simulation.transfer_energy_used = self.transfer_energy_used
-        simulation.travel_energy_used = self.travel_energy_used
+        self._register_handlers(with_communication=True)
+        self.engine.schedule(0, EventEngine.THRESHOLD)
 
-        return simulation
+        return self._run(horizon)
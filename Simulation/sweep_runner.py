@@ -0,0 +1,125 @@
+import itertools
+import json
+import os
+import time
+
+"""
+Monte Carlo sweeps over seeds, strategies, charge thresholds and cluster radii
+Every run is independent and seeded, so runs are farmed out to a process pool and their summaries are handed back
+as soon as each one finishes. Running the same configuration again gives the same summary.
+"""
+
+# strategy name: (module, class, method, whether the method takes a charge threshold)
+STRATEGIES = {
+    'single': ('Simulation.single_charger_simulation', 'SingleChargerSim', 'single_charger_simulation', False),
+    'single_with_communication': ('Simulation.single_charger_simulation', 'SingleChargerSim',
+                                  'single_charger_simulation_with_communication', True),
+    'multi': ('Simulation.multi_charger_simulation_experimental', 'MultiChargerSim',
+              'multi_charger_simulation_experimental', False),
+    'multi_with_communication': ('Simulation.multi_charger_simulation_experimental', 'MultiChargerSim',
+                                 'multi_charger_simulation_experimental_with_communication', True),
+    'multi_fleet': ('Simulation.multi_charger_simulation_experimental', 'MultiChargerSim',
+                    'multi_charger_simulation_fleet', False),
+}
+
+
+def build_sweep(seeds, strategies=None, charge_percentage_thresholds=(10,), cluster_radii=(5,), horizon=None,
+                series_points=None):
+    """
+    lay out every run in the grid seeds x strategies x thresholds x cluster radii
+    strategies without communication do not use a threshold, so they are only run once per seed and radius
+    :param seeds: the seeds to run, e.g. range(100)
+    :param strategies: names from STRATEGIES, all of them by default
+    :param charge_percentage_thresholds: thresholds to try for the communication strategies
+    :param cluster_radii: maximum cluster radii to try
+    :param horizon: simulated time each run lasts, the simulation's own default if None
+    :param series_points: downsample the charge and energy series of every run and hand them back with its summary,
+    read off at this many evenly spaced times. see Analytics.downsampling.TelemetryDownsampler.resample
+    :return: a list of run configurations
+    """
+    strategies = list(STRATEGIES) if strategies is None else list(strategies)
+    for strategy in strategies:
+        if strategy not in STRATEGIES:
+            raise KeyError('No strategy named {}. Available strategies: {}'.format(strategy, ', '.join(STRATEGIES)))
+
+    configurations = []
+    for strategy, cluster_radius, seed in itertools.product(strategies, cluster_radii, seeds):
+        thresholds = charge_percentage_thresholds if STRATEGIES[strategy][3] else (None,)
+        for threshold in thresholds:
+            configuration = {'strategy': strategy, 'seed': seed, 'charge_percentage_threshold': threshold,
+                             'cluster_radius': cluster_radius, 'horizon': horizon}
+            if series_points is not None:
+                configuration['series_points'] = series_points
+            configurations.append(configuration)
+    return configurations
+
+
+def run_configuration(configuration):
+    """
+    run one simulation from its configuration. this is what the worker processes call
+    :return: the configuration merged with the simulation summary and some run statistics, and under 'series' the
+    downsampled series if the configuration asks for them
+    """
+    import importlib
+    module_name, class_name, method_name, uses_threshold = STRATEGIES[configuration['strategy']]
+    sim_class = getattr(importlib.import_module(module_name), class_name)
+
+    telemetry = None
+    if configuration.get('series_points'):
+        from Analytics.downsampling import TelemetryDownsampler
+        telemetry = TelemetryDownsampler()
+
+    started = time.perf_counter()
+    sim = sim_class(seed=configuration['seed'], maximum_cluster_radius=configuration['cluster_radius'],
+                    telemetry=telemetry)
+    method = getattr(sim, method_name)
+    if uses_threshold:
+        simulation = method(configuration['charge_percentage_threshold'], horizon=configuration['horizon'])
+    else:
+        simulation = method(horizon=configuration['horizon'])
+
+    summary = dict(configuration)
+    summary.update(simulation.get_summary())
+    summary['cycles'] = sim.cycles
+    summary['simulated_time'] = sim.engine.now
+    summary['events_processed'] = sim.engine.events_processed
+    summary['wall_time'] = time.perf_counter() - started
+    summary['worker'] = os.getpid()
+    if telemetry is not None:
+        # a few hundred points a series, small enough to hand back from a worker process
+        summary['series'] = telemetry.resample(configuration['series_points'])
+    return summary
+
+
+def run_sweep(configurations, max_workers=None):
+    """
+    run every configuration across a pool of processes
+    :param configurations: run configurations, see build_sweep
+    :param max_workers: number of worker processes, one per core by default. 1 runs everything in this process
+    :return: a generator of run summaries, in the order the runs finish
+    """
+    if max_workers == 1:
+        for configuration in configurations:
+            yield run_configuration(configuration)
+        return
+
+    # only imported here, it is slow to import and most users of this module only need the strategy table
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run_configuration, configuration) for configuration in configurations]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def write_summaries(summaries, path):
+    """
+    stream run summaries to a JSON lines file as they arrive
+    :return: the number of summaries written
+    """
+    count = 0
+    with open(path, 'w') as f:
+        for summary in summaries:
+            f.write(json.dumps(summary) + '\n')
+            f.flush()
+            count += 1
+    return count
@@ -1,29 +1,195 @@
 #!/usr/bin/env python3
+import time
+
+STARTED = time.perf_counter()
+
+import argparse
+import json
+import sys
 
-from Services import requirements_service as rs
 from Services.format_service import pretty_print
-from Simulation.single_charger_simulation import SingleChargerSim
-from Simulation.multi_charger_simulation_experimental import MultiChargerSim
+from Simulation.sweep_runner import STRATEGIES
+
+"""
+Command line entry point of the simulator
+
+    ./simulation.py run single_with_communication --threshold 10
+    ./simulation.py compare --seed 3
+    ./simulation.py sweep --seeds 100 --output sweep.jsonl
+    ./simulation.py run single --horizon 1000000 --report run.html
+    ./simulation.py sweep --seeds 20 --report sweep.html
+
+Only the standard library and the strategy table are imported up front, the simulations are imported once a command
+needs them. Installed packages are checked against requirements.txt locally, without pip, and the result is cached.
+--startup-time reports how long the launch took before the command started, against STARTUP_BUDGET.
+--report writes the charge and energy series of a run, or of every group of runs in a sweep, to an HTML file with the
+charts drawn in. The series are downsampled as the runs go, so reports stay small however long the runs are.
+"""
+
+STARTUP_BUDGET = 0.05  # seconds from the first line of this file until the command starts
+DEFAULT_THRESHOLD = 10
+# run by compare when no strategies are given, in this order
+COMPARED_STRATEGIES = ('single_with_communication', 'multi_with_communication', 'single', 'multi')
+COMPARED_FIGURES = ('effective_energy_percentage', 'average_charge_at_15_cycles', 'peripheral_failure_count',
+                    'failed_peripheral_fraction', 'time_of_earliest_failure')
+
+
+def _run_strategy(strategy, threshold, horizon, seed, radius, scenario, statistics=False, telemetry=None):
+    """
+    :param statistics: keep streaming statistics of the run, with threshold as their charge threshold
+    :param telemetry: an optional telemetry recorder the simulation feeds every cycle
+    :return: the simulation class instance and the Simulation object of the run
+    """
+    import importlib
+    module_name, class_name, method_name, uses_threshold = STRATEGIES[strategy]
+    sim_class = getattr(importlib.import_module(module_name), class_name)
+    streaming_statistics = None
+    if statistics:
+        from Analytics.streaming_statistics import StreamingStatistics
+        streaming_statistics = StreamingStatistics(threshold_percentage=threshold)
+    sim = sim_class(seed=seed, maximum_cluster_radius=radius, scenario=scenario, statistics=streaming_statistics,
+                    telemetry=telemetry)
+    method = getattr(sim, method_name)
+    simulation = method(threshold, horizon=horizon) if uses_threshold else method(horizon=horizon)
+    return sim, simulation
+
+
+def run(args):
+    telemetry = None
+    if args.report:
+        from Analytics.downsampling import TelemetryDownsampler
+        telemetry = TelemetryDownsampler()
+    sim, simulation = _run_strategy(args.strategy, args.threshold, args.horizon, args.seed, args.radius,
+                                    args.scenario, statistics=args.statistics, telemetry=telemetry)
+    if args.report:
+        from Analytics.report_export import write_run_report
+        write_run_report(args.report, telemetry, summary=simulation.get_summary(),
+                         title='{} (seed {})'.format(args.strategy, sim.seed))
+        print('Report written to {}'.format(args.report), file=sys.stderr)
+    if args.json:
+        summary = simulation.get_summary()
+        summary.update({'strategy': args.strategy, 'seed': args.seed, 'cycles': sim.cycles,
+                        'simulated_time': sim.engine.now})
+        print(json.dumps(summary))
+    else:
+        simulation.run_analytics_on_simulation()
+    return 0
+
+
+def compare(args):
+    strategies = args.strategies or COMPARED_STRATEGIES
+    # every strategy gets the same layout, so without a seed one is picked for all of them
+    seed = args.seed if args.seed is not None else int(time.time())
+    print('{:<28} {:>10} '.format('strategy', 'cycles') + ' '.join('{:>16}'.format(figure[:16])
+                                                                     for figure in COMPARED_FIGURES))
+    for strategy in strategies:
+        sim, simulation = _run_strategy(strategy, args.threshold, args.horizon, seed, args.radius, args.scenario)
+        summary = simulation.get_summary()
+        figures = ['{:>16.4f}'.format(summary[figure]) if isinstance(summary[figure], float)
+                   else '{:>16}'.format(str(summary[figure])) for figure in COMPARED_FIGURES]
+        print('{:<28} {:>10} '.format(strategy, sim.cycles) + ' '.join(figures))
+    return 0
+
+
+def _fold_series(summaries, comparison):
+    # the series only go into the report, the summaries are written out without them
+    for summary in summaries:
+        comparison.add(summary)
+        del summary['series']
+        yield summary
+
+
+def sweep(args):
+    from Simulation import sweep_runner
+    comparison = None
+    if args.report:
+        from Analytics.report_export import SweepComparison, COMPARISON_POINTS
+        comparison = SweepComparison()
+    configurations = sweep_runner.build_sweep(range(args.first_seed, args.first_seed + args.seeds),
+                                              strategies=args.strategies,
+                                              charge_percentage_thresholds=args.thresholds,
+                                              cluster_radii=args.radii, horizon=args.horizon,
+                                              series_points=COMPARISON_POINTS if args.report else None)
+    started = time.perf_counter()
+    summaries = sweep_runner.run_sweep(configurations, max_workers=args.workers)
+    if comparison is not None:
+        summaries = _fold_series(summaries, comparison)
+    count = sweep_runner.write_summaries(summaries, args.output)
+    print('{} runs written to {} in {:.1f}s'.format(count, args.output, time.perf_counter() - started))
+    if comparison is not None:
+        comparison.write(args.report, title='Sweep of {} seeds'.format(args.seeds))
+        print('Report written to {}'.format(args.report))
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='FAU I-SENSE Mobile Charging Simulator.')
+    parser.add_argument('--skip-dependency-check', action='store_true',
+                        help='do not check the installed packages against requirements.txt')
+    parser.add_argument('--startup-time', action='store_true',
+                        help='report how long the launch took before the command started')
+    commands = parser.add_subparsers(dest='command')
+
+    def add_run_options(command_parser):
+        command_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                                    help='charge percentage at which devices ask to be charged, for the '
+                                         'communication strategies')
+        command_parser.add_argument('--horizon', type=float, help='simulated time the run lasts')
+        command_parser.add_argument('--radius', type=float, help='maximum cluster radius')
+        command_parser.add_argument('--scenario', help='scenario file to take the layout from')
+
+    run_parser = commands.add_parser('run', help='run a single strategy and print its analytics')
+    run_parser.add_argument('strategy', choices=sorted(STRATEGIES))
+    run_parser.add_argument('--seed', type=int)
+    run_parser.add_argument('--json', action='store_true', help='print the summary as JSON instead')
+    run_parser.add_argument('--statistics', action='store_true',
+                            help='keep streaming statistics of the charges and energy efficiency as the run goes')
+    run_parser.add_argument('--report', help='HTML file to write charts of the run to')
+    add_run_options(run_parser)
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser('compare', help='run several strategies on the same layout')
+    compare_parser.add_argument('--strategies', nargs='+', choices=sorted(STRATEGIES))
+    compare_parser.add_argument('--seed', type=int)
+    add_run_options(compare_parser)
+    compare_parser.set_defaults(handler=compare)
+
+    sweep_parser = commands.add_parser('sweep', help='run a Monte Carlo sweep across a process pool')
+    sweep_parser.add_argument('--seeds', type=int, default=10, help='number of seeds to run')
+    sweep_parser.add_argument('--first-seed', type=int, default=0)
+    sweep_parser.add_argument('--strategies', nargs='+', choices=sorted(STRATEGIES))
+    sweep_parser.add_argument('--thresholds', nargs='+', type=float, default=[DEFAULT_THRESHOLD])
+    sweep_parser.add_argument('--radii', nargs='+', type=float, default=[5])
+    sweep_parser.add_argument('--horizon', type=float)
+    sweep_parser.add_argument('--workers', type=int, help='worker processes, one per core by default')
+    sweep_parser.add_argument('--output', default='sweep.jsonl', help='JSON lines file to write the summaries to')
+    sweep_parser.add_argument('--report', help='HTML file to write charts comparing the strategies to')
+    sweep_parser.set_defaults(handler=sweep)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        # the simulator used to compare the strategies on every launch, keep that as the default
+        args = parser.parse_args((sys.argv[1:] if argv is None else list(argv)) + ['compare'])
+        pretty_print("Welcome to the FAU I-SENSE Mobile Charging Simulator.", 'blue')
+
+    if not args.skip_dependency_check:
+        from Services.requirements_service import check_requirements
+        for problem in check_requirements():
+            pretty_print('Requirement not met: {}. Install the packages in requirements.txt with pip.'.format(
+                problem), 'red', file=sys.stderr)
+
+    startup_time = time.perf_counter() - STARTED
+    if args.startup_time:
+        print('Startup took {:.1f}ms, the budget is {:.1f}ms.'.format(startup_time * 1000, STARTUP_BUDGET * 1000),
+              file=sys.stderr)
+        if startup_time > STARTUP_BUDGET:
+            pretty_print('Startup is over budget.', 'red', file=sys.stderr)
+    return args.handler(args)
+
 
 if __name__ == "__main__":
-    rs.run_requirement_check()
-    pretty_print("Welcome to the FAU I-SENSE Mobile Charging Simulator.", 'blue')
-
-    # we want to run both sims and record the following:
-    # 1. all types of energy used and amounts
-    # 2. the whole peripherals list should be returned after some number of cycles is completed
-    # 3. length of time the sim is able to continue. let's say that if it runs in a stable manner for 5 minutes,
-    # it works as intended.
-
-    print('single charge with comm:')
-    single_charge_with_communication = SingleChargerSim().single_charger_simulation_with_communication(10).\
-        run_analytics_on_simulation()
-    print('multi with comm:')
-    multi_with_communication = MultiChargerSim().multi_charger_simulation_experimental_with_communication(10).\
-        run_analytics_on_simulation()
-    print('single without:')
-    single_charger_simulation = SingleChargerSim().single_charger_simulation().run_analytics_on_simulation()
-    print('multi without:')
-    multi_charger_simulation = MultiChargerSim().multi_charger_simulation_experimental().run_analytics_on_simulation()
-
-    # TODO: next step will be visualization of this data and possibly hosting it on Heroku
+    sys.exit(main())
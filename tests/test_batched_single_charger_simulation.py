@@ -0,0 +1,28 @@
+import pytest
+
+from Simulation.batched_single_charger_simulation import BatchedSingleChargerSim
+from Simulation.single_charger_simulation import SingleChargerSim
+
+SEEDS = list(range(8))
+HORIZON = 30000
+THRESHOLD = 20
+
+
+@pytest.mark.parametrize('with_communication', [False, True])
+def test_replicas_match_single_runs_exactly(with_communication):
+    batched = BatchedSingleChargerSim(SEEDS)
+    if with_communication:
+        summaries = batched.single_charger_simulation_with_communication(THRESHOLD, horizon=HORIZON)
+    else:
+        summaries = batched.single_charger_simulation(horizon=HORIZON)
+
+    for seed, summary in zip(SEEDS, summaries):
+        sim = SingleChargerSim(seed=seed)
+        if with_communication:
+            expected = sim.single_charger_simulation_with_communication(THRESHOLD, horizon=HORIZON).get_summary()
+        else:
+            expected = sim.single_charger_simulation(horizon=HORIZON).get_summary()
+        for name, value in expected.items():
+            assert summary[name] == value, name
+        assert summary['cycles'] == sim.cycles
+        assert summary['simulated_time'] == sim.engine.now
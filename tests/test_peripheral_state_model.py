@@ -0,0 +1,261 @@
+import math
+
+import numpy as np
+import pytest
+
+from Models.peripheral_state_model import PeripheralState
+
+"""
+PeripheralState checked against a plain reference that keeps every charge as it is and takes every drain off every row
+Charges, capacities and drains are multiples of 1/4, so both sides compute them exactly and can be compared with ==
+"""
+
+QUARTER = 0.25
+
+
+class EagerState:
+    """
+    the reference: one charge per row, drained row by row, and a row is armed for depletion by any change to it
+    """
+
+    def __init__(self):
+        self.charges = []
+        self.capacities = []
+        self.thresholds = []
+        self.draining = []
+        self.armed = []
+
+    def add(self, charge_capacity, current_charge, draining):
+        self.charges.append(current_charge)
+        self.capacities.append(charge_capacity)
+        self.thresholds.append(math.nan)
+        self.draining.append(draining)
+        self.armed.append(True)
+
+    def drain(self, amount, exclude=None):
+        for row in range(len(self.charges)):
+            if self.draining[row] and row != exclude:
+                self.charges[row] -= amount
+        if exclude is not None and self.draining[exclude]:
+            self.armed[exclude] = True
+
+    def drain_ticks(self, ticks):
+        if ticks > 0:
+            self.drain(ticks)
+
+    def transfer(self, source_row, target_row, amount):
+        self.charges[source_row] -= amount
+        self.charges[target_row] += amount
+        self.armed[source_row] = self.armed[target_row] = True
+
+    def set_charge(self, row, charge):
+        self.charges[row] = charge
+        self.armed[row] = True
+
+    def set_charge_capacity(self, row, charge_capacity):
+        self.capacities[row] = charge_capacity
+        self.armed[row] = True
+
+    def set_draining(self, row, draining):
+        self.draining[row] = draining
+        self.armed[row] = True
+
+    def set_charge_threshold(self, percentage):
+        self.thresholds = [percentage / 100 * capacity for capacity in self.capacities]
+
+    def get_ticks_until_below_threshold(self, rows):
+        ticks = None
+        for row in rows:
+            charge = self.charges[row]
+            if not self.draining[row] or math.isnan(self.thresholds[row]):
+                continue
+            row_ticks = 1
+            while charge - row_ticks > self.thresholds[row]:
+                row_ticks += 1
+            ticks = row_ticks if ticks is None else min(ticks, row_ticks)
+        return ticks
+
+    def pop_depleted_rows(self):
+        depleted = [row for row, charge in enumerate(self.charges)
+                    if self.armed[row] and self.draining[row] and self.capacities[row] > 0 and charge <= 0]
+        for row in depleted:
+            self.armed[row] = False
+        return depleted
+
+
+def quarters(rng, low, high):
+    return int(rng.integers(low * 4, high * 4 + 1)) * QUARTER
+
+
+def make_states(rng, number_of_rows):
+    state = PeripheralState()
+    reference = EagerState()
+    for _ in range(number_of_rows):
+        charge_capacity = int(rng.integers(10, 31))
+        current_charge = quarters(rng, 0, charge_capacity)
+        draining = bool(rng.random() < 0.9)
+        state.add(None, 0, 0, charge_capacity=charge_capacity, current_charge=current_charge, draining=draining)
+        reference.add(charge_capacity, current_charge, draining)
+    return state, reference
+
+
+def check_charges(state, reference):
+    assert state.get_charges().tolist() == reference.charges
+    row = len(reference.charges) // 2
+    assert state.get_charge(row) == reference.charges[row]
+
+
+def random_operation(rng, state, reference):
+    number_of_rows = len(reference.charges)
+    row = int(rng.integers(number_of_rows))
+    operation = rng.random()
+    if operation < 0.3:
+        amount = quarters(rng, 0, 1)
+        state.drain(amount)
+        reference.drain(amount)
+    elif operation < 0.5:
+        # the row being charged is left out of the drain
+        amount = quarters(rng, 0, 1)
+        state.drain(amount, exclude=row)
+        reference.drain(amount, exclude=row)
+    elif operation < 0.6:
+        ticks = int(rng.integers(0, 3))
+        state.drain_ticks(ticks)
+        reference.drain_ticks(ticks)
+    elif operation < 0.75:
+        other_row = int(rng.integers(number_of_rows))
+        amount = quarters(rng, 0, 5)
+        state.transfer(row, other_row, amount)
+        reference.transfer(row, other_row, amount)
+    elif operation < 0.85:
+        charge = quarters(rng, 0, 30)
+        state.set_charge(row, charge)
+        reference.set_charge(row, charge)
+    elif operation < 0.93:
+        charge_capacity = int(rng.integers(0, 31))
+        state.set_charge_capacity(row, charge_capacity)
+        reference.set_charge_capacity(row, charge_capacity)
+    elif operation < 0.98:
+        draining = not reference.draining[row]
+        state.set_draining(row, draining)
+        reference.set_draining(row, draining)
+    else:
+        # rows added after the clock has moved start from the charge they are given
+        charge_capacity = int(rng.integers(10, 31))
+        state.add(None, 0, 0, charge_capacity=charge_capacity, current_charge=charge_capacity)
+        reference.add(charge_capacity, charge_capacity, True)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_charges_match_eager_draining(seed):
+    rng = np.random.default_rng(seed)
+    state, reference = make_states(rng, 50)
+    for _ in range(500):
+        random_operation(rng, state, reference)
+        check_charges(state, reference)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_ticks_until_below_threshold_match_eager_draining(seed):
+    rng = np.random.default_rng(seed)
+    state, reference = make_states(rng, 50)
+    percentage = int(rng.integers(5, 50))
+    crossings = 0
+    for step in range(300):
+        random_operation(rng, state, reference)
+        if step % 50 == 0:
+            # thresholds are fractions of the capacities, so they are not multiples of 1/4
+            state.set_charge_threshold(percentage, rows=slice(0, len(reference.charges)))
+            reference.set_charge_threshold(percentage)
+        # the draining rows not yet at their threshold, the others would cross it straight away
+        below_threshold = set(state.get_rows_below_threshold().tolist())
+        rows = [row for row in state.get_draining_rows().tolist() if row not in below_threshold]
+        ticks = state.get_ticks_until_below_threshold(rows)
+        assert ticks == reference.get_ticks_until_below_threshold(rows)
+        if ticks is not None:
+            # after that many ticks one of the rows is at or below its threshold, one tick earlier none was
+            state.drain_ticks(ticks - 1)
+            reference.drain_ticks(ticks - 1)
+            assert len(state.get_rows_below_threshold(rows)) == 0
+            state.drain_ticks(1)
+            reference.drain_ticks(1)
+            assert len(state.get_rows_below_threshold(rows)) > 0
+            check_charges(state, reference)
+            crossings += 1
+    assert crossings > 0
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_ticks_until_below_threshold_after_inexact_drains(seed):
+    # drains like the simulations make, which leave the clock and the charges off the grid of whole ticks
+    rng = np.random.default_rng(seed)
+    state = PeripheralState()
+    for _ in range(50):
+        charge_capacity = float(rng.uniform(10, 30))
+        state.add(None, 0, 0, charge_capacity=charge_capacity, current_charge=charge_capacity)
+    state.set_charge_threshold(float(rng.uniform(5, 50)))
+    for _ in range(1000):
+        state.drain(float(rng.random()) * 0.3, exclude=int(rng.integers(50)))
+        row = int(rng.integers(50))
+        if state.get_charge(row) <= state.charge_threshold[row]:
+            # a whole number of ticks above the threshold is where rounding decides which tick crosses it
+            state.set_charge(row, state.charge_threshold[row] + int(rng.integers(1, 5)))
+        below_threshold = set(state.get_rows_below_threshold().tolist())
+        rows = [row for row in range(50) if row not in below_threshold]
+        ticks = state.get_ticks_until_below_threshold(rows)
+        if ticks is None:
+            continue
+        clock = state.drain_clock
+        state.drain_ticks(ticks - 1)
+        assert len(state.get_rows_below_threshold(rows)) == 0
+        state.drain_ticks(1)
+        assert len(state.get_rows_below_threshold(rows)) > 0
+        # put the clock back rather than let every row run down
+        state.drain_clock = clock
+
+
+def test_ticks_until_below_threshold_rounded_up():
+    # found by search: ceil(charge - threshold) is 5 here, but the row is read as at its threshold after 4 ticks
+    state = PeripheralState()
+    row = state.add(None, 0, 0, charge_capacity=50)
+    state.drain(28.576491536488046)
+    state.charge_threshold[row] = 3.2186939107594217
+    state.stored_charge[row] = 35.79518544724747
+    assert state.get_ticks_until_below_threshold() == 4
+    state.drain_ticks(4)
+    assert state.get_rows_below_threshold().tolist() == [row]
+
+
+@pytest.mark.parametrize('heap_size', [4, PeripheralState.DEPLETION_HEAP_SIZE])
+@pytest.mark.parametrize('seed', range(3))
+def test_depleted_rows_match_eager_draining(monkeypatch, heap_size, seed):
+    # more rows than the heap holds at a time, so it is refilled from the rows further away
+    number_of_rows = 3 * PeripheralState.DEPLETION_HEAP_SIZE
+    monkeypatch.setattr(PeripheralState, 'DEPLETION_HEAP_SIZE', heap_size)
+    rng = np.random.default_rng(seed)
+    state, reference = make_states(rng, number_of_rows)
+    depleted_rows = 0
+    for step in range(1500):
+        random_operation(rng, state, reference)
+        if step % 3 == 0:
+            depleted = state.pop_depleted_rows()
+            assert depleted == reference.pop_depleted_rows()
+            depleted_rows += len(depleted)
+    check_charges(state, reference)
+    # the run has to have drained rows past the heap for the comparison to mean anything
+    assert depleted_rows > heap_size
+
+
+def test_failed_rows_match_depleted_rows():
+    rng = np.random.default_rng(0)
+    state, reference = make_states(rng, 100)
+    for _ in range(200):
+        state.drain(QUARTER)
+        reference.drain(QUARTER)
+    failed = state.get_failed_rows().tolist()
+    assert failed == [row for row, charge in enumerate(reference.charges) if reference.draining[row] and charge <= 0]
+    assert state.pop_depleted_rows() == reference.pop_depleted_rows()
+    # a row is only handed back once until it is changed again
+    assert state.pop_depleted_rows() == []
+    state.set_charge(failed[0], 0)
+    assert state.pop_depleted_rows() == [failed[0]]
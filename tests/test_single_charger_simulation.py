@@ -0,0 +1,41 @@
+import os
+
+from Services.scenario_service import write_scenario
+from Simulation.event_engine import EventEngine
+from Simulation.single_charger_simulation import SingleChargerSim
+
+
+def make_sim(tmp_path):
+    # three peripherals far enough apart to be in clusters of their own
+    path = write_scenario(os.path.join(str(tmp_path), 'layout.scn'), 20, 20, [2, 10, 18], [2, 10, 18], [20, 20, 20])
+    sim = SingleChargerSim(seed=0, scenario=path)
+    # a horizon before the first event sets the run up without processing anything
+    sim.single_charger_simulation_with_communication(50, horizon=-1)
+    return sim
+
+
+def next_cluster_served(sim):
+    sim.engine.queue = []
+    sim._check_thresholds(None)
+    (_, _, kind, cluster_id), = sim.engine.queue
+    assert kind == EventEngine.TRAVEL
+    return cluster_id
+
+
+def test_requests_are_served_by_when_they_run_empty(tmp_path):
+    sim = make_sim(tmp_path)
+    first, second, third = sim.peripherals
+    first.current_charge = 5
+    third.current_charge = 4
+    # both ask, the emptier one is served and the other keeps waiting
+    assert next_cluster_served(sim) == third.cluster.get_id()
+    third.current_charge = 20
+
+    # the waiting peripheral drains down to 1 while another asks with 2 left
+    sim.plane.drain_peripherals(4)
+    second.current_charge = 2
+    assert first.current_charge == 1
+    # the one that asked first, with more charge at the time, runs out first
+    assert next_cluster_served(sim) == first.cluster.get_id()
+    first.current_charge = 20
+    assert next_cluster_served(sim) == second.cluster.get_id()
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from Analytics.streaming_statistics import StreamingStatistics
+from Simulation.multi_charger_simulation_experimental import MultiChargerSim
+
+
+def make_run(rng, number_of_devices=30):
+    capacities = rng.uniform(10, 50, number_of_devices)
+    # failed devices have no capacity left
+    capacities[:3] = 0
+    return rng.uniform(0, 1, number_of_devices) * capacities, capacities
+
+
+def check_same_statistics(statistics, expected):
+    assert len(statistics) == len(expected)
+    assert statistics.last_time == pytest.approx(expected.last_time)
+    summary = statistics.get_summary()
+    for name, value in expected.get_summary().items():
+        assert summary[name] == pytest.approx(value), name
+    assert statistics.get_time_below_threshold() == pytest.approx(expected.get_time_below_threshold())
+    assert statistics.charge_sketch.counts == pytest.approx(expected.charge_sketch.counts)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_idle_stretch_matches_stepping_through_it(seed):
+    rng = np.random.default_rng(seed)
+    charges, capacities = make_run(rng)
+    # a window short enough to fill up and to lose records in the middle of the stretch
+    fast_forwarded = StreamingStatistics(threshold_percentage=20, window=int(rng.integers(5, 40)))
+    stepped = StreamingStatistics(threshold_percentage=20, window=fast_forwarded.window)
+    time, travel_energy_used, transfer_energy_used = 0, 0, 0
+    for _ in range(3):
+        time += rng.uniform(0, 10)
+        travel_energy_used += rng.uniform(0, 5)
+        transfer_energy_used += rng.uniform(0, 5)
+        charges = charges - rng.uniform(0, 3)
+        for statistics in (fast_forwarded, stepped):
+            statistics.record(time, travel_energy_used, transfer_energy_used, charges, capacities)
+
+        # long enough for devices to drop below the threshold and run empty on the way
+        ticks = int(rng.integers(1, 60))
+        fast_forwarded.record(time, travel_energy_used, transfer_energy_used, charges - ticks, capacities,
+                              ticks=ticks)
+        for tick in range(ticks):
+            stepped.record(time + tick, travel_energy_used, transfer_energy_used, charges - tick - 1, capacities)
+        time += ticks - 1
+        charges = charges - ticks
+        check_same_statistics(fast_forwarded, stepped)
+
+
+def test_long_idle_stretch_is_unrolled_in_parts(monkeypatch):
+    monkeypatch.setattr('Analytics.streaming_statistics.IDLE_VALUES', 64)
+    rng = np.random.default_rng(0)
+    charges, capacities = make_run(rng)
+    fast_forwarded = StreamingStatistics(threshold_percentage=20, window=50)
+    stepped = StreamingStatistics(threshold_percentage=20, window=50)
+    fast_forwarded.record(3, 10, 5, charges - 100, capacities, ticks=100)
+    for tick in range(100):
+        stepped.record(3 + tick, 10, 5, charges - tick - 1, capacities)
+    check_same_statistics(fast_forwarded, stepped)
+
+
+def test_records_are_weighted_by_elapsed_time():
+    statistics = StreamingStatistics(threshold_percentage=20)
+    statistics.record(1, 0, 0, [10], [100])
+    statistics.record(4, 0, 0, [40], [100])
+    # 10% for one time unit, then 40% for three
+    assert statistics.get_summary()['mean_charge_percentage'] == pytest.approx(32.5)
+    assert statistics.get_time_below_threshold().tolist() == [1]
+
+
+@pytest.mark.parametrize('seed', range(2))
+def test_fast_forwarded_run_matches_run_stepped_cycle_by_cycle(seed):
+    def run(step):
+        sim = MultiChargerSim(seed=seed, statistics=StreamingStatistics(window=500))
+        if step:
+            ticks_until_next_request = sim._ticks_until_next_request
+            sim._ticks_until_next_request = lambda: min(ticks_until_next_request(), 1)
+        sim.multi_charger_simulation_experimental_with_communication(20, horizon=10000)
+        return sim
+
+    fast_forwarded, stepped = run(False), run(True)
+    assert fast_forwarded.cycles == stepped.cycles
+    check_same_statistics(fast_forwarded.statistics, stepped.statistics)